@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import threading
+
+DEFAULT_CACHE_SIZE = 100000
+
+
+class LRUCache:
+    """
+    Bounded least-recently-used cache with hit/miss counters. Safe to share between threads.
+    """
+    def __init__(self, maxsize=DEFAULT_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached value for key, calling compute() and caching its result on a miss.
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        return {'size': len(self._items), 'maxsize': self.maxsize, 'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+
+_MISSING = object()
+
+
+def freeze(obj):
+    """
+    Turns a json-like object into a hashable cache key. Non-string scalars keep their type, so 1, 1.0 and True,
+        which json.dumps tells apart, do not share a key.
+    """
+    if isinstance(obj, str):
+        return obj
+    if isinstance(obj, dict):
+        return ('dict', tuple(sorted((k, freeze(v)) for k, v in obj.items())))
+    if isinstance(obj, (list, tuple)):
+        return ('list', tuple(freeze(v) for v in obj))
+    return (type(obj).__name__, obj)
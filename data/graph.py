@@ -0,0 +1,118 @@
+import networkx as nx
+
+
+class CycleError(ValueError):
+    pass
+
+
+class ServiceGraphIndex:
+    """
+    The service graph, with the ancestors, descendants and topological level of every service kept up to date as
+        services are added, so graph queries made per request are dictionary lookups.
+
+    Changing the inputs of a service only changes the ancestors and levels of the service and its descendants, and the
+        descendants of its old and new ancestors, so only those are recomputed.
+    """
+    def __init__(self):
+        self.graph = nx.DiGraph()
+        self.ancestors = {}
+        self.descendants = {}
+        self.levels = {}
+        # Levels of the ancestors of a target service, dropped when the target's ancestry changes.
+        self.predecessor_levels = {}
+
+    def set_service(self, name, service_description):
+        """
+        Adds or replaces a service and its input edges.
+
+        Raises CycleError, leaving the graph unchanged, if an input is the service itself or one of its descendants.
+        """
+        inputs = list(service_description['inputs'].keys())
+        self.check_inputs(name, inputs)
+        for node in [name] + inputs:
+            self._add_node(node)
+        self.graph.nodes[name].update(service_description)
+
+        old_ancestors = self.ancestors[name]
+        for i in list(self.graph.predecessors(name)):
+            if i not in service_description['inputs']:
+                self.graph.remove_edge(i, name)
+        for i in inputs:
+            self.graph.add_edge(i, name)
+
+        downstream = self.descendants[name] | {name}
+        for node in nx.topological_sort(self.graph.subgraph(downstream)):
+            ancestors = set()
+            level = 0
+            for p in self.graph.predecessors(node):
+                ancestors.add(p)
+                ancestors |= self.ancestors[p]
+                level = max(level, self.levels[p] + 1)
+            self.ancestors[node] = ancestors
+            self.levels[node] = level
+
+        upstream = old_ancestors | self.ancestors[name]
+        for node in reversed(list(nx.topological_sort(self.graph.subgraph(upstream)))):
+            descendants = set()
+            for s in self.graph.successors(node):
+                descendants.add(s)
+                descendants |= self.descendants[s]
+            self.descendants[node] = descendants
+
+        for target in downstream:
+            self.predecessor_levels.pop(target, None)
+
+    def check_inputs(self, name, inputs):
+        for i in inputs:
+            if i == name or i in self.descendants.get(name, ()):
+                raise CycleError("Input {} of service {} depends on {}".format(i, name, name))
+
+    def _add_node(self, name):
+        if name not in self.ancestors:
+            self.graph.add_node(name)
+            self.ancestors[name] = set()
+            self.descendants[name] = set()
+            self.levels[name] = 0
+
+    def get_predecessor_levels(self, target):
+        """
+        The target and its ancestors by topological level, so every service comes after all of its inputs and appears
+            at one level only. The result is shared and must not be modified.
+
+        :rtype: Dictionary of {level: set of services}
+        """
+        preds = self.predecessor_levels.get(target)
+        if preds is None:
+            preds = {}
+            for service in self.ancestors[target] | {target}:
+                preds.setdefault(self.levels[service], set()).add(service)
+            self.predecessor_levels[target] = preds
+        return preds
+
+
+def build_predecessor_levels(graph, source):
+    """
+    Traverses the graph and returns a dictionary of each level of the graph,
+        starting from the source node and working its way up along predecessors.
+    """
+    level = 0
+    predecessors = {}
+    done = False
+    currentLevel = set([source])
+    nextLevel = set()
+
+    # TODO This isn't perfect, as it won't do secondary chains that are shorter before we reach their level. But that's okay.
+    while not done:
+        predecessors[level] = currentLevel
+        level += 1
+        for current in currentLevel:
+            for p in graph.predecessors(current):
+                nextLevel.add(p)
+        if len(nextLevel) == 0:
+            done = True
+        currentLevel = nextLevel
+        nextLevel = set()
+    reversed_predecessors = {}
+    for k, v in predecessors.items():
+        reversed_predecessors[level-1-k] = v
+    return reversed_predecessors
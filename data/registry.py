@@ -1,8 +1,17 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne, ReturnDocument
+from pymongo.errors import PyMongoError
 from botocore.exceptions import ClientError
 import json
-import networkx as nx
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from .utils import *
+from .cache import LRUCache, DEFAULT_CACHE_SIZE
+from .graph import ServiceGraphIndex, CycleError
+
+logger = logging.getLogger(__name__)
 
 """
 Input - A piece of data that the hypervisor knows how to compute and is the output of another service. This is optionally specified only if the user want's to override the default value for the given parameters.
@@ -10,9 +19,16 @@ Parameter - A required piece of information, such as the location of the (most)
 
 """
 
+# Runtime samples of a service are kept in the data registry under this prefix and the service name.
+RUNTIME_PREFIX = '__runtime__/'
+
 class Registry:
+    """
+    graph_lock is held while the service graph is changed, and by readers that need it to stay the same across several
+        lookups. It is reentrant, so a reader can call the graph lookups below while holding it.
+    """
     def __init__(self, client):
-        pass
+        self.graph_lock = threading.RLock()
 
     def put_service(self, service_description):
         pass
@@ -26,83 +42,318 @@ class Registry:
     def get_data(self, data_description):
         pass
 
+    def get_data_many(self, data_ids):
+        """
+        Batched get_data. Registries that can fetch many items per round trip override this.
+
+        :rtype: dictionary of {"dataId": data_description} for the dataIds that exist.
+        """
+        found = {}
+        for data_id in data_ids:
+            item = self.get_data(data_id)
+            if item is not None:
+                found[data_id] = item
+        return found
+
+    def put_data_many(self, data_descriptions):
+        """
+        Batched put_data. Registries that can write many items per round trip override this.
+        """
+        succeeded = True
+        for data_description in data_descriptions:
+            succeeded = self.put_data(data_description) and succeeded
+        return succeeded
+
+    def refresh_service_graph(self):
+        """
+        Applies service registrations made by other processes to the local service graph.
+
+        :rtype: True if the graph changed.
+        """
+        return False
+
+    def put_runtime_samples(self, service_name, samples):
+        """
+        Stores the runtime samples of a service, [milliseconds, parameters] each, as one item among the data descriptions.
+        """
+        return self.put_data({'dataId': RUNTIME_PREFIX + service_name, 'service_name': service_name, 'samples': samples})
+
+    def get_runtime_samples(self, service_names):
+        """
+        :rtype: Dictionary of {service_name: samples} for the services that have stored samples.
+        """
+        found = self.get_data_many([RUNTIME_PREFIX + s for s in service_names])
+        return {item['service_name']: item['samples'] for item in found.values()}
+
+    def _reset_service_graph(self):
+        self.graph_index = ServiceGraphIndex()
+        self.service_graph = self.graph_index.graph
+
+    def get_ancestors_and_self(self, service_name):
+        """
+        Self included.
+        """
+        with self.graph_lock:
+            return self.graph_index.ancestors.get(service_name, set()) | {service_name}
+
+    def get_descendants_and_self(self, service_name):
+        """
+        Self included.
+        """
+        with self.graph_lock:
+            return self.graph_index.descendants.get(service_name, set()) | {service_name}
+
+    def get_topological_level(self, service_name):
+        """
+        Length of the longest chain of inputs leading to the service, 0 for services without inputs.
+        """
+        with self.graph_lock:
+            return self.graph_index.levels[service_name]
+
+    def get_predecessor_levels(self, service_name):
+        with self.graph_lock:
+            return self.graph_index.get_predecessor_levels(service_name)
+
+    def _add_service_to_graph(self, service_description):
+        name = service_description['service_name']
+        # A re-registered service replaces its inputs.
+        try:
+            with self.graph_lock:
+                self.graph_index.set_service(name, service_description)
+        except CycleError as e:
+            # Only possible for services registered concurrently by other workers.
+            logger.error("Ignoring service %s: %s", name, e)
+            return
+        logger.debug("* Added node to the graph %s %s ", name, service_description)
+        for i in service_description['inputs'].keys():
+            logger.debug("**** Added edge to the graph %s -> %s ", i, name)
+
+    def _print_graph(self):
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug("********************* Nodes **************************")
+        logger.debug("%s", self.service_graph.nodes)
+        logger.debug("********************* Edges **************************")
+        logger.debug("%s", self.service_graph.edges)
+        logger.debug("******************************************************")
+
+    def make_data_id(self, service_name, dataHash):
+        return service_name +  "/" + dataHash
+
+
+    def build_data_description_from_task(self, service_name, input_hashes, output_hash, parameters, s3_bucket='climate-ensembling'):
+        """
+        The output hash is the task set hash of the whole lineage, so it already determines the inputs and parameters.
+            Descriptions are cached on it and shared between callers, so they must not be modified in place.
+        """
+        key = (service_name, output_hash, s3_bucket)
+        data_description = self.description_cache.get(key)
+        if data_description is None:
+            data_description = self._build_data_description(service_name, input_hashes, output_hash, parameters, s3_bucket)
+            self.description_cache.put(key, data_description)
+        return data_description
+
+    def _build_data_description(self, service_name, input_hashes, output_hash, parameters, s3_bucket):
+        output_locations = {'output1': self.build_s3_location(output_hash, s3_bucket, service_name)}
+
+        input_locations = {}
+        if len(input_hashes) > 0:
+            for input_name, hash in input_hashes.items():
+                input_locations[input_name] = self.build_s3_location(hash, s3_bucket, input_name)
+
+        data_description = {'dataId': self.make_data_id(service_name, output_hash),
+                 'service_name': service_name, 
+                 'inputs': input_locations,
+                 'outputs': output_locations,
+                 'parameters': parameters
+        }
+
+        return data_description
+
+        
+    def build_s3_location(self, hash, s3_bucket, service_name):
+        return "s3://" + s3_bucket + "/" + service_name + "/" + hash
+
 REGION = "eu-west-1"
 DATA_REGISTRY_NAME = 'climate-data-index'
 SERVICES_REGISTRY_NAME = 'climate-services-index'
 READ_CAPACITY = 5
 WRITE_CAPACITY = 5
+# BatchGetItem reads at most 100 keys per call; keys DynamoDB leaves unprocessed are retried with exponential backoff.
+BATCH_GET_SIZE = 100
+BATCH_RETRIES = 5
+BATCH_BACKOFF = 0.05
+# The services table also holds a version counter bumped on every registration, and one change record per version
+# naming the service it registered, so workers can catch up on new registrations without scanning the table.
+GRAPH_VERSION_KEY = '__graph_version__'
+GRAPH_CHANGE_PREFIX = '__graph_change__/'
+SCAN_SEGMENTS = 4
 
 class DynamoDBRegistry(Registry):
-    def __init__(self, client):
+    def __init__(self, client, cache_size=DEFAULT_CACHE_SIZE, snapshot_path=None, scan_segments=SCAN_SEGMENTS):
         self.client = client
         self.data_index_table = self.client.Table(DATA_REGISTRY_NAME)
         self.services_index_table = self.client.Table(SERVICES_REGISTRY_NAME)
+        self.description_cache = LRUCache(cache_size)
+        self.snapshot_path = snapshot_path
+        self.scan_segments = scan_segments
+        self.graph_lock = threading.RLock()
 
         self._initialize_service_graph()
 
     def _initialize_service_graph(self):
-        print("Initializing service graph from service registry....")
-        self.service_graph = nx.DiGraph()
-
-        #### TODO - read in from services table and add everything as nodes.
-
-    def get_ancestors_and_self(self, service_name):
         """
-        Self included.
+        Warm starts from the local snapshot when it is current, or can be brought up to date from the change records.
+            Otherwise the graph is rebuilt from a parallel scan of the services table and a fresh snapshot is written.
         """
-        ancestors = nx.ancestors(self.service_graph, service_name)
-        ancestors.add(service_name)
-        return ancestors
-        
-        ancestors = set()
-        for p in self.service_graph.predecessors(service_name):
-            ancestors.add(p)
-            ancestors = ancestors | self.get_ancestors_and_self(p)
-        ancestors.add(service_name)
-        return ancestors
-
-    def get_descendants_and_self(self, service_name):
+        logger.info("Initializing service graph from service registry....")
+        self._reset_service_graph()
+        self.graph_version = 0
+
+        version = self.read_graph_version()
+        if self.snapshot_path is not None and self.load_graph_snapshot(self.snapshot_path):
+            if self.graph_version == version:
+                return
+            if self.graph_version < version and self.refresh_service_graph():
+                return
+
+        self._reset_service_graph()
+        for service_description in self._scan_services():
+            self._add_service_to_graph(service_description)
+        self.graph_version = version
+        logger.info("Loaded %s services at graph version %s", self.service_graph.number_of_nodes(), version)
+        if self.snapshot_path is not None:
+            self.save_graph_snapshot(self.snapshot_path)
+
+    def _scan_services(self):
+        with ThreadPoolExecutor(max_workers=self.scan_segments) as executor:
+            segments = executor.map(self._scan_services_segment, range(self.scan_segments))
+            return [service_description for segment in segments for service_description in segment]
+
+    def _scan_services_segment(self, segment):
+        # Table resources are not thread safe, so each segment uses its own.
+        table = self.client.Table(SERVICES_REGISTRY_NAME)
+        scan_kwargs = {'Segment': segment, 'TotalSegments': self.scan_segments}
+        services = []
+        while True:
+            response = table.scan(**scan_kwargs)
+            for item in response.get('Items', []):
+                if not self._is_graph_metadata(item['service_name']):
+                    services.append(item)
+            if 'LastEvaluatedKey' not in response:
+                return services
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _is_graph_metadata(self, service_name):
+        return service_name == GRAPH_VERSION_KEY or service_name.startswith(GRAPH_CHANGE_PREFIX)
+
+    def read_graph_version(self):
+        try:
+            response = self.services_index_table.get_item(Key={'service_name': GRAPH_VERSION_KEY}, ConsistentRead=True)
+        except ClientError as e:
+            logger.error("%s", e.response['Error']['Message'])
+            return 0
+        return int(response.get('Item', {}).get('graph_version', 0))
+
+    def _bump_graph_version(self, service_name):
+        response = self.services_index_table.update_item(
+            Key={'service_name': GRAPH_VERSION_KEY},
+            UpdateExpression='ADD graph_version :one',
+            ExpressionAttributeValues={':one': 1},
+            ReturnValues='UPDATED_NEW')
+        version = int(response['Attributes']['graph_version'])
+        self.services_index_table.put_item(Item={'service_name': GRAPH_CHANGE_PREFIX + str(version), 'changed_service': service_name})
+        return version
+
+    def refresh_service_graph(self):
         """
-        Self included.
+        Reads the version stamp and, if other workers registered services since, fetches only the change records and
+            services in between. Falls back to a full rescan when a change record is missing.
         """
-        descendants = []
-        for s in self.service_graph.sucessors(service_name):
-            descendants.append(s)
-            descendants = descendants + self.get_descendants(p)
-        descendants.add(service_name)
-        return set(descendants)
+        version = self.read_graph_version()
+        if version <= self.graph_version:
+            return False
+
+        change_keys = [GRAPH_CHANGE_PREFIX + str(v) for v in range(self.graph_version + 1, version + 1)]
+        changes = self._batch_get(SERVICES_REGISTRY_NAME, 'service_name', change_keys)
+        rescan = len(changes) < len(change_keys)
+        if rescan:
+            logger.warning("Missing graph change records, rescanning the service registry.")
+            services = self._scan_services()
+        else:
+            changed_services = set(change['changed_service'] for change in changes.values())
+            services = self._batch_get(SERVICES_REGISTRY_NAME, 'service_name', changed_services).values()
+        # The registry is read without the lock, another thread may have applied the same changes since.
+        with self.graph_lock:
+            if version <= self.graph_version:
+                return False
+            if rescan:
+                self._reset_service_graph()
+            for service_description in services:
+                self._add_service_to_graph(service_description)
+            self.graph_version = version
+            if self.snapshot_path is not None:
+                self.save_graph_snapshot(self.snapshot_path)
+        return True
+
+    def save_graph_snapshot(self, path):
+        services = [data for _, data in self.service_graph.nodes(data=True) if 'service_name' in data]
+        snapshot = {'graph_version': self.graph_version, 'services': services}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(snapshot, f, default=json_default)
+        os.replace(tmp_path, path)
+
+    def load_graph_snapshot(self, path):
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+        except ValueError as e:
+            logger.warning("Ignoring unreadable graph snapshot %s: %s", path, e)
+            return False
+        for service_description in snapshot['services']:
+            self._add_service_to_graph(service_description)
+        self.graph_version = snapshot['graph_version']
+        return True
 
     def put_service(self, service_description):
         name = service_description['service_name']
+        try:
+            with self.graph_lock:
+                self.graph_index.check_inputs(name, service_description['inputs'].keys())
+        except CycleError as e:
+            logger.error("Rejected service %s: %s", name, e)
+            return False
         try:
             self.services_index_table.put_item(Item=service_description)
-            print(f'resource, specify none      : write succeeded.')
+            logger.debug('resource, specify none      : write succeeded.')
         except Exception as e:
-            print(f'resource, specify none      : write failed: {e}')
+            logger.error('resource, specify none      : write failed: %s', e)
             return False
-        self.service_graph.add_nodes_from([(name, service_description)])
-        print("* Added node to the graph {} {} ".format(name, service_description))
-        for i in service_description['inputs'].keys():
-            self.service_graph.add_edge(i, name)
-            print("**** Added edge to the graph {} -> {} ".format(i, name))
-        
-        self._print_graph()
-        return True
+        try:
+            version = self._bump_graph_version(name)
+        except Exception as e:
+            logger.warning('Graph version update failed, other workers will not see %s until they rescan: %s', name, e)
+            version = None
 
-    def _print_graph(self):
-        print("\n********************* Nodes **************************")
-        print(self.service_graph.nodes)
-        print("********************* Edges **************************")
-        print(self.service_graph.edges)
-        print("******************************************************\n")
+        with self.graph_lock:
+            self._add_service_to_graph(service_description)
+            if version == self.graph_version + 1:
+                self.graph_version = version
+            if self.snapshot_path is not None:
+                self.save_graph_snapshot(self.snapshot_path)
 
+        self._print_graph()
+        return True
 
     def get_service(self, service_name, parameters):
         # print("Get Service {} {}".format(service_name, parameters))
         try:
             response = self.services_index_table.get_item(Key={'service_name': service_name})
         except ClientError as e:
-            print(e.response['Error']['Message'])
+            logger.error("%s", e.response['Error']['Message'])
         else:
             # print("Service Response: {}".format(response))
             if 'Item' in response:
@@ -113,9 +364,10 @@ class DynamoDBRegistry(Registry):
     def put_data(self, data_description):
         try:
             self.data_index_table.put_item(Item=data_description)
-            print(f'resource, specify none      : write succeeded.')
+            logger.debug('resource, specify none      : write succeeded.')
         except Exception as e:
-            print(f'resource, specify none      : write failed: {e}')
+            logger.error('resource, specify none      : write failed: %s', e)
+            return False
         return True
 
 
@@ -123,7 +375,7 @@ class DynamoDBRegistry(Registry):
         try:
             response = self.data_index_table.get_item(Key={'dataId': dataId})
         except ClientError as e:
-            print(e.response['Error']['Message'])
+            logger.error("%s", e.response['Error']['Message'])
         else:
             # print("Data Response: {}".format(response))
             if 'Item' in response:
@@ -132,50 +384,192 @@ class DynamoDBRegistry(Registry):
                 return None
 
 
-    def make_data_id(self, service_name, dataHash):
-        return service_name +  "/" + dataHash
-
+    def get_data_many(self, data_ids):
+        return self._batch_get(DATA_REGISTRY_NAME, 'dataId', data_ids)
+
+    def _batch_get(self, table_name, key_name, keys):
+        found = {}
+        for chunk in chunked(list(dict.fromkeys(keys)), BATCH_GET_SIZE):
+            request_items = {table_name: {'Keys': [{key_name: key} for key in chunk]}}
+            attempt = 0
+            while request_items:
+                try:
+                    response = self.client.batch_get_item(RequestItems=request_items)
+                except ClientError as e:
+                    logger.error("%s", e.response['Error']['Message'])
+                    break
+                for item in response.get('Responses', {}).get(table_name, []):
+                    found[item[key_name]] = item
+                request_items = response.get('UnprocessedKeys')
+                if request_items:
+                    attempt += 1
+                    if attempt > BATCH_RETRIES:
+                        logger.error("Batch get gave up on %s unprocessed keys.", len(request_items[table_name]['Keys']))
+                        break
+                    time.sleep(BATCH_BACKOFF * 2 ** attempt)
+        return found
+
+    def put_data_many(self, data_descriptions):
+        # batch_writer sends 25 items per BatchWriteItem and resends unprocessed items itself.
+        try:
+            with self.data_index_table.batch_writer(overwrite_by_pkeys=['dataId']) as batch:
+                for data_description in data_descriptions:
+                    batch.put_item(Item=data_description)
+            logger.debug('resource, specify none      : batch write succeeded.')
+        except Exception as e:
+            logger.error('resource, specify none      : batch write failed: %s', e)
+            return False
+        return True
 
-    def build_data_description_from_task(self, service_name, input_hashes, output_hash, parameters, s3_bucket='climate-ensembling'):
+MONGO_URI = "mongodb://localhost:27017"
+MONGO_DATABASE = 'registry'
+# Connections per process, enough for every dispatch and job thread to query at once.
+MONGO_MAX_POOL_SIZE = 64
+# dataIds per $in query.
+MONGO_FIND_BATCH_SIZE = 1000
+GRAPH_VERSION_ID = 'graph_version'
 
-        output_locations = {'output1': self.build_s3_location(output_hash, s3_bucket, service_name)}
+class MongoDBRegistry(Registry):
+    """
+    Registry on a self-hosted MongoDB. Services are keyed on service_name and data descriptions on dataId, both with
+        unique indexes, and every write is an upsert. Like the DynamoDB registry, a graph version counter and one change
+        record per version let workers catch up on registrations made by others.
+
+    Without a client, one is created for uri with a connection pool of max_pool_size, shared by every thread.
+    """
+    def __init__(self, client=None, uri=MONGO_URI, database=MONGO_DATABASE, max_pool_size=MONGO_MAX_POOL_SIZE,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        if client is None:
+            client = MongoClient(uri, maxPoolSize=max_pool_size)
+        self.client = client
+        db = self.client[database]
+        self.services_collection = db.services
+        self.data_collection = db.data
+        self.graph_changes_collection = db.graph_changes
+        self.meta_collection = db.meta
+        self.services_collection.create_index('service_name', unique=True)
+        self.data_collection.create_index('dataId', unique=True)
+        self.description_cache = LRUCache(cache_size)
+        self.graph_lock = threading.RLock()
 
-        input_locations = {}
-        if len(input_hashes) > 0:
-            for input_name, hash in input_hashes.items():
-                input_locations[input_name] = self.build_s3_location(hash, s3_bucket, input_name)
+        self._initialize_service_graph()
 
-        data_description = {'dataId': self.make_data_id(service_name, output_hash),
-                 'service_name': service_name, 
-                 'inputs': input_locations,
-                 'outputs': output_locations,
-                 'parameters': parameters
-        }
+    def _initialize_service_graph(self):
+        logger.info("Initializing service graph from service registry....")
+        version = self.read_graph_version()
+        services = list(self.services_collection.find({}, {'_id': 0}))
+        with self.graph_lock:
+            self._reset_service_graph()
+            self.graph_version = version
+            for service_description in services:
+                self._add_service_to_graph(service_description)
+        logger.info("Loaded %s services at graph version %s", self.service_graph.number_of_nodes(), self.graph_version)
+
+    def read_graph_version(self):
+        try:
+            meta = self.meta_collection.find_one({'_id': GRAPH_VERSION_ID})
+        except PyMongoError as e:
+            logger.error("%s", e)
+            return 0
+        return int(meta['graph_version']) if meta else 0
+
+    def _bump_graph_version(self, service_name):
+        meta = self.meta_collection.find_one_and_update({'_id': GRAPH_VERSION_ID}, {'$inc': {'graph_version': 1}},
+                                                        upsert=True, return_document=ReturnDocument.AFTER)
+        version = int(meta['graph_version'])
+        self.graph_changes_collection.replace_one({'_id': version}, {'_id': version, 'changed_service': service_name}, upsert=True)
+        return version
+
+    def refresh_service_graph(self):
+        version = self.read_graph_version()
+        if version <= self.graph_version:
+            return False
 
-        return data_description
+        changes = list(self.graph_changes_collection.find({'_id': {'$gt': self.graph_version, '$lte': version}}))
+        if len(changes) < version - self.graph_version:
+            logger.warning("Missing graph change records, rescanning the service registry.")
+            self._initialize_service_graph()
+            return True
+        changed_services = list(set(change['changed_service'] for change in changes))
+        services = list(self.services_collection.find({'service_name': {'$in': changed_services}}, {'_id': 0}))
+        with self.graph_lock:
+            if version <= self.graph_version:
+                return False
+            for service_description in services:
+                self._add_service_to_graph(service_description)
+            self.graph_version = version
+        return True
 
-        
-    def build_s3_location(self, hash, s3_bucket, service_name):
-        return "s3://" + s3_bucket + "/" + service_name + "/" + hash
+    def put_service(self, service_description):
+        name = service_description['service_name']
+        try:
+            with self.graph_lock:
+                self.graph_index.check_inputs(name, service_description['inputs'].keys())
+        except CycleError as e:
+            logger.error("Rejected service %s: %s", name, e)
+            return False
+        try:
+            self.services_collection.replace_one({'service_name': name}, service_description, upsert=True)
+            logger.debug("Registered service description for service %s", name)
+        except PyMongoError as e:
+            logger.error("Service registration failed: %s", e)
+            return False
+        try:
+            version = self._bump_graph_version(name)
+        except PyMongoError as e:
+            logger.warning('Graph version update failed, other workers will not see %s until they rescan: %s', name, e)
+            version = None
 
-class MongoDBRegistry(Registry):
-    def __init__(self, client):
-        self.client = client
-        self.services_collection = self.client.registry.services
-        self.data_collection = self.client.registry.data
+        with self.graph_lock:
+            self._add_service_to_graph(service_description)
+            if version == self.graph_version + 1:
+                self.graph_version = version
 
-    def put_service(self, service_description):
-        result = self.services_collection.insert_one(service_description)
-        print("Registered service description: " + str(result.inserted_id) + " for service " + service_description["name"])
+        self._print_graph()
         return True
 
-    def get_service(self, service_description):
-        return True
+    def get_service(self, service_name, parameters=None):
+        try:
+            return self.services_collection.find_one({'service_name': service_name}, {'_id': 0})
+        except PyMongoError as e:
+            logger.error("%s", e)
+            return None
 
     def put_data(self, data_description):
-        result = self.data_collection.insert_one(data_description)
-        print("Registered data description: " + str(result.inserted_id) + " for service " + data_description["name"] + " at output location " + data_description['output'])
+        try:
+            self.data_collection.replace_one({'dataId': data_description['dataId']}, data_description, upsert=True)
+            logger.debug("Registered data description %s", data_description['dataId'])
+        except PyMongoError as e:
+            logger.error("Data registration failed: %s", e)
+            return False
         return True
 
-    def get_data(self, data_description):
-        return True
\ No newline at end of file
+    def get_data(self, dataId):
+        try:
+            return self.data_collection.find_one({'dataId': dataId}, {'_id': 0})
+        except PyMongoError as e:
+            logger.error("%s", e)
+            return None
+
+    def get_data_many(self, data_ids):
+        found = {}
+        for chunk in chunked(list(dict.fromkeys(data_ids)), MONGO_FIND_BATCH_SIZE):
+            try:
+                for data_description in self.data_collection.find({'dataId': {'$in': chunk}}, {'_id': 0}):
+                    found[data_description['dataId']] = data_description
+            except PyMongoError as e:
+                logger.error("%s", e)
+        return found
+
+    def put_data_many(self, data_descriptions):
+        # Unordered, so one failed upsert doesn't stop the rest of the batch.
+        requests = [ReplaceOne({'dataId': d['dataId']}, d, upsert=True) for d in data_descriptions]
+        if not requests:
+            return True
+        try:
+            self.data_collection.bulk_write(requests, ordered=False)
+            logger.debug("Batch write of %s data descriptions succeeded.", len(requests))
+        except PyMongoError as e:
+            logger.error("Batch write failed: %s", e)
+            return False
+        return True
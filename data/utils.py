@@ -1,23 +1,47 @@
 import hashlib
+import itertools
+import logging
+from decimal import Decimal
 
 HASH_DIGEST_SIZE = 8
+
+logger = logging.getLogger(__name__)
+
 def get_required_parameters(ancestors, parameters, graph):
-    print("\n*************Get Required Parameters *********************")
-    print("Ancestors {} \n\n Parameters {} \n".format(ancestors, parameters))
+    logger.debug("Get Required Parameters: Ancestors %s Parameters %s", ancestors, parameters)
     req_parameters = {}
     for a in ancestors:
         req_parameters[a] = {}
         anode = graph.nodes[a]
         # print("Node p {} {}".format(a, graph.nodes[a]))
-        for p in anode['parameters'].keys():
+        for p in anode.get('parameters', {}).keys():
             # print("Parameter p {} Parameters {}".format(p, parameters[a].keys()))
-            if p in parameters[a]:
+            if p in parameters.get(a, {}):
                 req_parameters[a][p] = parameters[a][p]
             else:
-                print("Required parameter {} is not in parameters list!!!!".format(p))
-    print("Returning required parameters {}".format(req_parameters))
+                logger.warning("Required parameter %s is not in parameters list!!!!", p)
+    logger.debug("Returning required parameters %s", req_parameters)
     return req_parameters
 
+def chunked(iterable, size):
+    """
+    Splits an iterable into lists of at most size items, without consuming more than one chunk ahead.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def json_default(obj):
+    """
+    json.dump fallback for the Decimal numbers DynamoDB returns.
+    """
+    if isinstance(obj, Decimal):
+        return int(obj) if obj == obj.to_integral_value() else float(obj)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
 def make_hash(s):
     return hashlib.blake2s(str.encode(s), digest_size=HASH_DIGEST_SIZE).hexdigest()
     # return hashlib.sha224(b"Nobody inspects the spammish repetition").hexdigest()
@@ -1,16 +1,92 @@
 from flask import (Flask, request, make_response, jsonify)
 
-from modules.hypervisor import Hypervisor
+from modules.hypervisor import Hypervisor, AdmissionError
+from modules.dispatch import ECS_RUN_TASK_RATE, ECS_RUN_TASK_BURST
+from modules.jobs import JobManager
+from modules.executors import LocalExecutor, LOCAL
+from modules.checkpoint import pending_checkpoints
+from modules.profiling import ProfileStore
 import boto3
-from data.registry import DynamoDBRegistry
+from botocore.config import Config
+from data.registry import DynamoDBRegistry, MongoDBRegistry, MONGO_URI
+import json
+import logging
+import os
+import uuid
+
+# Set HYPERVISOR_LOG_LEVEL=DEBUG to log every expanded task set and the service graph.
+logging.basicConfig(level=os.environ.get('HYPERVISOR_LOG_LEVEL', 'INFO'),
+                    format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
 app = Flask(__name__)
 
-ddb_client = boto3.resource("dynamodb")
-registry = DynamoDBRegistry(ddb_client)
-s3_client = boto3.client("s3")
-ecs_client = boto3.client("ecs")
-hypervisor = Hypervisor(registry=registry, s3_client=s3_client, ecs_client=ecs_client)
+MAX_DISPATCH_CONCURRENCY = 32
+# Requests run concurrently, sharing the dispatch queue by requester (or request_name) with HYPERVISOR_FLOW_WEIGHTS,
+# e.g. {"ensembles": 1, "interactive": 4}. A request's 'priority' puts its launches ahead of lower priority ones.
+JOB_WORKERS = 8
+FLOW_WEIGHTS = json.loads(os.environ.get('HYPERVISOR_FLOW_WEIGHTS', '{}'))
+# Launched tasks running on the cluster at once, across every request.
+MAX_RUNNING_TASKS = int(os.environ['HYPERVISOR_MAX_RUNNING_TASKS']) if 'HYPERVISOR_MAX_RUNNING_TASKS' in os.environ else None
+# Requests expanding into more tasks than this, in total or at one level, are rejected.
+MAX_TASKS = int(os.environ.get('HYPERVISOR_MAX_TASKS', 1000000))
+MAX_LEVEL_TASKS = int(os.environ.get('HYPERVISOR_MAX_LEVEL_TASKS', 500000))
+# Requests are checkpointed here, and the ones left unfinished by the last run are resumed on startup.
+CHECKPOINT_DIR = os.environ.get('HYPERVISOR_CHECKPOINT_DIR', 'checkpoints')
+# Tasks of a service packed into one container launch, 'auto' packs as many as run in a few minutes.
+BUNDLE_SIZE = os.environ.get('HYPERVISOR_BUNDLE_SIZE', '1')
+BUNDLE_SIZE = BUNDLE_SIZE if BUNDLE_SIZE == 'auto' else int(BUNDLE_SIZE)
+# One connection pool per client, large enough for every dispatch thread, with adaptive client side retries.
+boto_config = Config(max_pool_connections=MAX_DISPATCH_CONCURRENCY, retries={'mode': 'adaptive', 'max_attempts': 10})
+
+# HYPERVISOR_REGISTRY=mongo keeps the registry in the MongoDB at HYPERVISOR_MONGO_URI instead of DynamoDB.
+if os.environ.get('HYPERVISOR_REGISTRY') == 'mongo':
+    registry = MongoDBRegistry(uri=os.environ.get('HYPERVISOR_MONGO_URI', MONGO_URI))
+else:
+    ddb_client = boto3.resource("dynamodb", config=boto_config)
+    registry = DynamoDBRegistry(ddb_client)
+s3_client = boto3.client("s3", config=boto_config)
+ecs_client = boto3.client("ecs", config=boto_config)
+# Services listed in HYPERVISOR_LOCAL_SERVICES run on this machine, with their s3:// data under HYPERVISOR_LOCAL_ROOT.
+local_executor = LocalExecutor(os.environ.get('HYPERVISOR_LOCAL_ROOT', 'local_data'),
+                               default_entry_point=os.environ.get('HYPERVISOR_LOCAL_ENTRY_POINT', 'main.py'))
+local_services = [s for s in os.environ.get('HYPERVISOR_LOCAL_SERVICES', '').split(',') if s]
+# HYPERVISOR_STREAMING=1 expands and dispatches the task sets of a level in chunks, so large requests never hold all
+# of them in memory. Requests checkpointed in HYPERVISOR_CHECKPOINT_DIR are always expanded that way.
+# HYPERVISOR_REUSE_OUTPUTS=1 skips tasks whose output an earlier run already produced.
+# HYPERVISOR_SCHEDULING=dag launches each task as soon as its own inputs complete instead of level by level.
+# HYPERVISOR_DIAGNOSTICS=1 lists the container's files and packages in the logs before every task.
+hypervisor = Hypervisor(registry=registry, s3_client=s3_client, ecs_client=ecs_client,
+                        max_concurrency=MAX_DISPATCH_CONCURRENCY, dispatch_rate=ECS_RUN_TASK_RATE, dispatch_burst=ECS_RUN_TASK_BURST,
+                        executors={LOCAL: local_executor}, backends={s: LOCAL for s in local_services},
+                        streaming=os.environ.get('HYPERVISOR_STREAMING') == '1',
+                        reuse_outputs=os.environ.get('HYPERVISOR_REUSE_OUTPUTS') == '1',
+                        scheduling=os.environ.get('HYPERVISOR_SCHEDULING', 'levels'), bundle_size=BUNDLE_SIZE,
+                        offload_payloads=os.environ.get('HYPERVISOR_OFFLOAD_PAYLOADS') == '1',
+                        diagnostics=os.environ.get('HYPERVISOR_DIAGNOSTICS') == '1',
+                        max_tasks=MAX_TASKS, max_level_tasks=MAX_LEVEL_TASKS, checkpoint_dir=CHECKPOINT_DIR,
+                        max_running_tasks=MAX_RUNNING_TASKS, flow_weights=FLOW_WEIGHTS,
+                        speculative=os.environ.get('HYPERVISOR_SPECULATIVE') == '1')
+hypervisor.start_completion_tracking()
+# Requests sent with ?profile=1, the X-Hypervisor-Profile: 1 header or "profile": true are profiled, and the profile is
+# served at /auto_ai/hypervisor/profiles/<profile_id>. Raw stats are also written to HYPERVISOR_PROFILE_DIR, if set.
+PROFILE_HEADER = 'X-Hypervisor-Profile'
+PROFILE_DIR = os.environ.get('HYPERVISOR_PROFILE_DIR')
+if PROFILE_DIR:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+profiles = ProfileStore(directory=PROFILE_DIR)
+
+
+def run_request(service_request, job):
+    if service_request.get('profile'):
+        with profiles.profile(job.id, service_request.get('request_name')):
+            return hypervisor.execute_service(service_request, job)
+    return hypervisor.execute_service(service_request, job)
+
+
+jobs = JobManager(run_request, workers=JOB_WORKERS)
+os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+for checkpoint_path in pending_checkpoints(CHECKPOINT_DIR):
+    jobs.submit({'resume': checkpoint_path})
 
 
 @app.route("/auto_ai/hypervisor/register_service", methods=["GET", "POST", "PUT", "DELETE"])
@@ -25,16 +101,109 @@ def register_service():
     return res
 
 
+def profiling_requested(service_request):
+    return (request.args.get('profile') == '1' or request.headers.get(PROFILE_HEADER) == '1'
+            or bool(service_request.get('profile')))
+
+
 @app.route("/auto_ai/hypervisor/execute_service", methods=["GET", "POST", "PUT", "DELETE"])
 def execute_service():
     res = {}
     service_request = request.get_json()
-    if hypervisor.execute_service(service_request):
-        res["response"] = "Executing service."
-    else:
-        res["response"] = "Service not executed."
-    res = make_response(jsonify(res), 200)
+    if profiling_requested(service_request):
+        service_request['profile'] = True
+    try:
+        counts = hypervisor.check_admission(service_request)
+    except AdmissionError as e:
+        res["response"] = "Request rejected: {}".format(e)
+        res["plan"] = e.plan
+        return make_response(jsonify(res), 422)
+    job = jobs.submit(service_request, admitted=True)
+    res["response"] = "Executing service."
+    res["job_id"] = job.id
+    res["tasks"] = counts["total"]
+    if service_request.get('profile'):
+        res["profile_id"] = job.id
+    res = make_response(jsonify(res), 202)
     return res
 
+
+@app.route("/auto_ai/hypervisor/plan", methods=["GET", "POST"])
+def plan():
+    """
+    Dry run: task counts per service and level, how many outputs already exist, and whether the request is admitted.
+    """
+    service_request = request.get_json()
+    if not profiling_requested(service_request):
+        return make_response(jsonify(hypervisor.plan(service_request)), 200)
+    with profiles.profile(uuid.uuid4().hex, service_request.get('request_name')) as profile_id:
+        res = hypervisor.plan(service_request)
+    res["profile_id"] = profile_id
+    return make_response(jsonify(res), 200)
+
+
+@app.route("/auto_ai/hypervisor/plan_shards", methods=["POST"])
+def plan_shards():
+    """
+    Splits the service request in the body into "shards" requests. Post each of them to the execute_service of a
+        different hypervisor node.
+    """
+    service_request = request.get_json()
+    shards = int(service_request.pop("shards", 1))
+    res = {"response": "Planned {} shards.".format(shards), "requests": hypervisor.plan_shards(service_request, shards)}
+    return make_response(jsonify(res), 200)
+
+
+@app.route("/auto_ai/hypervisor/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return make_response(jsonify({"response": "Job not found."}), 404)
+    return make_response(jsonify(job.to_dict()), 200)
+
+
+@app.route("/auto_ai/hypervisor/jobs/<job_id>/cancel", methods=["POST", "PUT", "DELETE"])
+def cancel_job(job_id):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return make_response(jsonify({"response": "Job not found."}), 404)
+    res = job.to_dict()
+    res["response"] = "Job cancelled."
+    return make_response(jsonify(res), 200)
+
+
+@app.route("/auto_ai/hypervisor/metrics", methods=["GET"])
+def metrics():
+    return make_response(jsonify(hypervisor.metrics_snapshot()), 200)
+
+
+@app.route("/auto_ai/hypervisor/runtimes", methods=["GET"])
+def runtimes():
+    """
+    Runtime summaries of every service that has run, or of ?service=<name>, with means per parameter value.
+    """
+    service_name = request.args.get('service')
+    if service_name is not None:
+        hypervisor.history.load([service_name])
+        return make_response(jsonify({service_name: hypervisor.history.summary(service_name)}), 200)
+    return make_response(jsonify(hypervisor.history.summaries()), 200)
+
+
+@app.route("/auto_ai/hypervisor/profiles", methods=["GET"])
+def list_profiles():
+    return make_response(jsonify(profiles.list()), 200)
+
+
+@app.route("/auto_ai/hypervisor/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Slowest functions by cumulative time and largest allocations of a profiled request. A job's profile is stored once
+        the job has dispatched everything.
+    """
+    profile = profiles.get(profile_id)
+    if profile is None:
+        return make_response(jsonify({"response": "Profile not found."}), 404)
+    return make_response(jsonify(profile), 200)
+
 if __name__ == "__main__":
     app.run(host="127.0.0.1:5000")
@@ -0,0 +1,216 @@
+import fcntl
+import json
+import os
+import threading
+from data.utils import json_default
+
+CHECKPOINT_SUFFIX = '.jsonl'
+
+PLAN = 'plan'
+# Task sets [start, stop) of a level have been dispatched.
+CHUNK = 'chunk'
+LAUNCHED = 'launched'
+FINISHED_TASK = 'finished_task'
+# Everything has been dispatched.
+DISPATCHED = 'dispatched'
+# Every launched task has finished, or the request was cancelled. Nothing is left to resume.
+DONE = 'done'
+# Bytes read at a time from the end of a checkpoint for its last record.
+TAIL_BLOCK = 4096
+
+
+class CheckpointLocked(Exception):
+    """
+    Raised when another Checkpoint, in this process or another one, holds the checkpoint file.
+    """
+    pass
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines record of a level by level execution, so a restarted hypervisor can resume it.
+
+    The plan record holds the request, the level of each of its services, the order of the services of each level and
+        the index ranges of every level in its TaskSpace. Dispatched task sets are recorded as index ranges, not one by one, launched tasks as their ARN and
+        task descriptions, so they can be followed or launched again, and finished tasks by dataId. A checkpoint is a
+        waiter of the tasks it launched, so finishing tasks are recorded as they are reported.
+
+    The file is deleted once the done record is written. The record is there for the case the delete fails.
+
+    A Checkpoint holds an exclusive flock on its file until it is closed, so hypervisors sharing a checkpoint directory
+        never resume or append to the same one. Opening a locked checkpoint raises CheckpointLocked.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.request = None
+        self.service_levels = {}
+        self.orders = None
+        self.ranges = {}
+        self.cursors = {}
+        self.launched = {}
+        self._launched_ids = set()
+        self.finished = {}
+        self.dispatched = False
+        self.done = False
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+        try:
+            fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self._file.close()
+            raise CheckpointLocked(path)
+        self._load()
+        if self._file.tell() > 0 and not _ends_with_newline(path):
+            # Records appended after a cut short line must start on a line of their own.
+            self._file.write('\n')
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash.
+                    continue
+                self._apply(record)
+
+    def _apply(self, record):
+        kind = record['type']
+        if kind == PLAN:
+            self.request = record['request']
+            self.service_levels = record.get('service_levels', {})
+            if record.get('orders'):
+                self.orders = {int(level): services for level, services in record['orders'].items()}
+            self.ranges = {int(level): r for level, r in record['ranges'].items()}
+            self.cursors = {level: r[0] for level, r in self.ranges.items()}
+        elif kind == CHUNK:
+            self.cursors[record['level']] = record['stop']
+        elif kind == LAUNCHED:
+            self.launched[record['taskArn']] = record['tasks']
+            self._launched_ids.update(d['dataId'] for d in record['tasks'])
+        elif kind == FINISHED_TASK:
+            self.finished[record['dataId']] = record['succeeded']
+        elif kind == DISPATCHED:
+            self.dispatched = True
+        elif kind == DONE:
+            self.done = True
+
+    def _append(self, record, sync=False):
+        with self._lock:
+            self._apply(record)
+            if self._file.closed:
+                return
+            self._file.write(json.dumps(record, default=json_default) + '\n')
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+
+    def start(self, request, ranges, service_levels=None, orders=None):
+        self._append({'type': PLAN, 'request': request, 'service_levels': service_levels or {}, 'orders': orders,
+                      'ranges': ranges}, sync=True)
+
+    def chunk_dispatched(self, level, stop):
+        self._append({'type': CHUNK, 'level': level, 'stop': stop}, sync=True)
+
+    def task_launched(self, task_arn, task_descriptions):
+        self._append({'type': LAUNCHED, 'taskArn': task_arn, 'tasks': task_descriptions})
+
+    def task_finished(self, data_id, succeeded):
+        self._append({'type': FINISHED_TASK, 'dataId': data_id, 'succeeded': succeeded})
+        self._check_done()
+
+    def all_dispatched(self):
+        self._append({'type': DISPATCHED}, sync=True)
+        self._check_done()
+
+    def running(self):
+        """
+        :rtype: Dictionary of {task ARN: task descriptions not finished yet} of the launched tasks.
+        """
+        with self._lock:
+            running = {}
+            for task_arn, task_descriptions in self.launched.items():
+                left = [d for d in task_descriptions if d['dataId'] not in self.finished]
+                if left:
+                    running[task_arn] = left
+            return running
+
+    def completed(self, data_id):
+        return self.finished.get(data_id) is True
+
+    def is_running(self, data_id):
+        return data_id in self._launched_ids and data_id not in self.finished
+
+    def _check_done(self):
+        if self.dispatched and not self.done and not self.running():
+            self._append({'type': DONE}, sync=True)
+            self.remove()
+
+    def cancel(self):
+        if not self.done:
+            self._append({'type': DONE, 'cancelled': True}, sync=True)
+        self.remove()
+
+    def remove(self):
+        # Deleted while still locked, so no other hypervisor opens it in between.
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _ends_with_newline(path):
+    with open(path, 'rb') as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b'\n'
+
+
+def _last_record(path):
+    """
+    Reads the file backwards a block at a time, up to the start of its last line.
+
+    :rtype: The last record, or None if the file is empty or its last line was cut short.
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        tail = b''
+        while end > 0 and tail.strip().count(b'\n') < 1:
+            start = max(0, end - TAIL_BLOCK)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+    try:
+        return json.loads(tail.strip().split(b'\n')[-1])
+    except ValueError:
+        return None
+
+
+def _is_locked(path):
+    with open(path, 'rb') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return False
+
+
+def pending_checkpoints(directory):
+    """
+    :rtype: Paths of the checkpoints in directory that still have work to resume, and that no other hypervisor holds.
+    """
+    if not os.path.isdir(directory):
+        return []
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(CHECKPOINT_SUFFIX):
+            path = os.path.join(directory, name)
+            record = _last_record(path)
+            if (record is None or record.get('type') != DONE) and not _is_locked(path):
+                paths.append(path)
+    return paths
@@ -0,0 +1,222 @@
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+# RunTask is throttled per account and region with a token bucket, these defaults stay well inside it.
+ECS_RUN_TASK_RATE = 20
+ECS_RUN_TASK_BURST = 20
+DEFAULT_FLOW = 'default'
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Allows rate calls per second on average, and bursts of up to capacity calls.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class DispatchResult:
+    def __init__(self, item, response=None, error=None):
+        self.item = item
+        self.response = response
+        self.error = error
+
+    @property
+    def succeeded(self):
+        return self.error is None
+
+
+class Dispatcher:
+    """
+    Runs a dispatch function over a batch of items on a bounded thread pool, optionally rate limited.
+        The pool is created on first use and reused across batches.
+    """
+    def __init__(self, max_workers=1, rate=None, burst=None):
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _call(self, fn, item):
+        if self.bucket is not None:
+            self.bucket.acquire()
+        try:
+            return DispatchResult(item, response=fn(item))
+        except Exception as e:
+            return DispatchResult(item, error=e)
+
+    def map(self, fn, items):
+        """
+        :rtype: List of DispatchResult, in the order of items. Exceptions are captured per item, not raised.
+        """
+        if self.max_workers <= 1:
+            return [self._call(fn, item) for item in items]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='dispatch')
+        futures = [self._executor.submit(self._call, fn, item) for item in items]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+class _Entry:
+    def __init__(self, fn, item, callback):
+        self.fn = fn
+        self.item = item
+        self.callback = callback
+        self.result = None
+        self.done = threading.Event()
+
+
+class FairDispatcher(Dispatcher):
+    """
+    One dispatch queue shared by every request, served by max_workers threads. Each request dispatches as a flow,
+        and flows share the dispatch threads by weighted fair queuing: an item's cost, divided by its flow's weight, is
+        added to the flow's virtual finish time, and the queued item finishing first is dispatched next. A small request
+        arriving behind a large sweep is interleaved with it rather than queued after it. Items of higher priority are
+        always dispatched first.
+
+    With max_running, at most that many launched tasks run at once: an item is only dispatched while fewer tasks are
+        running, and a task holds its slot until release is called with its ARN.
+    """
+    def __init__(self, max_workers=1, rate=None, burst=None, max_running=None):
+        super().__init__(max_workers, rate, burst)
+        self.max_running = max_running
+        self.running = set()
+        self._reserved = 0
+        self._heap = []
+        # {flow: [virtual finish time of its last queued item, number of items queued]}
+        self._flows = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._stopped = False
+
+    def submit(self, fn, items, callback=None, flow=DEFAULT_FLOW, weight=1, priority=0, cost=None):
+        """
+        Queues fn over items and returns without waiting. callback, when given, is called on a dispatch thread with the
+            DispatchResult of each item. cost gives an item's cost, 1 by default.
+
+        :rtype: The queued entries.
+        """
+        entries = [_Entry(fn, item, callback) for item in items]
+        with self._condition:
+            self._start_workers()
+            for idle in [f for f, state in self._flows.items() if state[1] == 0 and state[0] <= self._virtual_time]:
+                del self._flows[idle]
+            state = self._flows.setdefault(flow, [self._virtual_time, 0])
+            for entry in entries:
+                start = max(self._virtual_time, state[0])
+                state[0] = start + (cost(entry.item) if cost is not None else 1) / float(weight)
+                state[1] += 1
+                heapq.heappush(self._heap, (-priority, state[0], next(self._seq), start, flow, entry))
+            self._condition.notify_all()
+        return entries
+
+    def map(self, fn, items, flow=DEFAULT_FLOW, weight=1, priority=0, cost=None):
+        """
+        :rtype: List of DispatchResult, in the order of items, once all of them have been dispatched.
+        """
+        return self.wait(self.submit(fn, items, flow=flow, weight=weight, priority=priority, cost=cost))
+
+    def wait(self, entries):
+        """
+        Waits until every entry has been dispatched and its callback has returned.
+
+        :rtype: List of DispatchResult, in the order of entries.
+        """
+        for entry in entries:
+            entry.done.wait()
+        return [entry.result for entry in entries]
+
+    def release(self, task_arn):
+        """
+        Frees the slot of a launched task once it has stopped.
+        """
+        with self._condition:
+            if task_arn in self.running:
+                self.running.discard(task_arn)
+                self._condition.notify_all()
+
+    def queued(self):
+        """
+        :rtype: Dictionary of {flow: number of items queued}.
+        """
+        with self._condition:
+            return {flow: state[1] for flow, state in self._flows.items() if state[1]}
+
+    def _start_workers(self):
+        while len(self._threads) < max(self.max_workers, 1):
+            thread = threading.Thread(target=self._work, name='dispatch-{}'.format(len(self._threads)), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _has_slot(self):
+        return self.max_running is None or len(self.running) + self._reserved < self.max_running
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._stopped and not (self._heap and self._has_slot()):
+                    self._condition.wait()
+                if self._stopped:
+                    return
+                _, _, _, start, flow, entry = heapq.heappop(self._heap)
+                self._virtual_time = max(self._virtual_time, start)
+                state = self._flows[flow]
+                state[1] -= 1
+                if state[1] == 0 and state[0] <= self._virtual_time:
+                    del self._flows[flow]
+                self._reserved += 1
+            result = self._call(entry.fn, entry.item)
+            with self._condition:
+                self._reserved -= 1
+                if self.max_running is not None and isinstance(result.response, dict):
+                    self.running.update(task['taskArn'] for task in result.response.get('tasks', []))
+                self._condition.notify_all()
+            entry.result = result
+            if entry.callback is not None:
+                try:
+                    entry.callback(result)
+                except Exception:
+                    logger.exception("Dispatch callback failed for %s", entry.item)
+            entry.done.set()
+
+    def shutdown(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopped = False
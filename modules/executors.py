@@ -0,0 +1,220 @@
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import runpy
+import sys
+import threading
+
+ECS = 'ecs'
+LOCAL = 'local'
+LOCAL_ARN_PREFIX = 'local:task/'
+# Every task of a bundle writes its exit code to this object in its output location, as {"exitCode": <code>}.
+STATUS_OBJECT = '_status.json'
+
+logger = logging.getLogger(__name__)
+
+
+class Executor:
+    """
+    Runs bundles of task descriptions of one service. run returns a response shaped like ECS run_task's, with one
+        task ARN per launched bundle, or failures.
+
+    polled executors have their tasks followed by the CompletionTracker. The others report when a task stops themselves.
+    """
+    polled = False
+    on_stopped = None
+
+    def run(self, bundle):
+        raise NotImplementedError
+
+    def exit_codes(self, bundle):
+        """
+        :rtype: Dictionary of {dataId: exit code} of the tasks of a stopped bundle that wrote their status object.
+        """
+        return {}
+
+    def stop(self, task_arn):
+        pass
+
+    def shutdown(self):
+        pass
+
+
+class ECSExecutor(Executor):
+    """
+    Launches bundles as ECS Fargate tasks through run_bundle, the hypervisor's container launch. The status objects of
+        bundled tasks are read from S3.
+    """
+    polled = True
+
+    def __init__(self, run_bundle, ecs_client, cluster_name, s3_client=None):
+        self.run_bundle = run_bundle
+        self.ecs_client = ecs_client
+        self.cluster_name = cluster_name
+        self.s3_client = s3_client
+
+    def run(self, bundle):
+        return self.run_bundle(bundle)
+
+    def exit_codes(self, bundle):
+        exit_codes = {}
+        if self.s3_client is None:
+            return exit_codes
+        for task_description in bundle:
+            location = status_location(task_description)
+            if location is None:
+                continue
+            bucket, key = location[len('s3://'):].split('/', 1)
+            try:
+                status = json.loads(self.s3_client.get_object(Bucket=bucket, Key=key)['Body'].read())
+            except Exception as e:
+                # Not written, the container stopped before the task ran.
+                logger.debug("No status for %s: %s", task_description['dataId'], e)
+                continue
+            exit_codes[task_description['dataId']] = status['exitCode']
+        return exit_codes
+
+    def stop(self, task_arn):
+        self.ecs_client.stop_task(cluster=self.cluster_name, task=task_arn, reason='Cancelled')
+
+
+class LocalExecutor(Executor):
+    """
+    Runs bundles on this machine, in a pool of worker processes. Each task description is passed to the service entry
+        point as --parameters, like in the container, with every s3:// location mapped to a directory under root.
+
+    entry_points maps a service name to the path of its main.py, services not in it use default_entry_point. The entry
+        point runs in the directory it is in. on_stopped is called with the task ARN, the exit code and the reason once
+        a bundle has run.
+    """
+    def __init__(self, root, entry_points=None, default_entry_point='main.py', max_workers=None, on_stopped=None):
+        self.root = root
+        self.entry_points = entry_points or {}
+        self.default_entry_point = default_entry_point
+        self.max_workers = max_workers
+        self.on_stopped = on_stopped
+        self.futures = {}
+        self._pool = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def entry_point(self, service_name):
+        return os.path.abspath(self.entry_points.get(service_name, self.default_entry_point))
+
+    def run(self, bundle):
+        with self._lock:
+            if self._pool is None:
+                # Spawned, not forked. A fork copies the locks the dispatcher, tracker and job threads hold at that
+                # moment, and the worker would wait on them forever.
+                self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            task_arn = LOCAL_ARN_PREFIX + str(next(self._ids))
+        payloads = [localize(task_description, self.root) for task_description in bundle]
+        future = self._pool.submit(run_bundle, self.entry_point(bundle[0]['service_name']), payloads)
+        self.futures[task_arn] = future
+        future.add_done_callback(lambda f: self._on_done(task_arn, f))
+        return {'tasks': [{'taskArn': task_arn, 'lastStatus': 'RUNNING'}], 'failures': []}
+
+    def _on_done(self, task_arn, future):
+        self.futures.pop(task_arn, None)
+        if future.cancelled():
+            exit_code, reason = None, 'Cancelled'
+        elif future.exception() is not None:
+            exit_code, reason = None, str(future.exception())
+        else:
+            exit_code, reason = future.result(), None
+        if self.on_stopped is not None:
+            self.on_stopped(task_arn, exit_code, reason)
+
+    def exit_codes(self, bundle):
+        exit_codes = {}
+        for task_description in bundle:
+            location = status_location(localize(task_description, self.root))
+            if location is None:
+                continue
+            try:
+                with open(location) as f:
+                    exit_codes[task_description['dataId']] = json.load(f)['exitCode']
+            except (OSError, ValueError):
+                continue
+        return exit_codes
+
+    def stop(self, task_arn):
+        # Bundles still queued are dropped, a running process can't be interrupted and runs to the end.
+        future = self.futures.get(task_arn)
+        if future is not None:
+            future.cancel()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+def status_location(task_description):
+    """
+    :rtype: The location of the status object of a task, in its first output location, or None if it has no outputs.
+    """
+    outputs = task_description.get('outputs')
+    if not outputs:
+        return None
+    return next(iter(outputs.values())).rstrip('/') + '/' + STATUS_OBJECT
+
+
+def localize(task_description, root):
+    """
+    Maps the s3:// locations of a task description to directories under root, creating the output directories.
+    """
+    def to_local(value):
+        if isinstance(value, str) and value.startswith('s3://'):
+            return os.path.join(root, value[len('s3://'):])
+        if isinstance(value, dict):
+            return {k: to_local(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [to_local(v) for v in value]
+        return value
+
+    local = to_local(task_description)
+    for location in local.get('outputs', {}).values():
+        os.makedirs(location, exist_ok=True)
+    return local
+
+
+def run_bundle(entry_point, payloads):
+    """
+    Runs in a worker process. Runs the entry point once per payload, in order, and writes each run's exit code to its
+        status object.
+
+    :rtype: 0 if every run succeeded, otherwise the first non-zero exit code.
+    """
+    status = 0
+    for payload in payloads:
+        rc = run_entry_point(entry_point, payload)
+        logger.info("[bundle] %s exit=%s", payload['dataId'], rc)
+        location = status_location(payload)
+        if location is not None:
+            with open(location, 'w') as f:
+                json.dump({'exitCode': rc}, f)
+        if rc != 0 and status == 0:
+            status = rc
+    return status
+
+
+def run_entry_point(entry_point, payload):
+    argv, cwd = sys.argv, os.getcwd()
+    sys.argv = [entry_point, "--parameters={}".format(json.dumps(payload))]
+    os.chdir(os.path.dirname(entry_point))
+    try:
+        runpy.run_path(entry_point, run_name='__main__')
+        return 0
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        return e.code if isinstance(e.code, int) else 1
+    except Exception:
+        logger.exception("Task %s failed", payload['dataId'])
+        return 1
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
@@ -0,0 +1,166 @@
+from collections import deque
+import logging
+import threading
+
+# Samples kept per service, the oldest are dropped first.
+MAX_SAMPLES = 500
+# Samples recorded for a service before they are written back to the registry.
+FLUSH_EVERY = 20
+# Samples of a parameter value needed before it is used in predictions.
+MIN_PARAMETER_SAMPLES = 3
+
+logger = logging.getLogger(__name__)
+
+
+class _Aggregate:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds, n=1):
+        self.count += n
+        self.total += seconds * n
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+
+class RuntimeHistory:
+    """
+    How long the tasks of every service took, from launch or start to stop, as a window of the last max_samples per
+        service. Each sample keeps the task's parameters, so runtimes are also summarized per parameter value, and a
+        task's runtime is predicted from the values it is given.
+
+    Samples are stored in the registry, next to the data descriptions, and loaded for the services of a request when it
+        is planned.
+    """
+    def __init__(self, registry=None, max_samples=MAX_SAMPLES, flush_every=FLUSH_EVERY):
+        self.registry = registry
+        self.max_samples = max_samples
+        self.flush_every = flush_every
+        # {service: deque of [seconds, {parameter: value}]}
+        self.samples = {}
+        self._services = {}
+        self._parameters = {}
+        self._sorted = {}
+        self._loaded = set()
+        self._unflushed = {}
+        self._lock = threading.Lock()
+
+    def load(self, services):
+        """
+        Fetches the stored samples of the services not loaded yet, in one batch. Services whose fetch failed are
+            fetched again next time.
+        """
+        with self._lock:
+            missing = [s for s in services if s not in self._loaded]
+        if not missing or self.registry is None:
+            return
+        try:
+            stored = self.registry.get_runtime_samples(missing)
+        except Exception as e:
+            logger.warning("Could not load runtime history of %s: %s", missing, e)
+            return
+        with self._lock:
+            for service in missing:
+                if service in self._loaded:
+                    # Loaded by a concurrent request meanwhile.
+                    continue
+                self._loaded.add(service)
+                for milliseconds, parameters in stored.get(service, ()):
+                    self._add(service, int(milliseconds) / 1000.0, parameters)
+
+    def record(self, service, parameters, seconds):
+        with self._lock:
+            self._add(service, seconds, parameters)
+            self._unflushed[service] = self._unflushed.get(service, 0) + 1
+            flush = self._unflushed[service] >= self.flush_every
+        if flush:
+            self.flush([service])
+
+    def _add(self, service, seconds, parameters):
+        samples = self.samples.setdefault(service, deque())
+        if len(samples) == self.max_samples:
+            self._count(service, *samples.popleft(), n=-1)
+        samples.append([seconds, parameters])
+        self._count(service, seconds, parameters)
+        self._sorted.pop(service, None)
+
+    def _count(self, service, seconds, parameters, n=1):
+        self._services.setdefault(service, _Aggregate()).add(seconds, n)
+        for name, value in parameters.items():
+            self._parameters.setdefault((service, name, str(value)), _Aggregate()).add(seconds, n)
+
+    def flush(self, services=None):
+        """
+        Writes the samples of services, or of every service with new samples, to the registry. Services whose write
+            failed are written again with the next flush.
+        """
+        with self._lock:
+            services = [s for s in (services if services is not None else list(self._unflushed)) if s in self._unflushed]
+            unflushed = {s: self._unflushed.pop(s) for s in services}
+            # DynamoDB doesn't take floats. Parameter values are only ever compared as strings.
+            stored = {s: [[int(seconds * 1000), {name: str(value) for name, value in parameters.items()}]
+                          for seconds, parameters in self.samples[s]] for s in services}
+        if self.registry is None:
+            return
+        for service, samples in stored.items():
+            try:
+                written = self.registry.put_runtime_samples(service, samples)
+            except Exception as e:
+                logger.warning("Could not store runtime history of %s: %s", service, e)
+                written = False
+            if not written:
+                with self._lock:
+                    self._unflushed[service] = self._unflushed.get(service, 0) + unflushed[service]
+
+    def predict(self, service, parameters=None):
+        """
+        The mean runtime of the service's tasks given these parameter values, where enough of them have been seen,
+            otherwise of all the service's tasks.
+
+        :rtype: Seconds, or None if the service has never run.
+        """
+        aggregate = self._services.get(service)
+        if aggregate is None or not aggregate.count:
+            return None
+        means = []
+        for name, value in (parameters or {}).items():
+            by_value = self._parameters.get((service, name, str(value)))
+            if by_value is not None and by_value.count >= MIN_PARAMETER_SAMPLES:
+                means.append(by_value.mean)
+        return sum(means) / len(means) if means else aggregate.mean
+
+    def percentile(self, service, q):
+        """
+        :rtype: The q-th percentile, 0 to 100, of the service's runtimes in seconds, or None if it has never run.
+        """
+        with self._lock:
+            ordered = self._sorted.get(service)
+            if ordered is None:
+                ordered = sorted(seconds for seconds, _ in self.samples.get(service, ()))
+                self._sorted[service] = ordered
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, int(round(q / 100.0 * (len(ordered) - 1))))]
+
+    def summary(self, service):
+        """
+        :rtype: Dictionary with the count, mean, p50, p90, p95 and max runtime of the service, and the count and mean
+            per parameter value, or None if it has never run.
+        """
+        aggregate = self._services.get(service)
+        if aggregate is None or not aggregate.count:
+            return None
+        parameters = {}
+        with self._lock:
+            for (s, name, value), by_value in self._parameters.items():
+                if s == service and by_value.count:
+                    parameters.setdefault(name, {})[value] = {'count': by_value.count, 'mean': by_value.mean}
+        return {'count': aggregate.count, 'mean': aggregate.mean, 'p50': self.percentile(service, 50),
+                'p90': self.percentile(service, 90), 'p95': self.percentile(service, 95),
+                'max': self.percentile(service, 100), 'parameters': parameters}
+
+    def summaries(self):
+        return {service: self.summary(service) for service in sorted(self.samples)}
@@ -1,60 +1,428 @@
+from collections import OrderedDict
 import json
-from data.utils import make_hash
+import logging
+import os
+import uuid
+from data.utils import make_hash, chunked, get_required_parameters, json_default
+from data.graph import build_predecessor_levels
+from data.cache import LRUCache, DEFAULT_CACHE_SIZE, freeze
+from modules.dispatch import FairDispatcher, DEFAULT_FLOW
+from modules.scheduler import DAGScheduler
+from modules.tracker import CompletionTracker
+from modules.inflight import InFlightRegistry
+from modules.metrics import Metrics
+from modules.executors import ECS, ECSExecutor, status_location
+from modules.taskspace import TaskSpace
+from modules.checkpoint import Checkpoint, CheckpointLocked, CHECKPOINT_SUFFIX
+from modules.history import RuntimeHistory
+from modules.speculation import Speculator
 import itertools
+import threading
+import time
+import networkx as nx
+
+# ECS rejects run_task calls whose overrides exceed 8KiB, bundles are sized to stay under this.
+MAX_OVERRIDE_BYTES = 8000
+MAX_AUTO_BUNDLE_SIZE = 64
+# In 'auto' bundling, a bundle of a service whose runtime is known runs for about this long.
+BUNDLE_SECONDS = 300
+SPECULATION_PRIORITY = 100
+PAYLOAD_PREFIX = 'payloads/'
+# Dispatch results kept for the latest dispatched dataIds, the oldest are dropped first.
+MAX_DISPATCH_RESULTS = 100000
+# Fields of a request that pick its dispatch flow, see flow_of.
+REQUEST_FLOW_FIELDS = ('requester', 'request_name', 'priority')
+DIAGNOSTICS_COMMAND = "cd /app && ls -altr && pwd && python3 --version && pip freeze "
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a request expands into more tasks than the hypervisor's admission limits allow. plan holds the counts.
+    """
+    def __init__(self, message, plan):
+        super().__init__(message)
+        self.plan = plan
+
 
 class Hypervisor():
-    def __init__(self, base_bucket='climate-ensembling', cluster_name="HypervisorCluster", s3_client=None, ecs_client=None, registry=None):
+    def __init__(self, base_bucket='climate-ensembling', cluster_name="HypervisorCluster", s3_client=None, ecs_client=None, registry=None,
+                 streaming=False, chunk_size=1000, cache_size=DEFAULT_CACHE_SIZE, reuse_outputs=False,
+                 max_concurrency=1, dispatch_rate=None, dispatch_burst=None, scheduling='levels', bundle_size=1,
+                 executors=None, backends=None, default_backend=ECS, offload_payloads=False, diagnostics=False,
+                 max_tasks=None, max_level_tasks=None, max_existing_check=100000, checkpoint_dir=None,
+                 max_running_tasks=None, flow_weights=None, bundle_seconds=BUNDLE_SECONDS,
+                 speculative=False, speculation_percentile=95, speculation_factor=1.5, max_speculative=10,
+                 max_dispatch_results=MAX_DISPATCH_RESULTS):
 
         self.registry = registry
+        # Held while the service graph is read, for hypervisors without a registry that keeps its own.
+        self._graph_lock = threading.RLock()
         self.s3_client =s3_client
         self.ecs_client = ecs_client
         self.BASE_BUCKET = base_bucket
         self.CLUSTER_NAME = cluster_name
+        # Streaming mode expands task sets lazily and dispatches them in chunks of at most chunk_size.
+        self.streaming = streaming
+        self.chunk_size = chunk_size
+        # Per-task parameter hashes and prefix task set hashes, kept across requests so overlapping sweeps reuse them.
+        self.hash_cache = LRUCache(cache_size)
+        self.tshash_cache = LRUCache(cache_size)
+        # Reuse mode skips task sets whose output dataId is already in the data registry, and registers the
+        # outputs of dispatched tasks once they are reported complete.
+        self.reuse_outputs = reuse_outputs
+        self.pending_outputs = {}
+        # run_task calls of every request go through one bounded, rate limited dispatch queue, shared fairly between
+        # requesters with the weights in flow_weights. At most max_running_tasks launched tasks run at once. The outcome
+        # of every dispatch is kept by dataId.
+        self.dispatcher = FairDispatcher(max_workers=max_concurrency, rate=dispatch_rate, burst=dispatch_burst,
+                                         max_running=max_running_tasks)
+        self.flow_weights = flow_weights or {}
+        # Runtimes of the tasks that completed, by service and parameter value. Predictions from them order dispatch
+        # along the longest paths to the target first, and size 'auto' bundles to about bundle_seconds.
+        self.history = RuntimeHistory(registry)
+        self.bundle_seconds = bundle_seconds
+        # Task descriptions of every launched task that hasn't stopped, by task ARN.
+        self._launched_tasks = {}
+        self.speculative = speculative
+        self.dispatch_results = OrderedDict()
+        self.max_dispatch_results = max_dispatch_results
+        # 'levels' dispatches the task sets level by level, 'dag' releases each task as soon as its own inputs complete,
+        # which requires completions to be reported through notify_completed.
+        self.scheduling = scheduling
+        self._lock = threading.Lock()
+        # Task descriptions of the same service are packed bundle_size at a time into one container launch. 'auto' packs
+        # as many as fit in the ECS overrides limit.
+        self.bundle_size = bundle_size
+        # Every launched task is followed until it stops, and its dataIds are then reported to notify_completed.
+        self.tracker = CompletionTracker(ecs_client, cluster_name, on_stopped_many=self._on_tasks_stopped,
+                                         on_poll=self.speculate if speculative else None)
+        # dataIds launched and not finished yet. Requests for a dataId already in flight wait on it instead of
+        # launching it again, and a task nobody waits for any more is stopped.
+        self.in_flight = InFlightRegistry(on_abandoned=self._on_abandoned)
+        # Positions of the lineage of every service within a lineage, by lineage.
+        self._lineage_positions = {}
+        # Time spent per phase (expansion, hashing, planning, registry, dispatch) and task counters.
+        self.metrics = Metrics()
+        # Speculative mode launches a second copy of a task still running speculation_factor times past its service's
+        # speculation_percentile runtime, at most max_speculative at once. The first copy to succeed completes the
+        # dataId and the others are stopped.
+        self.speculator = Speculator(self.history, self.in_flight, self.metrics, self._launched_tasks, self._stop_task,
+                                     speculation_percentile, speculation_factor, max_speculative)
+        # Executors by backend name, 'ecs' launches on Fargate. backends maps a service name, or a callable maps it, to
+        # the backend that runs the service; services it doesn't name run on default_backend.
+        self.executors = {ECS: ECSExecutor(self._compute_bundle, ecs_client, cluster_name, s3_client)}
+        self.executors.update(executors or {})
+        for executor in self.executors.values():
+            if not executor.polled and executor.on_stopped is None:
+                executor.on_stopped = self.tracker.report_stopped
+        self.backends = backends or {}
+        self.default_backend = default_backend
+        # Offloading writes the task descriptions of every dispatched batch to one object in BASE_BUCKET, and commands
+        # only pass --payload=<s3 location> --payload-index=<position>. A payload object is deleted once every task
+        # in it has stopped. diagnostics lists the container's files and packages before running a task.
+        self.offload_payloads = offload_payloads
+        self.diagnostics = diagnostics
+        self._payload_refs = {}
+        # The keys of the payloads a dataId is in, oldest first, one per launch that hasn't stopped yet, and the number
+        # of tasks in each payload that haven't stopped yet, by key.
+        self._payload_keys = {}
+        self._payload_tasks = {}
+        # Admission limits on the number of tasks a request expands into, in total and at any one level. Requests over
+        # them are rejected before anything is expanded. plan() only looks up existing outputs for plans of at most
+        # max_existing_check tasks.
+        self.max_tasks = max_tasks
+        self.max_level_tasks = max_level_tasks
+        self.max_existing_check = max_existing_check
+        # Level by level requests record their plan, the task set ranges dispatched so far and the tasks they launched
+        # in a checkpoint file under checkpoint_dir, so resume can pick them up after a restart.
+        self.checkpoint_dir = checkpoint_dir
 
     def register_service(self, service_description):
-        print("Register: Service description {}".format(service_description))
-        registry_response = self.registry.put_service(service_description)
+        logger.info("Register: Service description %s", service_description)
+        with self.metrics.timer('registry'):
+            registry_response = self.registry.put_service(service_description)
 
         return registry_response
 
-    def execute_service(self, service_request):
-        print("Execute: Service description {} \n \n ".format(service_request))
+    def execute_service(self, service_request, job=None):
+        """
+        job, when given, is a modules.jobs.Job that collects per-level progress and can cancel the request between
+            dispatches.
+
+        A request made by plan_shards carries a 'shard' and only dispatches the task sets in its index ranges. A request
+            {'resume': <checkpoint path>} resumes the request of that checkpoint.
+        """
+        if 'resume' in service_request:
+            return self.resume(service_request['resume'], job)
+        logger.info("Execute: Service description %s", service_request)
+        self.metrics.incr('requests')
         service_name = service_request['target_service']
         service_parameters = service_request['parameters']
-        service_response = self._compute(service_name, service_parameters)
+        # Shards were admitted as a whole when they were planned, jobs may have been admitted when they were queued.
+        limited = self.max_tasks is not None or self.max_level_tasks is not None
+        admitted = 'shard' in service_request or (job is not None and job.admitted)
+        if limited and not admitted:
+            self.check_admission(service_request)
+        if job is not None:
+            job.add_cancel_callback(lambda: self.in_flight.detach(job))
+        checkpoint = None
+        if self.checkpoint_dir is not None and self.scheduling != 'dag':
+            checkpoint_id = job.id if job is not None else uuid.uuid4().hex
+            checkpoint = self._open_checkpoint(os.path.join(self.checkpoint_dir, checkpoint_id + CHECKPOINT_SUFFIX), job)
+        service_response = self._compute(service_name, service_parameters, job, service_request.get('shard'), checkpoint)
         return service_response
 
+    def resume(self, path, job=None):
+        """
+        Resumes the request of a checkpoint left unfinished by a previous process. Tasks it had launched and that were
+            not reported finished are tracked again rather than relaunched, task sets it had dispatched are not expanded
+            or hashed again, and dispatching carries on from where it stopped. Tasks of executors that are not polled,
+            which ran in the previous process, are launched again. A checkpoint another hypervisor is resuming is left to
+            it, and the job is cancelled.
+        """
+        try:
+            checkpoint = self._open_checkpoint(path, job)
+        except CheckpointLocked:
+            logger.info("Checkpoint %s is held by another hypervisor, not resuming it", path)
+            if job is not None:
+                job.cancel()
+            return
+        if checkpoint.done:
+            checkpoint.remove()
+            return
+        if checkpoint.request is None:
+            # Stopped before the plan was written, nothing was dispatched.
+            checkpoint.cancel()
+            return
+        request = checkpoint.request
+        logger.info("Resume: %s from %s", request, path)
+        if job is not None:
+            job.request = dict(request, resume=path)
+            job.service_levels.update(checkpoint.service_levels)
+        waiters = [checkpoint] + ([job] if job is not None else [])
+        relaunch = []
+        for task_arn, task_descriptions in checkpoint.running().items():
+            if not self.executor_for(task_descriptions[0]['service_name']).polled:
+                # The process that ran the task is gone with the previous hypervisor.
+                relaunch.extend(task_descriptions)
+                continue
+            for task_description in task_descriptions:
+                if job is not None:
+                    job.task_dispatched(task_description)
+                self.in_flight.claim(task_description['dataId'], waiters)
+            self._launched_tasks[task_arn] = task_descriptions
+            self.tracker.track(task_arn, [d['dataId'] for d in task_descriptions])
+        if relaunch:
+            logger.info("Relaunching %s tasks of %s", len(relaunch), path)
+            self.compute_task_descriptions(relaunch, job, waiters, checkpoint)
+        self._compute(request['target_service'], request['parameters'], job, request.get('shard'), checkpoint)
+
+    def _open_checkpoint(self, path, job):
+        checkpoint = Checkpoint(path)
+        if job is not None:
+            def cancel():
+                self.in_flight.detach(checkpoint)
+                checkpoint.cancel()
+            job.add_cancel_callback(cancel)
+        return checkpoint
+
+    def plan_shards(self, service_request, shards):
+        """
+        Splits a request into shards requests, one per hypervisor process or node. Each shard expands, hashes and
+            dispatches its own index ranges of the level-by-level task space, and together they dispatch the same dataIds
+            as the whole request would.
+
+        The shards are only planned here, each has to be sent to the execute_service of another hypervisor, a node or
+            another server worker process. A hypervisor never splits a request across processes of its own, since the
+            tasks it launches are tracked, coalesced and counted in its jobs in the process that launched them.
+
+        :rtype: List of service requests, each with a 'shard' holding its index, the number of shards and its
+            {level: [start, stop]} ranges.
+        """
+        self.check_admission(service_request)
+        target = service_request['target_service']
+        s_e = self.build_expanded_service_sets(self.prune_parameters(target, service_request['parameters']))
+        preds = self.get_predecessor_levels(target)
+        space = TaskSpace(preds, s_e, self.build_lineages(self.registry.service_graph, set().union(*preds.values())))
+        return [dict(service_request, shard={'index': i, 'count': shards, 'ranges': ranges})
+                for i, ranges in enumerate(space.split(shards))]
+
+    def count_tasks(self, service_name, parameters):
+        """
+        Counts the tasks of a request from the lengths of its parameter lists and the graph, without expanding them. A
+            service has one task per combination of its parameter values, and a task set per combination of the tasks of
+            its lineage.
+
+        :rtype: Dictionary with the task sets per service, per level and in total.
+        """
+        parameters = self.prune_parameters(service_name, parameters)
+        combinations = {}
+        for service, service_parameters in parameters.items():
+            combinations[service] = 1
+            for values in service_parameters.values():
+                combinations[service] *= len(values)
+
+        preds = self.get_predecessor_levels(service_name)
+        lineages = self.build_lineages(self.registry.service_graph, set().union(*preds.values()))
+        services = {}
+        for service, lineage in lineages.items():
+            services[service] = 1
+            for s in lineage:
+                services[service] *= combinations[s]
+        levels = {level: sum(services[s] for s in level_services) for level, level_services in preds.items()}
+        return {'services': services, 'levels': levels, 'total': sum(levels.values())}
+
+    def check_admission(self, service_request):
+        """
+        Raises AdmissionError if the request would expand into more tasks than max_tasks, or than max_level_tasks at a
+            level.
+
+        :rtype: The task counts of the request.
+        """
+        self.registry.refresh_service_graph()
+        counts = self.count_tasks(service_request['target_service'], service_request['parameters'])
+        if self.max_tasks is not None and counts['total'] > self.max_tasks:
+            raise AdmissionError("Request expands into {} tasks, the limit is {}".format(counts['total'], self.max_tasks), counts)
+        for level, tasks in counts['levels'].items():
+            if self.max_level_tasks is not None and tasks > self.max_level_tasks:
+                raise AdmissionError("Level {} of the request has {} tasks, the limit is {}".format(level, tasks, self.max_level_tasks), counts)
+        return counts
+
+    def plan(self, service_request):
+        """
+        Dry run of a request. Task counts are computed from the parameter list lengths. Existing outputs are looked up
+            in the data registry, expanding the task sets a chunk at a time, when there are at most max_existing_check.
+
+        :rtype: Dictionary with the task counts, 'existing' outputs (None when not looked up), and whether the request
+            would be 'admitted' and the 'reason' when not.
+        """
+        try:
+            plan = self.check_admission(service_request)
+            plan.update(admitted=True, reason=None)
+        except AdmissionError as e:
+            plan = dict(e.plan, admitted=False, reason=str(e))
+
+        plan['existing'] = None
+        if plan['total'] <= self.max_existing_check:
+            target = service_request['target_service']
+            s_e = self.build_expanded_service_sets(self.prune_parameters(target, service_request['parameters']))
+            existing = 0
+            for level_tasks in self.iter_tasks_per_level(self.get_predecessor_levels(target), s_e).values():
+                for chunk in chunked(level_tasks, self.chunk_size):
+                    existing += len(self.find_materialized([self.build_task_description(task_set)['dataId'] for task_set in chunk]))
+            plan['existing'] = existing
+        return plan
+
+    def cache_stats(self):
+        """
+        Hit/miss counters of the hashing caches, and of the registry's data description cache when it has one.
+        """
+        stats = {'task_hashes': self.hash_cache.stats(), 'task_set_hashes': self.tshash_cache.stats()}
+        description_cache = getattr(self.registry, 'description_cache', None)
+        if description_cache is not None:
+            stats['data_descriptions'] = description_cache.stats()
+        return stats
+
+    def metrics_snapshot(self):
+        snapshot = self.metrics.snapshot()
+        snapshot['caches'] = self.cache_stats()
+        snapshot['in_flight'] = len(self.in_flight)
+        snapshot['queued'] = self.dispatcher.queued()
+        snapshot['running'] = len(self.dispatcher.running)
+        snapshot['tracked_tasks'] = self.tracker.active_count
+        return snapshot
+
     def pp_task_set(self, task_set):
         tshash = self.build_task_set_hash(task_set)
-        print("\tTask set: len({}) type({}) TSHash({})".format(len(task_set), type(task_set), tshash))
+        logger.debug("\tTask set: len(%s) type(%s) TSHash(%s)", len(task_set), type(task_set), tshash)
         for j, task in enumerate(task_set):
-            print("\t\tTask {} Hash {}: len({}) type({}) Service: {} \n\t\t\t{}".format(j, task['hash'], len(task), type(task), task['service'], task))
-        print()
+            logger.debug("\t\tTask %s Hash %s: len(%s) type(%s) Service: %s \n\t\t\t%s", j, task['hash'], len(task), type(task), task['service'], task)
 
 
     def pretty_print_tasks_by_level(self, tasks_by_level):
-        print("Tasks by Level Size:{}".format(len(tasks_by_level)))
+        # Walking every task set is the expensive part, so skip it entirely unless it would be logged.
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        logger.debug("Tasks by Level Size:%s", len(tasks_by_level))
         for key, value in tasks_by_level.items():
-            print("\nLevel {} Length {}".format(key, len(value)))
+            logger.debug("Level %s Length %s", key, len(value))
             for i, task_set in enumerate(value):
                 self.pp_task_set(task_set)
 
     def build_input_task_set_hashes(self, task_set):
         """
-        Note this only works on a linear graph right now, if there are multiple inputs to a single node it will likely get confused and build hashes out of order.
-        We'll need to add in a sense of lineage here for the sub-tasks to extend to multi-inputs. TODO tho :)
+        The task set is a lineage, one task of the service computed and of each of its ancestors in topological order. The
+            task set hash of each service is built from the tasks of its own lineage only, so on a linear graph these are
+            the prefixes of the task set, and on a graph with several inputs a service ignores the tasks of other branches.
 
         :rtype: returns a dictionary of {"service": "task_set_hash"}
         """
+        hashes = tuple(task['hash'] for task in task_set)
+        all_positions = self.build_lineage_positions(tuple(task['service'] for task in task_set))
+        if all_positions is None:
+            prefix_hashes = self.build_prefix_hashes(hashes)
+            return {task['service']: {'tshash': prefix_hashes[i], 'task_set': task_set[:i + 1]} for i, task in enumerate(task_set)}
+
         tshashes = {}
-        ts = []
-        for task in task_set:
-            print("Task as we build the task-set-hashed: {}".format(task))
-            service = task['service']
-            ts.append(task)
-            tshashes[service] = {'tshash': self.build_task_set_hash(ts), 'task_set': ts.copy()}
+        for task, positions in zip(task_set, all_positions):
+            tshashes[task['service']] = {'tshash': self.build_prefix_hashes(tuple(hashes[j] for j in positions))[-1],
+                                         'task_set': [task_set[j] for j in positions]}
         return tshashes
 
+    def build_lineage_positions(self, services):
+        """
+        Where the lineage of each service sits in a lineage of services, cached per lineage and graph version.
+
+        :rtype: List of lists of positions, or None when the lineage is a chain and every lineage is a prefix.
+        """
+        if self.registry is None:
+            # Without a service graph task sets can only be taken as chains.
+            return None
+        key = (getattr(self.registry, 'graph_version', None), services)
+        if key not in self._lineage_positions:
+            all_positions = []
+            for i, service in enumerate(services):
+                own = self.get_ancestors_and_self(service)
+                all_positions.append([j for j in range(i + 1) if services[j] in own])
+            is_chain = all(len(positions) == i + 1 for i, positions in enumerate(all_positions))
+            self._lineage_positions[key] = None if is_chain else all_positions
+        return self._lineage_positions[key]
+
+    @property
+    def graph_lock(self):
+        """
+        The registry's graph lock, so the service graph doesn't change under a request being planned while another
+            thread registers or refreshes services.
+        """
+        return getattr(self.registry, 'graph_lock', None) or self._graph_lock
+
+    def get_ancestors_and_self(self, service_name):
+        lookup = getattr(self.registry, 'get_ancestors_and_self', None)
+        if lookup is not None:
+            return lookup(service_name)
+        with self.graph_lock:
+            return nx.ancestors(self.registry.service_graph, service_name) | {service_name}
+
+    def build_prefix_hashes(self, lineage):
+        """
+        Returns the task set hash of every prefix of a lineage of task hashes, i.e. the same values build_task_set_hash
+            gives for task_set[:1], task_set[:2], ... Lineages are cached, and a miss extends the cached prefixes of
+            the parent lineage, so each task set only adds its own hash.
+
+        :rtype: Tuple of strings of type "hash1/", "hash1/hash2/", ...
+        """
+        if not lineage:
+            return ()
+        prefix_hashes = self.tshash_cache.get(lineage)
+        if prefix_hashes is None:
+            parent_hashes = self.build_prefix_hashes(lineage[:-1])
+            previous = parent_hashes[-1] if parent_hashes else ''
+            prefix_hashes = parent_hashes + (previous + lineage[-1] + '/',)
+            self.tshash_cache.put(lineage, prefix_hashes)
+        return prefix_hashes
+
     def build_task_set_hash(self, task_set):
         """
         Makes a combined hash of the hashes of the sub-components for the overall task.
@@ -67,28 +435,86 @@ class Hypervisor():
 
     def hash_single_service(self, p):
         """
-        Makes a hash out of an individual tasks parameters.
+        Makes a hash out of an individual tasks parameters. Hashes are cached on the parameters themselves.
 
         """
+        return self.hash_cache.get_or_compute(freeze(p), lambda: self._hash_parameters(p))
 
+    def _hash_parameters(self, p):
         s2 = json.dumps(p, sort_keys=True)
         s3 = repr(s2)
         s4 = make_hash(s3)
         s5 = str(s4)
         return s5
 
-    def _compute(self, service_name, parameters):
-        print("Received request to compute for service: {} with parameters: {}\n".format(service_name, parameters))
+    def _compute(self, service_name, parameters, job=None, shard=None, checkpoint=None):
+        logger.info("Received request to compute for service: %s with parameters: %s", service_name, parameters)
+        with self.metrics.timer('registry'):
+            self.registry.refresh_service_graph()
+
+        with self.metrics.timer('expansion'):
+            s_e = self.build_expanded_service_sets(self.prune_parameters(service_name, parameters))
+        logger.debug("Expanded service sets: %s", s_e)
 
-        s_e = self.build_expanded_service_sets(parameters)
-        print("Expanded service sets: {}".format(s_e))
+        with self.metrics.timer('planning'):
+            preds = self.get_predecessor_levels(service_name)
+        logger.debug("Predecessor Dictionary: %s", preds)
+        service_levels = {}
+        for level, services in preds.items():
+            for service in services:
+                service_levels[service] = max(level, service_levels.get(service, level))
+        if job is not None:
+            job.service_levels.update(service_levels)
+        self.history.load(set().union(*preds.values()))
+        critical_paths = self.critical_paths(preds)
 
-        preds = self.build_predecessor_level_dict(self.registry.service_graph, service_name)
-        print("Predecessor Dictionary: {}".format(preds))
-        tasks_by_level = self.build_tasks_per_level(preds, s_e)
-        self.pretty_print_tasks_by_level(tasks_by_level)
+        # Shards are ranges of the level-by-level task space, so they are always dispatched level by level.
+        if checkpoint is not None:
+            lineages = self.build_lineages(self.registry.service_graph, set().union(*preds.values()))
+            if checkpoint.request is None:
+                # Shards index the task space in name order, like every other node. A resumed request keeps the order
+                # it was started with, its cursors are indexes in it.
+                orders = None
+                if shard is None:
+                    orders = {level: self.level_order(services, critical_paths) for level, services in preds.items()}
+                space = TaskSpace(preds, s_e, lineages, orders)
+                if shard is not None:
+                    ranges = {int(level): r for level, r in shard['ranges'].items()}
+                else:
+                    ranges = {level: [0, space.level_size(level)] for level in space.levels}
+                request = {'target_service': service_name, 'parameters': parameters}
+                if shard is not None:
+                    request['shard'] = shard
+                if job is not None:
+                    # So a resumed request keeps its dispatch flow.
+                    request.update((k, job.request[k]) for k in REQUEST_FLOW_FIELDS if k in job.request)
+                checkpoint.start(request, ranges, service_levels, orders)
+            else:
+                space = TaskSpace(preds, s_e, lineages, checkpoint.orders)
+            return self.compute_checkpointed(space, checkpoint, job)
+        elif shard is not None:
+            space = TaskSpace(preds, s_e, self.build_lineages(self.registry.service_graph, set().union(*preds.values())))
+            tasks_by_level = {}
+            for level, (start, stop) in sorted((int(level), r) for level, r in shard['ranges'].items()):
+                tasks_by_level[level] = space.iter_range(level, start, stop)
+        elif self.scheduling == 'dag':
+            return self.compute_task_graph(service_name, s_e, job, critical_paths)
+        elif self.streaming:
+            tasks_by_level = self.iter_tasks_per_level(preds, s_e, critical_paths=critical_paths)
+        else:
+            with self.metrics.timer('expansion'):
+                tasks_by_level = self.build_tasks_per_level(preds, s_e, critical_paths=critical_paths)
+            self.pretty_print_tasks_by_level(tasks_by_level)
 
-        self.compute_tasks_by_level(tasks_by_level)
+        self.compute_tasks_by_level(tasks_by_level, job)
+
+    def prune_parameters(self, service_name, parameters):
+        """
+        Keeps the parameters the target service and its ancestors declare, so undeclared ones don't multiply the tasks.
+            Every one of these services gets an entry, empty if the request gives it no parameters.
+        """
+        with self.graph_lock:
+            return get_required_parameters(self.get_ancestors_and_self(service_name), parameters, self.registry.service_graph)
 
     def build_expanded_service_sets(self, parameters):
         """
@@ -98,8 +524,11 @@ class Hypervisor():
         """
         expanded_service_sets = {}
         for service, sp in parameters.items():
-            combos = list(itertools.product(*sp.values()))
-            keyed_combos = tuple(map(lambda values: dict(zip(sp.keys(), values)), combos))
+            # Parameters are expanded in name order, not in the order the registry or the request lists them, so the
+            # task set at an index of a TaskSpace is the same on every node and after a restart.
+            names = sorted(sp)
+            combos = list(itertools.product(*(sp[name] for name in names)))
+            keyed_combos = tuple(map(lambda values: dict(zip(names, values)), combos))
             expanded_service_sets[service] = keyed_combos
 
         s_e_hash = {}
@@ -118,66 +547,131 @@ class Hypervisor():
         Traverses the graph and returns a dictionary of each level of the graph,
             starting from the source node and working its way up along predecessors.
         """
-        level = 0
-        predecessors = {}
-        done = False
-        currentLevel = set([source])
-        nextLevel = set()
+        return build_predecessor_levels(graph, source)
+
+    def get_predecessor_levels(self, service_name):
+        """
+        build_predecessor_level_dict on the registry's service graph, looked up in the registry's graph index when it
+            keeps one.
+        """
+        lookup = getattr(self.registry, 'get_predecessor_levels', None)
+        if lookup is not None:
+            return lookup(service_name)
+        with self.graph_lock:
+            return self.build_predecessor_level_dict(self.registry.service_graph, service_name)
 
+    def build_lineages(self, graph, services):
+        """
+        The lineage of a service is the service and its ancestors, in lexicographical topological order. services must
+            include the ancestors of each of its services.
 
-        # TODO This isn't perfect, as it won't do secondary chains that are shorter before we reach their level. But that's okay.
-        while not done:
-            predecessors[level] = currentLevel
-            level += 1
-            for current in currentLevel:
-                for p in graph.predecessors(current):
-                    nextLevel.add(p)
-            if len(nextLevel) == 0:
-                done = True
-            currentLevel = nextLevel
-            nextLevel = set()
-        reversed_predecessors = {}
-        for k, v in predecessors.items():
-            reversed_predecessors[level-1-k] = v
-        return reversed_predecessors
-
-    def build_tasks_per_level(self, preds, s_e):
+        :rtype: Dictionary of {"service": [lineage]}
         """
-        
+        lineages = {}
+        with self.graph_lock:
+            order = list(nx.lexicographical_topological_sort(graph.subgraph(services)))
+            for service in order:
+                ancestors = nx.ancestors(graph, service)
+                lineages[service] = [s for s in order if s in ancestors or s == service]
+        return lineages
+
+    def build_tasks_per_level(self, preds, s_e, graph=None, critical_paths=None):
+        """
+        A task set of a service picks one task of the service and one of each of its ancestors, so tasks of services on
+            other branches of the graph are never multiplied in. graph defaults to the registry's service graph.
+
         :rtype: Dictionary of levels, with each level containing a list of tasks to be computed at that level.
         """
-        
-        start_level = 0
-        level = start_level
-        done = False
-        tasks_by_level = {}
-        while not done:
-            level_services = preds[level]
-            tasks_by_level[level] = []
-            for service in level_services:
-                task_set = s_e[service]
-                for new_task in task_set:
-                    if level > 0:
-                        for previous_tasks in tasks_by_level[level-1]:
-                            pt_copy = previous_tasks.copy()
-                            pt_copy.append(new_task)
-                            tasks_by_level[level].append(pt_copy)
-                    else:
-                        tasks_by_level[level].append([new_task])
+        return {level: list(task_sets) for level, task_sets in self.iter_tasks_per_level(preds, s_e, graph, critical_paths).items()}
 
-            level += 1
-            if level not in preds:
-                done=True
+    def iter_tasks_per_level(self, preds, s_e, graph=None, critical_paths=None):
+        """
+        Lazy version of build_tasks_per_level. Nothing is expanded up front, each level is a generator that yields
+            its task sets one at a time, in the same order build_tasks_per_level would list them.
 
+        :rtype: Dictionary of levels, with each level containing a generator of task sets to be computed at that level.
+        """
+        if graph is None:
+            graph = self.registry.service_graph
+        lineages = self.build_lineages(graph, set().union(*preds.values()))
+        tasks_by_level = {}
+        level = 0
+        while level in preds:
+            tasks_by_level[level] = self.iter_level_task_sets(preds, s_e, level, lineages, critical_paths)
+            level += 1
         return tasks_by_level
 
+    def iter_level_task_sets(self, preds, s_e, level, lineages, critical_paths=None):
+        """
+        Yields the task sets of a single level, service by service in name order, or longest critical path first when
+            critical_paths are given. The task sets of a service are the product of the tasks of its lineage. Only the
+            per service task lists are held in memory, never the product.
+        """
+        for service in self.level_order(preds[level], critical_paths):
+            for task_set in itertools.product(*(s_e[s] for s in lineages[service])):
+                yield list(task_set)
+
+    def level_order(self, services, critical_paths=None):
+        """
+        :rtype: List of the services of a level, longest critical path first, then by name.
+        """
+        critical_paths = critical_paths or {}
+        return sorted(services, key=lambda s: (-critical_paths.get(s, 0), s))
+
+    def critical_paths(self, preds):
+        """
+        The predicted time from the start of each service's tasks to the end of the request, along the slowest chain of
+            services downstream of it. Services that have never run count as taking no time.
+
+        :rtype: Dictionary of {service: seconds}
+        """
+        graph = self.registry.service_graph
+        critical_paths = {}
+        with self.graph_lock:
+            for level in sorted(preds, reverse=True):
+                for service in preds[level]:
+                    downstream = [critical_paths[s] for s in graph.successors(service) if s in critical_paths]
+                    critical_paths[service] = (self.history.predict(service) or 0) + max(downstream, default=0)
+        return critical_paths
+
+    def predict_runtime(self, task_description):
+        service_name = task_description['service_name']
+        return self.history.predict(service_name, task_description['parameters'].get(service_name)) or 0
 
-    def compute_tasks_by_level(self, tasks_by_level):
+    def compute_tasks_by_level(self, tasks_by_level, job=None):
         for level, level_tasks in tasks_by_level.items():
-            print("Level: {}".format(level))
+            logger.info("Level: %s", level)
             if level >= 0:
-                for task_set in level_tasks:
-                    self.compute_task(task_set)
+                chunks = chunked(level_tasks, self.chunk_size)
+                while True:
+                    # In streaming mode this is where the task sets are expanded.
+                    with self.metrics.timer('expansion'):
+                        chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    if job is not None:
+                        job.raise_if_cancelled()
+                    self.compute_tasks(chunk, job)
+
+    def compute_checkpointed(self, space, checkpoint, job=None):
+        """
+        Dispatches the task sets of the checkpoint's ranges left after its cursors, a chunk at a time, recording each
+            chunk once it has been dispatched. Task sets are decoded from the task space a chunk at a time, so
+            checkpointed requests are always expanded as lazily as in streaming mode, whatever streaming is set to.
+        """
+        for level in sorted(checkpoint.ranges):
+            logger.info("Level: %s", level)
+            stop = checkpoint.ranges[level][1]
+            for chunk_start in range(checkpoint.cursors[level], stop, self.chunk_size):
+                chunk_stop = min(chunk_start + self.chunk_size, stop)
+                with self.metrics.timer('expansion'):
+                    chunk = list(space.iter_range(level, chunk_start, chunk_stop))
+                if job is not None:
+                    job.raise_if_cancelled()
+                self.compute_tasks(chunk, job, checkpoint)
+                checkpoint.chunk_dispatched(level, chunk_stop)
+        if not checkpoint.dispatched:
+            checkpoint.all_dispatched()
 
     def pp_tshashes(self, tshashes, service=None):
         for service, tshash in tshashes.items():
@@ -185,6 +679,427 @@ class Hypervisor():
             task_set = tshash['task_set']
 
     def compute_task(self, task_set):
+        return self.compute_tasks([task_set])
+
+    def compute_tasks(self, task_sets, job=None, checkpoint=None):
+        """
+        Builds the task descriptions of a batch of task sets and dispatches them. In reuse mode the registry is checked
+            for the whole batch first and only the outputs that don't exist yet are computed.
+
+        With a checkpoint, task sets it records as completed are skipped, and the tasks launched are recorded in it.
+        """
+        with self.metrics.timer('hashing'):
+            task_descriptions = [self.build_task_description(task_set) for task_set in task_sets]
+        if checkpoint is not None:
+            # Tasks resumed from the checkpoint are already followed and counted.
+            task_descriptions = [d for d in task_descriptions
+                                 if not checkpoint.completed(d['dataId']) and not checkpoint.is_running(d['dataId'])]
+        self.metrics.incr('tasks_planned', len(task_descriptions))
+        if job is not None:
+            for task_description in task_descriptions:
+                job.count(job.level_of(task_description), 'planned')
+        if self.reuse_outputs:
+            missing = self.filter_materialized(task_descriptions)
+            self.metrics.incr('tasks_skipped', len(task_descriptions) - len(missing))
+            if job is not None:
+                missing_ids = set(d['dataId'] for d in missing)
+                for task_description in task_descriptions:
+                    if task_description['dataId'] not in missing_ids:
+                        job.count(job.level_of(task_description), 'skipped')
+            task_descriptions = missing
+        if self.history.samples:
+            # Longest tasks first, so they aren't the ones left running at the end of the level.
+            task_descriptions = sorted(task_descriptions, key=self.predict_runtime, reverse=True)
+        waiters = [w for w in (job, checkpoint) if w is not None]
+        return self.compute_task_descriptions(task_descriptions, job, waiters, checkpoint)
+
+    def compute_task_descriptions(self, task_descriptions, job=None, waiters=(), checkpoint=None, wait=True):
+        """
+        Bundles and launches task descriptions. Task descriptions already in flight for another request are not launched
+            again, the waiters are attached to the running task instead. Waiters are told when each task finishes.
+
+        Under a running task cap the launches may wait for running tasks to stop. DAG mode dispatches from the thread
+            that reports them stopped, so it queues its launches without waiting, wait=False, and gets no results back.
+
+        :rtype: List of DispatchResult, one per launched bundle, with the bundle's task descriptions as the item.
+        """
+        launch = []
+        for task_description in task_descriptions:
+            if job is not None:
+                job.task_dispatched(task_description)
+            if self.in_flight.claim(task_description['dataId'], waiters):
+                launch.append(task_description)
+            else:
+                logger.debug("Attaching to in flight task %s", task_description['dataId'])
+                self.metrics.incr('tasks_attached')
+                if job is not None:
+                    job.count(job.level_of(task_description), 'attached')
+
+        if self.offload_payloads:
+            self.offload(launch)
+        with self.metrics.timer('planning'):
+            bundles = self.build_bundles(launch)
+        # Launched tasks are tracked as they are launched, so their stops free running task slots for the rest.
+        flow, weight, priority = self.flow_of(job)
+        entries = self.dispatcher.submit(self._run_bundle, bundles, lambda result: self._on_dispatched(result, checkpoint),
+                                         flow=flow, weight=weight, priority=priority, cost=len)
+        if not wait:
+            return []
+        with self.metrics.timer('dispatch'):
+            return self.dispatcher.wait(entries)
+
+    def flow_of(self, job):
+        """
+        The dispatch flow of a request, its requester or else its request_name, with the requester's weight and the
+            request's priority. Every request without a name shares one flow.
+
+        :rtype: Tuple of (flow, weight, priority).
+        """
+        if job is None:
+            return DEFAULT_FLOW, self.flow_weights.get(DEFAULT_FLOW, 1), 0
+        request = job.request
+        flow = request.get('requester') or request.get('request_name') or DEFAULT_FLOW
+        return flow, self.flow_weights.get(flow, 1), int(request.get('priority', 0))
+
+    def _on_dispatched(self, result, checkpoint=None):
+        for task_description in result.item:
+            self._payload_refs.pop(task_description['dataId'], None)
+            record = self.record_dispatch_result(task_description, result)
+            if self.reuse_outputs and record['taskArns']:
+                self.pending_outputs[task_description['dataId']] = task_description
+        # The tasks of a bundle share its ARNs.
+        polled = self.executor_for(result.item[0]['service_name']).polled
+        for task_arn in record['taskArns']:
+            self._launched_tasks[task_arn] = result.item
+            if checkpoint is not None:
+                checkpoint.task_launched(task_arn, result.item)
+            self.tracker.track(task_arn, [d['dataId'] for d in result.item], poll=polled)
+        if record['taskArns']:
+            self.metrics.incr('bundles_launched')
+            self.metrics.incr('tasks_dispatched', len(result.item))
+        else:
+            self.metrics.incr('ecs_errors')
+            self.release_payloads([d['dataId'] for d in result.item])
+            for task_description in result.item:
+                self.in_flight.finish(task_description['dataId'], False)
+
+    def executor_for(self, service_name):
+        if callable(self.backends):
+            backend = self.backends(service_name)
+        else:
+            backend = self.backends.get(service_name, self.default_backend)
+        return self.executors[backend]
+
+    def _run_bundle(self, bundle):
+        return self.executor_for(bundle[0]['service_name']).run(bundle)
+
+    def start_completion_tracking(self):
+        self.tracker.start()
+
+    def _on_tasks_stopped(self, stopped):
+        """
+        Settles the tasks the tracker found stopped in one poll, [(task ARN, state)], and reports their dataIds together,
+            so their outputs are registered in one batch.
+        """
+        results = {}
+        for task_arn, task in stopped:
+            for data_id, succeeded in self._on_task_stopped(task_arn, task).items():
+                results[data_id] = results.get(data_id, False) or succeeded
+        self.notify_completed_many(results)
+
+    def _on_task_stopped(self, task_arn, task):
+        """
+        :rtype: Dictionary of {dataId: succeeded} of the dataIds of the task to report.
+        """
+        self.dispatcher.release(task_arn)
+        launched = self._launched_tasks.pop(task_arn, None)
+        self.release_payloads(task['dataIds'])
+        if self.speculator.stopped_as_loser(task_arn):
+            return {}
+        succeeded = CompletionTracker.succeeded(task)
+        results = {data_id: succeeded for data_id in task['dataIds']}
+        if not succeeded and launched and len(launched) > 1:
+            # The container of a bundle fails if any of its tasks failed, each task's own exit code is in its status
+            # object. Tasks that didn't write one fail with the container.
+            for data_id, exit_code in self.executor_for(launched[0]['service_name']).exit_codes(launched).items():
+                results[data_id] = exit_code == 0
+        # dataIds another copy already settled are not reported, or counted, again.
+        results = self.speculator.settle(task_arn, results)
+        completed = sum(results.values())
+        if completed:
+            self.metrics.incr('tasks_completed', completed)
+        if completed < len(results):
+            self.metrics.incr('tasks_failed', len(results) - completed)
+        runtime = CompletionTracker.runtime(task)
+        if succeeded and launched and runtime is not None:
+            # The tasks of a bundle run one after the other.
+            for d in launched:
+                self.history.record(d['service_name'], d['parameters'].get(d['service_name'], {}), runtime / len(launched))
+        if not succeeded:
+            logger.warning("Task %s stopped with exit code %s: %s", task_arn, task['exitCode'], task['stoppedReason'])
+        return results
+
+    def speculate(self, now=None):
+        """
+        Launches a copy of every running task that has been running speculation_factor times longer than its service's
+            speculation_percentile runtime, per task for bundles. Each task gets at most one copy, launched ahead of
+            everything queued.
+
+        :rtype: Number of copies launched.
+        """
+        now = now if now is not None else time.time()
+        stragglers = self.speculator.stragglers(self.tracker.active(), now)
+        if stragglers:
+            logger.info("Speculatively relaunching %s", [d['dataId'] for d in stragglers])
+            self.metrics.incr('tasks_speculated', len(stragglers))
+            self.dispatcher.submit(self._run_bundle, [[d] for d in stragglers], self._on_speculated,
+                                   flow='speculative', priority=SPECULATION_PRIORITY)
+        return len(stragglers)
+
+    def _on_speculated(self, result):
+        task_description = result.item[0]
+        data_id = task_description['dataId']
+        task_arns = [task['taskArn'] for task in (result.response or {}).get('tasks', [])]
+        if not task_arns:
+            # The original keeps running on its own.
+            logger.warning("Speculative copy of %s failed to launch: %s", data_id, result.error or (result.response or {}).get('failures'))
+            return
+        task_arn = task_arns[0]
+        needed = self.speculator.copy_launched(data_id, task_arn)
+        self._launched_tasks[task_arn] = result.item
+        polled = self.executor_for(task_description['service_name']).polled
+        self.tracker.track(task_arn, [data_id], poll=polled)
+        if not needed:
+            # The original finished while the copy was launching.
+            self.speculator.stop(task_arn, task_description['service_name'])
+
+    def _stop_task(self, task_arn, service_name):
+        try:
+            self.executor_for(service_name).stop(task_arn)
+        except Exception as e:
+            logger.warning("Failed to stop Task %s: %s", task_arn, e)
+
+    def build_bundles(self, task_descriptions):
+        """
+        Groups task descriptions by service, in order, into bundles of at most bundle_size. In 'auto' mode a bundle grows
+            until its container command would no longer fit in the ECS overrides limit.
+
+        :rtype: List of lists of task descriptions.
+        """
+        if self.bundle_size == 1:
+            return [[task_description] for task_description in task_descriptions]
+
+        by_service = {}
+        for task_description in task_descriptions:
+            by_service.setdefault(task_description['service_name'], []).append(task_description)
+
+        bundles = []
+        for service_name, service_descriptions in by_service.items():
+            max_size = self.bundle_limit(service_name)
+            bundle = []
+            bundle_bytes = len(json.dumps(self._build_bundle_command([])))
+            for task_description in service_descriptions:
+                item_bytes = len(json.dumps(self._build_bundle_item_command(task_description)))
+                too_big = self.bundle_size == 'auto' and bundle_bytes + item_bytes > MAX_OVERRIDE_BYTES
+                if bundle and (len(bundle) == max_size or too_big):
+                    bundles.append(bundle)
+                    bundle = []
+                    bundle_bytes = len(json.dumps(self._build_bundle_command([])))
+                bundle.append(task_description)
+                bundle_bytes += item_bytes
+            if bundle:
+                bundles.append(bundle)
+        return bundles
+
+    def bundle_limit(self, service_name):
+        """
+        The most task descriptions of a service bundled together. In 'auto' mode, as many as run in about bundle_seconds
+            where the service's runtime is known, so long tasks run in parallel and short ones share a container.
+        """
+        if self.bundle_size != 'auto':
+            return self.bundle_size
+        predicted = self.history.predict(service_name)
+        if not predicted:
+            return MAX_AUTO_BUNDLE_SIZE
+        return max(1, min(MAX_AUTO_BUNDLE_SIZE, int(self.bundle_seconds // predicted)))
+
+    def build_task_graph(self, graph, target, s_e):
+        """
+        Expands the tasks of the target service and all of its ancestors as a DAG, for services with any number of
+            inputs. A task of a service picks one task of itself and of each of its ancestors, its lineage, so a service
+            is only ever combined with its real ancestors, and a task shared by several inputs is the same for all of them.
+            Lineages are in topological order, so on a linear chain the hashes are the same as build_task_description's.
+
+        :rtype: Generator of (task description, dataIds of the direct upstream tasks), upstream tasks first.
+        """
+        lineages = self.build_lineages(graph, nx.ancestors(graph, target) | {target})
+
+        for service in lineages:
+            lineage = lineages[service]
+            # Where each ancestor's own lineage sits within this one.
+            positions = {}
+            for ancestor in lineage[:-1]:
+                positions[ancestor] = [lineage.index(s) for s in lineages[ancestor]]
+
+            for task_set in itertools.product(*(s_e[s] for s in lineage)):
+                hashes = tuple(task['hash'] for task in task_set)
+                input_hashes = {}
+                for ancestor, ancestor_positions in positions.items():
+                    input_hashes[ancestor] = self.build_prefix_hashes(tuple(hashes[i] for i in ancestor_positions))[-1]
+                output_hash = self.build_prefix_hashes(hashes)[-1]
+
+                param_dict = {}
+                for t in task_set:
+                    param_dict.update(t['task'])
+                parameters = {service: param_dict}
+
+                task_description = self.registry.build_data_description_from_task(service, input_hashes, output_hash, parameters)
+                upstream = [self.registry.make_data_id(p, input_hashes[p]) for p in graph.predecessors(service)]
+                yield task_description, upstream
+
+    def compute_task_graph(self, service_name, s_e, job=None, critical_paths=None):
+        """
+        Schedules the task graph of a request without level barriers. Tasks without inputs are dispatched straight away,
+            the rest as notify_completed reports their inputs done. Ready tasks on the longest critical paths go first.
+        """
+        critical_paths = critical_paths or {}
+
+        def priority(task_description):
+            service = task_description['service_name']
+            downstream = critical_paths.get(service, 0) - (self.history.predict(service) or 0)
+            return downstream + self.predict_runtime(task_description)
+        scheduler = DAGScheduler(lambda task_descriptions: self._dispatch_scheduled(task_descriptions, scheduler, job),
+                                 priority=priority if any(critical_paths.values()) else None)
+        with self.metrics.timer('planning'), self.graph_lock:
+            task_graph = list(self.build_task_graph(self.registry.service_graph, service_name, s_e))
+        self.metrics.incr('tasks_planned', len(task_graph))
+        materialized = set()
+        if self.reuse_outputs:
+            for chunk in chunked([d['dataId'] for d, _ in task_graph], self.chunk_size):
+                materialized |= self.find_materialized(chunk)
+            self.metrics.incr('tasks_skipped', len(materialized))
+        for task_description, upstream in task_graph:
+            completed = task_description['dataId'] in materialized
+            scheduler.add_task(task_description, upstream, completed=completed)
+            if job is not None:
+                job.count(job.level_of(task_description), 'planned')
+                if completed:
+                    job.count(job.level_of(task_description), 'skipped')
+
+        if job is not None:
+            job.add_cancel_callback(lambda: self.in_flight.detach(scheduler))
+        scheduler.start()
+        return scheduler
+
+    def _dispatch_scheduled(self, task_descriptions, scheduler, job=None):
+        """
+        Launch failures reach the scheduler as failed completions, so only a cancelled job returns dataIds to fail here.
+        """
+        if job is not None and job.cancelled:
+            return [d['dataId'] for d in task_descriptions]
+        # The scheduler hears of completions before the job, so the job never sees a moment with nothing outstanding.
+        waiters = [scheduler] if job is None else [scheduler, job]
+        wait = self.dispatcher.max_running is None
+        for chunk in chunked(task_descriptions, self.chunk_size):
+            self.compute_task_descriptions(chunk, job, waiters, wait=wait)
+        return []
+
+    def notify_completed(self, data_id, succeeded=True):
+        """
+        Reports a dispatched task as finished. Its output is registered in reuse mode, and every request waiting on it is
+            told, which in DAG mode releases the tasks downstream of it, or fails them along with it.
+        """
+        self.notify_completed_many({data_id: succeeded})
+
+    def notify_completed_many(self, results):
+        """
+        notify_completed for {dataId: succeeded}. In reuse mode the outputs of all of them are registered in one batch.
+        """
+        if self.reuse_outputs:
+            self.mark_outputs_completed([data_id for data_id, succeeded in results.items() if succeeded])
+        for data_id, succeeded in results.items():
+            if not succeeded:
+                self.pending_outputs.pop(data_id, None)
+        for data_id, succeeded in results.items():
+            self.in_flight.finish(data_id, succeeded)
+
+    def _on_abandoned(self, data_id):
+        """
+        Stops the task of a dataId no request waits for any more, unless it is a bundle other dataIds still need.
+        """
+        task = self.tracker.status_of(data_id)
+        if task is None or task['status'] == 'STOPPED':
+            return
+        if any(d in self.in_flight for d in task['dataIds']):
+            return
+        logger.info("Stopping Task %s, no request waits for %s", task['taskArn'], task['dataIds'])
+        for d in task['dataIds']:
+            self.pending_outputs.pop(d, None)
+        # dataIds are "<service name>/<task set hash>".
+        service_name = data_id.split('/', 1)[0]
+        for task_arn in self.speculator.abandoned(data_id) | {task['taskArn']}:
+            self._stop_task(task_arn, service_name)
+
+    def record_dispatch_result(self, task_description, result):
+        """
+        Keeps the launched task ARNs, or the ECS failures or exception, of a dispatched task description. Task descriptions
+            launched in the same bundle share its ARN.
+        """
+        data_id = task_description['dataId']
+        response = result.response or {}
+        record = {
+            'taskArns': [task['taskArn'] for task in response.get('tasks', [])],
+            'failures': response.get('failures', []),
+            'error': None if result.error is None else str(result.error),
+            'bundleSize': len(result.item)
+        }
+        if record['error'] is not None or record['failures']:
+            logger.warning("ECS Task %s failed to launch: %s %s", data_id, record['error'], record['failures'])
+        with self._lock:
+            self.dispatch_results[data_id] = record
+            self.dispatch_results.move_to_end(data_id)
+            while len(self.dispatch_results) > self.max_dispatch_results:
+                self.dispatch_results.popitem(last=False)
+        return record
+
+    def filter_materialized(self, task_descriptions):
+        """
+        Drops the task descriptions whose dataId was already produced by an earlier run.
+        """
+        materialized = self.find_materialized([d['dataId'] for d in task_descriptions])
+        missing = []
+        for task_description in task_descriptions:
+            if task_description['dataId'] in materialized:
+                logger.debug("Reusing existing output %s", task_description['dataId'])
+            else:
+                missing.append(task_description)
+        return missing
+
+    def find_materialized(self, data_ids):
+        """
+        :rtype: Set of the dataIds that already exist in the data registry.
+        """
+        with self.metrics.timer('registry'):
+            return set(self.registry.get_data_many(data_ids))
+
+    def mark_output_completed(self, data_id):
+        """
+        Records the output of a dispatched task in the data registry once it has completed, so later runs reuse it.
+        """
+        return self.mark_outputs_completed([data_id])
+
+    def mark_outputs_completed(self, data_ids):
+        task_descriptions = []
+        for data_id in data_ids:
+            task_description = self.pending_outputs.pop(data_id, None)
+            if task_description is not None:
+                task_descriptions.append(task_description)
+        if not task_descriptions:
+            return False
+        with self.metrics.timer('registry'):
+            return self.registry.put_data_many(task_descriptions)
+
+    def build_task_description(self, task_set):
         service_name = task_set[-1]['service']
         tshashes = self.build_input_task_set_hashes(task_set)
         self.pp_tshashes(tshashes, service_name)
@@ -202,16 +1117,82 @@ class Hypervisor():
 
         task_description = self.registry.build_data_description_from_task(service_name, input_hashes, output_hash, parameters)
         
-        print(task_description)
-        print("\n\n")
+        logger.debug("%s", task_description)
+
+        return task_description
+
+    def offload(self, task_descriptions):
+        """
+        Writes the task descriptions to a single payload object in BASE_BUCKET, and remembers each one's location and
+            index for the container commands. If the write fails the task descriptions are passed inline as usual.
+
+        :rtype: The s3:// location of the payload, or None.
+        """
+        if not task_descriptions:
+            return None
+        key = PAYLOAD_PREFIX + make_hash("".join(d['dataId'] for d in task_descriptions)) + '.json'
+        try:
+            with self.metrics.timer('registry'):
+                self.s3_client.put_object(Bucket=self.BASE_BUCKET, Key=key,
+                                          Body=json.dumps(task_descriptions, default=json_default).encode())
+        except Exception as e:
+            logger.warning("Payload upload to %s failed, passing task descriptions inline: %s", key, e)
+            return None
+        location = "s3://" + self.BASE_BUCKET + "/" + key
+        with self._lock:
+            for i, task_description in enumerate(task_descriptions):
+                self._payload_refs[task_description['dataId']] = (location, i)
+                # A dataId launched again, e.g. as a speculative copy, keeps the payload of its earlier launch too.
+                self._payload_keys.setdefault(task_description['dataId'], []).append(key)
+            self._payload_tasks[key] = self._payload_tasks.get(key, 0) + len(task_descriptions)
+        self.metrics.incr('payloads_offloaded')
+        return location
 
-        self._compute_single_service(task_description)
+    def release_payloads(self, data_ids):
+        """
+        Deletes the payload objects whose tasks have all stopped, or failed to launch, once these dataIds are done.
+        """
+        done = []
+        with self._lock:
+            for data_id in data_ids:
+                keys = self._payload_keys.get(data_id)
+                if not keys:
+                    continue
+                key = keys.pop(0)
+                if not keys:
+                    del self._payload_keys[data_id]
+                self._payload_tasks[key] -= 1
+                if not self._payload_tasks[key]:
+                    del self._payload_tasks[key]
+                    done.append(key)
+        for key in done:
+            try:
+                self.s3_client.delete_object(Bucket=self.BASE_BUCKET, Key=key)
+            except Exception as e:
+                logger.warning("Payload %s could not be deleted: %s", key, e)
+
+    def _build_task_arguments(self, parameters):
+        ref = self._payload_refs.get(parameters['dataId'])
+        if ref is not None:
+            return "--payload={} --payload-index={}".format(*ref)
+        return "--parameters='{}'".format(json.dumps(parameters)).replace("\"", "\\\"")
+
+    def _build_command_prefix(self):
+        return DIAGNOSTICS_COMMAND if self.diagnostics else "cd /app "
+
+    def _compute_bundle(self, bundle, taskDefinition="ClimateTaskCF"):
+        if len(bundle) == 1:
+            return self._compute_single_service(bundle[0], taskDefinition)
+        logger.info("Calling bundle of %s %s tasks: %s", len(bundle), bundle[0]['service_name'], [d['dataId'] for d in bundle])
+        return self._run_task(self._build_bundle_command(bundle), "bundle of {}".format(len(bundle)), taskDefinition)
 
     def _compute_single_service(self, task_command_description, taskDefinition="ClimateTaskCF"):
 
-        print("Calling task {} with inputs from {} and output to: {}".format(task_command_description['dataId'], task_command_description['inputs'], task_command_description['outputs']))
-        # print("**** DEBUG **** Calling task {} with data description: {}".format(data_description))
+        logger.info("Calling task %s with inputs from %s and output to: %s", task_command_description['dataId'], task_command_description['inputs'], task_command_description['outputs'])
+
+        return self._run_task(self._build_container_command(task_command_description), task_command_description['dataId'], taskDefinition)
 
+    def _run_task(self, command, label, taskDefinition):
 
         def call_ecs():
             task_response = self.ecs_client.run_task(
@@ -232,27 +1213,44 @@ class Hypervisor():
                 overrides={'containerOverrides': [
                     {
                         'name': 'HypervisorTask1',
-                        'command': self._build_container_command(task_command_description)
+                        'command': command
                     }
                 ]}
             )
-            print("ECS Task {} running......".format(task_command_description['dataId']))
+            logger.debug("ECS Task %s running......", label)
             return task_response
 
         return call_ecs()
 
     def _build_container_command(self, parameters):
-        cmd = "/bin/sh -c \"cd /app && ls -altr && pwd && python3 --version && pip freeze "
+        cmd = "/bin/sh -c \"" + self._build_command_prefix()
         cmd = cmd + " && " + "python3 /app/main.py "
-        cmd = cmd + "--parameters='{}'".format(json.dumps(parameters)).replace("\"", "\\\"")
+        cmd = cmd + self._build_task_arguments(parameters)
         cmd = cmd + "\""
-        # print("\nContainer Parameters: {} \n\n Command: {}".format(parameters, cmd))
         return [cmd]
 
+    def _build_bundle_command(self, bundle):
+        """
+        Runs every task description of a bundle in one container, one after the other. Each task reports its own
+            exit code in the logs as "[bundle] <dataId> exit=<code>" and in its status object, and the container fails
+            if any of them failed. Shell variables are escaped so the inner shell expands them, not the one running
+            /bin/sh -c.
+        """
+        cmd = "/bin/sh -c \"" + self._build_command_prefix() + "; status=0"
+        for task_description in bundle:
+            cmd = cmd + " ; " + self._build_bundle_item_command(task_description)
+        cmd = cmd + " ; exit \\$status\""
+        return [cmd]
+
+    def _build_bundle_item_command(self, parameters):
+        cmd = "python3 /app/main.py "
+        cmd = cmd + self._build_task_arguments(parameters)
+        cmd = cmd + " ; rc=\\$? ; echo [bundle] {} exit=\\$rc ; [ \\$rc -eq 0 ] || status=1".format(parameters['dataId'])
+        location = status_location(parameters)
+        if location is not None:
+            cmd = cmd + " ; echo '{{\\\"exitCode\\\": '\\$rc'}}' | aws s3 cp - {}".format(location)
+        return cmd
+
     def _is_service_completed(self, target_task_arn):
-        taskList = self.ecs_client.list_tasks(cluster=self.CLUSTER_NAME)['taskArns'] #desiredStatus='STOPPED')
-        describedTasks = self.ecs_client.describe_tasks(cluster=self.CLUSTER_NAME, tasks=taskList)
-        for task_arn, task_response in zip(taskList, describedTasks):
-            if task_arn == target_task_arn:
-                print("Target task located in list.")
-        return False
\ No newline at end of file
+        task = self.tracker.status(target_task_arn)
+        return task is not None and task['status'] == 'STOPPED'
\ No newline at end of file
@@ -0,0 +1,63 @@
+import threading
+
+
+class InFlightRegistry:
+    """
+    Tasks that have been launched and haven't finished yet, keyed by dataId. The first request to claim a dataId
+        launches it, later requests for the same dataId attach to that execution instead of launching a duplicate.
+        Waiters are objects with a task_finished(data_id, succeeded) method, and are called once the task finishes.
+
+    on_abandoned is called with a dataId when the last waiter detaches from it, e.g. because its request was cancelled.
+    """
+    def __init__(self, on_abandoned=None):
+        self.on_abandoned = on_abandoned
+        self._waiters = {}
+        self._lock = threading.Lock()
+
+    def claim(self, data_id, waiters=()):
+        """
+        A dataId claimed without waiters is not kept, nothing would be told when it finishes, and without a tracker
+            running nothing might ever finish it.
+
+        :rtype: True if the caller should launch the task, False if it is already in flight and waiters were attached.
+        """
+        with self._lock:
+            if data_id in self._waiters:
+                self._waiters[data_id].extend(waiters)
+                return False
+            if waiters:
+                self._waiters[data_id] = list(waiters)
+            return True
+
+    def finish(self, data_id, succeeded):
+        """
+        Removes the dataId, failed or completed, and notifies its waiters. A failed dataId can be claimed again.
+        """
+        with self._lock:
+            waiters = self._waiters.pop(data_id, [])
+        for waiter in waiters:
+            waiter.task_finished(data_id, succeeded)
+        return len(waiters)
+
+    def detach(self, waiter):
+        """
+        Stops notifying a waiter. dataIds left with no waiters are dropped and reported to on_abandoned.
+        """
+        abandoned = []
+        with self._lock:
+            for data_id, waiters in list(self._waiters.items()):
+                if waiter in waiters:
+                    waiters[:] = [w for w in waiters if w is not waiter]
+                    if not waiters:
+                        del self._waiters[data_id]
+                        abandoned.append(data_id)
+        for data_id in abandoned:
+            if self.on_abandoned is not None:
+                self.on_abandoned(data_id)
+        return abandoned
+
+    def __contains__(self, data_id):
+        return data_id in self._waiters
+
+    def __len__(self):
+        return len(self._waiters)
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import logging
+import queue
+import threading
+import time
+import uuid
+
+QUEUED = 'QUEUED'
+RUNNING = 'RUNNING'
+# Everything has been dispatched, some tasks are still running.
+WAITING = 'WAITING'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+CANCELLED = 'CANCELLED'
+
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+MAX_FINISHED_JOBS = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    One execute_service request run in the background. Progress is counted per level: tasks planned, skipped because
+        their output already exists, dispatched (of which attached to a task another request had already launched),
+        and then completed or failed.
+    """
+    def __init__(self, request, admitted=False):
+        self.id = uuid.uuid4().hex
+        self.request = request
+        # The request was checked against the admission limits before it was queued.
+        self.admitted = admitted
+        self.status = QUEUED
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.progress = {}
+        # The level every service of the request is at, set when the request is planned.
+        self.service_levels = {}
+        self._outstanding = {}
+        self._cancel_callbacks = []
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def level_of(self, task_description):
+        return self.service_levels.get(task_description['service_name'], 0)
+
+    def count(self, level, key, n=1):
+        with self._lock:
+            counts = self.progress.setdefault(level, {'planned': 0, 'skipped': 0, 'dispatched': 0, 'attached': 0, 'completed': 0, 'failed': 0})
+            counts[key] += n
+
+    def task_dispatched(self, task_description):
+        level = self.level_of(task_description)
+        with self._lock:
+            self._outstanding[task_description['dataId']] = level
+        self.count(level, 'dispatched')
+
+    def task_finished(self, data_id, succeeded):
+        with self._lock:
+            level = self._outstanding.pop(data_id, None)
+        if level is not None:
+            self.count(level, 'completed' if succeeded else 'failed')
+            self._finish_if_done()
+
+    def finish_dispatch(self):
+        with self._lock:
+            # Cancelled after its last check, its waiters are already detached and nothing will finish it.
+            if self.status == RUNNING and self.cancelled:
+                self.status = CANCELLED
+                self.finished = time.time()
+            elif self.status == RUNNING:
+                self.status = WAITING
+        self._finish_if_done()
+
+    def _finish_if_done(self):
+        with self._lock:
+            if self.status == WAITING and not self._outstanding:
+                failed = any(counts['failed'] for counts in self.progress.values())
+                self.status = FAILED if failed else COMPLETED
+                self.finished = time.time()
+
+    @property
+    def done(self):
+        return self.status in FINISHED_STATES
+
+    def add_cancel_callback(self, callback):
+        self._cancel_callbacks.append(callback)
+
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            if self.status == QUEUED or self.status == WAITING:
+                self.status = CANCELLED
+                self.finished = time.time()
+        for callback in self._cancel_callbacks:
+            callback()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def raise_if_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.id)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'job_id': self.id,
+                'request_name': self.request.get('request_name'),
+                'target_service': self.request.get('target_service'),
+                'status': self.status,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished,
+                'progress': {str(level): dict(counts) for level, counts in sorted(self.progress.items())},
+            }
+
+
+class JobManager:
+    """
+    Queues requests and runs them on background worker threads. run is called with the request and its Job.
+    """
+    def __init__(self, run, workers=1):
+        self.run = run
+        self.jobs = OrderedDict()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work, name='job-worker-{}'.format(i), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, request, admitted=False):
+        job = Job(request, admitted)
+        with self._lock:
+            self.jobs[job.id] = job
+            self._forget_finished_jobs()
+        self._queue.put(job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def _forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job.cancelled:
+                continue
+            job.status = RUNNING
+            job.started = time.time()
+            try:
+                self.run(job.request, job)
+            except JobCancelled:
+                job.status = CANCELLED
+                job.finished = time.time()
+            except Exception as e:
+                logger.exception("Job %s failed: %s", job.id, e)
+                job.error = str(e)
+                job.status = FAILED
+                job.finished = time.time()
+            else:
+                job.finish_dispatch()
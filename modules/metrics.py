@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+import threading
+import time
+
+
+class Metrics:
+    """
+    Thread safe counters and per-phase timers.
+    """
+    def __init__(self):
+        self.counters = {}
+        self.timers = {}
+        self._lock = threading.Lock()
+
+    def incr(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+            timer['count'] += 1
+            timer['total_seconds'] += seconds
+            timer['max_seconds'] = max(timer['max_seconds'], seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        with self._lock:
+            timers = {}
+            for name, timer in self.timers.items():
+                timers[name] = dict(timer, mean_seconds=timer['total_seconds'] / timer['count'])
+            return {'counters': dict(self.counters), 'timers': timers}
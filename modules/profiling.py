@@ -0,0 +1,107 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Profiles kept in memory, the oldest are dropped first.
+MAX_PROFILES = 20
+# Functions and allocation sites listed per profile.
+TOP_ENTRIES = 30
+
+logger = logging.getLogger(__name__)
+
+
+class ProfileStore:
+    """
+    cProfile and tracemalloc profiles of single requests, by profile ID. Nothing is traced unless a request is run under
+        profile().
+
+    cProfile only follows the thread a request runs on, so time spent launching tasks on the dispatch threads shows up
+        as waiting on them. tracemalloc traces the whole process, so allocations of requests running alongside a
+        profiled one are counted in it too. With a directory, each profile's raw stats are also written to
+        <directory>/<profile ID>.prof for pstats or snakeviz.
+    """
+    def __init__(self, max_profiles=MAX_PROFILES, directory=None, top=TOP_ENTRIES):
+        self.max_profiles = max_profiles
+        self.directory = directory
+        self.top = top
+        self.profiles = OrderedDict()
+        self._tracing = 0
+        self._started_tracing = False
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def profile(self, profile_id, label=None):
+        self._start_tracing()
+        before = tracemalloc.take_snapshot()
+        profiler = cProfile.Profile()
+        started = time.time()
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            yield profile_id
+        finally:
+            profiler.disable()
+            seconds = time.perf_counter() - start
+            after = tracemalloc.take_snapshot()
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+            self._stop_tracing()
+            self.put(profile_id, {
+                'profile_id': profile_id,
+                'label': label,
+                'started': started,
+                'seconds': seconds,
+                'peak_bytes': peak_bytes,
+                'functions': self._top_functions(profiler),
+                'allocations': self._top_allocations(before, after),
+            })
+            if self.directory is not None:
+                profiler.dump_stats(os.path.join(self.directory, profile_id + '.prof'))
+
+    def _start_tracing(self):
+        with self._lock:
+            if self._tracing == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            elif self._tracing == 0:
+                self._started_tracing = False
+            self._tracing += 1
+            tracemalloc.reset_peak()
+
+    def _stop_tracing(self):
+        with self._lock:
+            self._tracing -= 1
+            if self._tracing == 0 and self._started_tracing:
+                tracemalloc.stop()
+
+    def _top_functions(self, profiler):
+        stats = pstats.Stats(profiler)
+        functions = []
+        for (filename, line, name), (_, calls, total, cumulative, _) in stats.stats.items():
+            functions.append({'function': "{}:{}({})".format(filename, line, name), 'calls': calls,
+                              'total_seconds': total, 'cumulative_seconds': cumulative})
+        functions.sort(key=lambda f: f['cumulative_seconds'], reverse=True)
+        return functions[:self.top]
+
+    def _top_allocations(self, before, after):
+        return [{'location': str(stat.traceback), 'size_bytes': stat.size_diff, 'count': stat.count_diff}
+                for stat in after.compare_to(before, 'lineno')[:self.top]]
+
+    def put(self, profile_id, profile):
+        with self._lock:
+            self.profiles[profile_id] = profile
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+
+    def get(self, profile_id):
+        with self._lock:
+            return self.profiles.get(profile_id)
+
+    def list(self):
+        with self._lock:
+            return [{k: p[k] for k in ('profile_id', 'label', 'started', 'seconds', 'peak_bytes')} for p in self.profiles.values()]
@@ -0,0 +1,107 @@
+import threading
+
+PENDING = 'PENDING'
+DISPATCHED = 'DISPATCHED'
+COMPLETED = 'COMPLETED'
+FAILED = 'FAILED'
+
+
+class TaskNode:
+    def __init__(self, description, upstream):
+        self.description = description
+        self.upstream = set(upstream)
+        self.downstream = []
+        self.remaining = len(self.upstream)
+        self.state = PENDING
+
+
+class DAGScheduler:
+    """
+    Tracks the exact upstream dataIds of every task and hands a task to dispatch as soon as all of its own inputs
+        have completed, rather than when the whole previous level has. A failed task fails everything downstream of it.
+
+    dispatch is called with a list of task descriptions that are ready to run, and returns the dataIds of the ones it
+        could not launch. With priority, a function of a task description, ready tasks are dispatched highest first.
+    """
+    def __init__(self, dispatch, priority=None):
+        self.dispatch = dispatch
+        self.priority = priority
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    def add_task(self, description, upstream=(), completed=False):
+        """
+        Tasks must be added after their upstream tasks. Upstream dataIds that aren't part of the graph are treated
+            as already available. completed marks outputs that already exist, which are never dispatched.
+        """
+        data_id = description['dataId']
+        upstream = [u for u in upstream if u in self.tasks]
+        node = TaskNode(description, upstream)
+        for u in upstream:
+            upstream_node = self.tasks[u]
+            upstream_node.downstream.append(data_id)
+            if upstream_node.state == COMPLETED:
+                node.remaining -= 1
+        if completed:
+            node.state = COMPLETED
+        self.tasks[data_id] = node
+
+    def start(self):
+        with self._lock:
+            ready = [node for node in self.tasks.values() if node.state == PENDING and node.remaining == 0]
+            self._mark_dispatched(ready)
+        self._dispatch(ready)
+
+    def mark_completed(self, data_id):
+        with self._lock:
+            node = self.tasks.get(data_id)
+            if node is None or node.state in (COMPLETED, FAILED):
+                return
+            node.state = COMPLETED
+            ready = []
+            for d in node.downstream:
+                downstream_node = self.tasks[d]
+                downstream_node.remaining -= 1
+                if downstream_node.remaining == 0 and downstream_node.state == PENDING:
+                    ready.append(downstream_node)
+            self._mark_dispatched(ready)
+        self._dispatch(ready)
+
+    def task_finished(self, data_id, succeeded):
+        if succeeded:
+            self.mark_completed(data_id)
+        else:
+            self.mark_failed(data_id)
+
+    def mark_failed(self, data_id):
+        with self._lock:
+            failing = [data_id]
+            while failing:
+                node = self.tasks.get(failing.pop())
+                if node is None or node.state in (COMPLETED, FAILED):
+                    continue
+                node.state = FAILED
+                failing.extend(node.downstream)
+
+    def _mark_dispatched(self, nodes):
+        for node in nodes:
+            node.state = DISPATCHED
+
+    def _dispatch(self, nodes):
+        if nodes:
+            if self.priority is not None:
+                nodes = sorted(nodes, key=lambda node: self.priority(node.description), reverse=True)
+            for data_id in self.dispatch([node.description for node in nodes]) or ():
+                self.mark_failed(data_id)
+
+    def counts(self):
+        counts = {PENDING: 0, DISPATCHED: 0, COMPLETED: 0, FAILED: 0}
+        with self._lock:
+            for node in self.tasks.values():
+                counts[node.state] += 1
+        return counts
+
+    @property
+    def finished(self):
+        counts = self.counts()
+        return counts[PENDING] == 0 and counts[DISPATCHED] == 0
@@ -0,0 +1,137 @@
+import logging
+import threading
+
+# Runtimes of a service needed before its tasks are judged stragglers.
+MIN_SPECULATION_SAMPLES = 10
+
+logger = logging.getLogger(__name__)
+
+
+class Speculator:
+    """
+    Picks the running tasks that get a speculative copy, and settles the copies of a dataId as they stop. A task is a
+        straggler once it has been running factor times longer than its service's percentile runtime, per task for
+        bundles. Each task gets at most one copy, and at most max_copies dataIds have copies at once. The first copy of a
+        dataId to succeed completes it and the others are stopped, a failed copy only fails the dataId if it was the
+        last one running.
+
+    launched maps the ARN of every running task to its task descriptions. stop_task stops a task, given its ARN and
+        service name.
+    """
+    def __init__(self, history, in_flight, metrics, launched, stop_task, percentile=95, factor=1.5, max_copies=10):
+        self.history = history
+        self.in_flight = in_flight
+        self.metrics = metrics
+        self.launched = launched
+        self.stop_task = stop_task
+        self.percentile = percentile
+        self.factor = factor
+        self.max_copies = max_copies
+        # {dataId: task ARNs of its copies still running}, for dataIds with a speculative copy.
+        self._copies = {}
+        self._speculative_arns = set()
+        # Copies stopped because another one won.
+        self._losers = set()
+        # {task ARN: dataIds already settled by another copy}, for bundles left running because other tasks in them
+        # are still needed.
+        self._settled = {}
+        self._lock = threading.Lock()
+
+    def stragglers(self, active, now):
+        """
+        Registers a copy for every task of the active tasks, {task ARN: state}, that has run for too long.
+
+        :rtype: Task descriptions to launch a copy of.
+        """
+        stragglers = []
+        for task_arn, task in active.items():
+            launched = self.launched.get(task_arn)
+            if not launched:
+                continue
+            service_name = launched[0]['service_name']
+            if len(self.history.samples.get(service_name, ())) < MIN_SPECULATION_SAMPLES:
+                continue
+            limit = self.history.percentile(service_name, self.percentile) * self.factor * len(launched)
+            if now - (task['startedAt'] or task['launchedAt']) <= limit:
+                continue
+            with self._lock:
+                for d in launched:
+                    if len(self._copies) >= self.max_copies:
+                        break
+                    if d['dataId'] not in self._copies and d['dataId'] in self.in_flight:
+                        self._copies[d['dataId']] = {task_arn}
+                        stragglers.append(d)
+        return stragglers
+
+    def copy_launched(self, data_id, task_arn):
+        """
+        :rtype: False if the dataId was settled while its copy was launching, and the copy should be stopped.
+        """
+        with self._lock:
+            copies = self._copies.get(data_id)
+            if copies is None:
+                return False
+            copies.add(task_arn)
+            self._speculative_arns.add(task_arn)
+            return True
+
+    def stopped_as_loser(self, task_arn):
+        """
+        :rtype: True if the task was stopped because another copy of its tasks won, and has nothing left to report.
+        """
+        with self._lock:
+            if task_arn in self._losers:
+                self._losers.discard(task_arn)
+                return True
+            return False
+
+    def settle(self, task_arn, results):
+        """
+        Settles the dataIds of a stopped task, given as {dataId: succeeded}.
+
+        :rtype: Dictionary of {dataId: succeeded} of the dataIds whose completion should be reported.
+        """
+        with self._lock:
+            settled = self._settled.pop(task_arn, set())
+        return {data_id: succeeded for data_id, succeeded in results.items()
+                if data_id not in settled and self._settle(task_arn, data_id, succeeded)}
+
+    def _settle(self, task_arn, data_id, succeeded):
+        with self._lock:
+            copies = self._copies.get(data_id)
+            if copies is None:
+                return True
+            copies.discard(task_arn)
+            if not succeeded and copies:
+                return False
+            del self._copies[data_id]
+            won_by_copy = task_arn in self._speculative_arns
+            self._speculative_arns.discard(task_arn)
+        if succeeded:
+            if won_by_copy:
+                self.metrics.incr('speculative_wins')
+            for loser in copies:
+                launched = self.launched.get(loser) or []
+                # A bundle is only stopped once none of its tasks are needed any more, until then its copy of the
+                # dataId is ignored when it stops.
+                if all(d['dataId'] == data_id or d['dataId'] not in self.in_flight for d in launched):
+                    self.stop(loser, data_id.split('/', 1)[0])
+                else:
+                    with self._lock:
+                        self._settled.setdefault(loser, set()).add(data_id)
+        return True
+
+    def stop(self, task_arn, service_name):
+        with self._lock:
+            self._losers.add(task_arn)
+            self._speculative_arns.discard(task_arn)
+            self._settled.pop(task_arn, None)
+        logger.info("Stopping Task %s, another copy finished first", task_arn)
+        self.stop_task(task_arn, service_name)
+
+    def abandoned(self, data_id):
+        """
+        :rtype: ARNs of the copies of a dataId no request waits for any more.
+        """
+        with self._lock:
+            return self._copies.pop(data_id, set())
@@ -0,0 +1,91 @@
+import bisect
+
+
+class TaskSpace:
+    """
+    Addresses every task set of a level-by-level expansion by an integer, without materializing the grid.
+
+    A level lists the task sets of its services in name order, or in the order orders gives for the level, and the task
+        sets of a service are the product of the tasks of its lineage. Within a service, task set n is n written in the
+        mixed radix of its lineage's task counts, last service least significant, which is the order
+        build_tasks_per_level lists them in.
+
+    The digits index each service's expanded parameter combinations, not its parameter value lists. The combinations of
+        every service are expanded and hashed once per request, which costs the sum of the services' combinations, and
+        only the product across a lineage is left unexpanded. A combination's index is itself the mixed radix index of
+        its values in the service's parameter lists, in name order, so the task set at an index is the same either way.
+    """
+    def __init__(self, preds, s_e, lineages, orders=None):
+        self.levels = sorted(preds)
+        # Per level, the pools of task lists of each service's lineage and the index each service starts at.
+        self.blocks = {}
+        self.offsets = {}
+        self.sizes = {}
+        for level in self.levels:
+            blocks, offsets, size = [], [], 0
+            for service in orders[level] if orders else sorted(preds[level]):
+                pools = [s_e[s] for s in lineages[service]]
+                count = 1
+                for pool in pools:
+                    count *= len(pool)
+                if count == 0:
+                    continue
+                blocks.append(pools)
+                offsets.append(size)
+                size += count
+            self.blocks[level], self.offsets[level], self.sizes[level] = blocks, offsets, size
+
+    def level_size(self, level):
+        return self.sizes[level]
+
+    @property
+    def size(self):
+        return sum(self.sizes.values())
+
+    def _locate(self, level, index):
+        block = bisect.bisect_right(self.offsets[level], index) - 1
+        pools = self.blocks[level][block]
+        index -= self.offsets[level][block]
+        digits = [0] * len(pools)
+        for i in range(len(pools) - 1, -1, -1):
+            index, digits[i] = divmod(index, len(pools[i]))
+        return block, digits
+
+    def task_set(self, level, index):
+        block, digits = self._locate(level, index)
+        return [pool[digit] for pool, digit in zip(self.blocks[level][block], digits)]
+
+    def iter_range(self, level, start, stop):
+        """
+        Yields task sets start to stop - 1 of a level, counting through the digits instead of decoding every index.
+        """
+        if start >= stop:
+            return
+        block, digits = self._locate(level, start)
+        pools = self.blocks[level][block]
+        for _ in range(stop - start):
+            yield [pool[digit] for pool, digit in zip(pools, digits)]
+            for i in range(len(pools) - 1, -1, -1):
+                digits[i] += 1
+                if digits[i] < len(pools[i]):
+                    break
+                digits[i] = 0
+            else:
+                # Past the last task set of this service, on to the next one.
+                block += 1
+                if block < len(self.blocks[level]):
+                    pools = self.blocks[level][block]
+                    digits = [0] * len(pools)
+
+    def split(self, shards):
+        """
+        Splits every level into shards contiguous index ranges of near equal size, so each shard has work at every level.
+
+        :rtype: List of {level: [start, stop]}, one per shard.
+        """
+        ranges = [{} for _ in range(shards)]
+        for level in self.levels:
+            size = self.level_size(level)
+            for shard in range(shards):
+                ranges[shard][level] = [size * shard // shards, size * (shard + 1) // shards]
+        return ranges
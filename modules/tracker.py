@@ -0,0 +1,230 @@
+from collections import deque
+import logging
+import threading
+import time
+
+# describe_tasks accepts at most 100 task ARNs per call.
+DESCRIBE_TASKS_BATCH = 100
+MIN_POLL_INTERVAL = 2.0
+MAX_POLL_INTERVAL = 30.0
+POLL_BACKOFF = 1.5
+# Stopped tasks whose state is kept for lookups, the oldest are forgotten first.
+MAX_STOPPED_TASKS = 10000
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+STOPPED = 'STOPPED'
+
+logger = logging.getLogger(__name__)
+
+
+class CompletionTracker:
+    """
+    Follows the ECS tasks launched by the hypervisor until they stop. Polling only describes the tasks that haven't
+        stopped yet, 100 ARNs per call, and backs off while nothing changes. The state of every running task, and of
+        every dataId it computes, is kept in memory for O(1) lookups, along with the last max_stopped tasks that stopped.
+
+    on_stopped is called with the task ARN and its state once the task has stopped, and on_poll after every poll.
+        on_stopped_many, when given, is called instead with a list of (task ARN, state) of every task found stopped by
+        one poll, or reported stopped.
+    """
+    def __init__(self, ecs_client, cluster, on_stopped=None, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL,
+                 on_poll=None, max_stopped=MAX_STOPPED_TASKS, on_stopped_many=None):
+        self.ecs_client = ecs_client
+        self.cluster = cluster
+        self.on_stopped = on_stopped
+        self.on_stopped_many = on_stopped_many
+        self.on_poll = on_poll
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.tasks = {}
+        self.task_by_data_id = {}
+        self._active = set()
+        self.max_stopped = max_stopped
+        self._stopped = deque()
+        # Stops reported before their task was tracked.
+        self._reported = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def track(self, task_arn, data_ids, poll=True):
+        """
+        Tasks not run on ECS are tracked with poll=False, and their executor calls report_stopped instead.
+        """
+        with self._lock:
+            self.tasks[task_arn] = {'status': PENDING, 'exitCode': None, 'stoppedReason': None, 'dataIds': list(data_ids),
+                                    'launchedAt': time.time(), 'startedAt': None, 'stoppedAt': None}
+            for data_id in data_ids:
+                self.task_by_data_id[data_id] = task_arn
+            reported = self._reported.pop(task_arn, None)
+            if poll and reported is None:
+                self._active.add(task_arn)
+        if reported is not None:
+            self.report_stopped(task_arn, *reported)
+            return
+        if poll:
+            # New work resets the backoff.
+            self.interval = self.min_interval
+            self._wake.set()
+
+    def report_stopped(self, task_arn, exit_code, reason=None):
+        with self._lock:
+            task = self.tasks.get(task_arn)
+            if task is None:
+                self._reported[task_arn] = (exit_code, reason)
+                return
+            if task['status'] == STOPPED:
+                return
+            task.update(status=STOPPED, exitCode=exit_code, stoppedReason=reason, stoppedAt=time.time())
+            self._active.discard(task_arn)
+        self._notify_stopped([task_arn])
+        self._forget_stopped([task_arn])
+
+    def status(self, task_arn):
+        with self._lock:
+            task = self.tasks.get(task_arn)
+            return None if task is None else dict(task)
+
+    def status_of(self, data_id):
+        with self._lock:
+            task_arn = self.task_by_data_id.get(data_id)
+            if task_arn is None:
+                return None
+            return dict(self.tasks[task_arn], taskArn=task_arn)
+
+    @property
+    def active_count(self):
+        return len(self._active)
+
+    def active(self):
+        """
+        :rtype: Dictionary of {task ARN: state} of the tasks that haven't stopped yet.
+        """
+        with self._lock:
+            return {task_arn: dict(self.tasks[task_arn]) for task_arn in self._active}
+
+    def poll(self):
+        """
+        Describes every task that hasn't stopped yet and updates its state.
+
+        :rtype: Number of tasks whose status changed.
+        """
+        with self._lock:
+            active = list(self._active)
+        changed = 0
+        stopped = []
+        for i in range(0, len(active), DESCRIBE_TASKS_BATCH):
+            batch = active[i:i + DESCRIBE_TASKS_BATCH]
+            try:
+                response = self.ecs_client.describe_tasks(cluster=self.cluster, tasks=batch)
+            except Exception as e:
+                logger.warning("describe_tasks failed: %s", e)
+                continue
+            with self._lock:
+                for described in response.get('tasks', []):
+                    task_arn = described['taskArn']
+                    task = self.tasks.get(task_arn)
+                    if task is None:
+                        continue
+                    status = described.get('lastStatus', PENDING)
+                    if status != task['status']:
+                        changed += 1
+                        task['status'] = status
+                    if status == RUNNING and task['startedAt'] is None:
+                        task['startedAt'] = timestamp(described.get('startedAt')) or time.time()
+                    if status == STOPPED and task_arn in self._active:
+                        # A task's exit code is the first non-zero one among its containers.
+                        exit_codes = [c.get('exitCode') for c in described.get('containers', [])]
+                        failed = [code for code in exit_codes if code != 0]
+                        task['exitCode'] = failed[0] if failed else (0 if exit_codes else None)
+                        task['stoppedReason'] = described.get('stoppedReason')
+                        task['startedAt'] = timestamp(described.get('startedAt')) or task['startedAt']
+                        task['stoppedAt'] = timestamp(described.get('stoppedAt')) or time.time()
+                        self._active.discard(task_arn)
+                        stopped.append(task_arn)
+                # Tasks ECS no longer knows about can't be followed any further.
+                for failure in response.get('failures', []):
+                    task_arn = failure.get('arn')
+                    if task_arn in self._active:
+                        changed += 1
+                        self.tasks[task_arn].update(status=STOPPED, stoppedReason=failure.get('reason'), stoppedAt=time.time())
+                        self._active.discard(task_arn)
+                        stopped.append(task_arn)
+
+        if stopped:
+            self._notify_stopped(stopped)
+        self._forget_stopped(stopped)
+        self.interval = self.min_interval if changed else min(self.interval * POLL_BACKOFF, self.max_interval)
+        if self.on_poll is not None:
+            self.on_poll()
+        return changed
+
+    def _notify_stopped(self, task_arns):
+        if self.on_stopped_many is not None:
+            self.on_stopped_many([(task_arn, self.status(task_arn)) for task_arn in task_arns])
+            return
+        for task_arn in task_arns:
+            if self.on_stopped is not None:
+                self.on_stopped(task_arn, self.status(task_arn))
+
+    def _forget_stopped(self, task_arns):
+        with self._lock:
+            self._stopped.extend(task_arns)
+            while len(self._stopped) > self.max_stopped:
+                task_arn = self._stopped.popleft()
+                task = self.tasks.pop(task_arn, None)
+                for data_id in task['dataIds'] if task is not None else ():
+                    # A dataId launched again since is left to its newer task.
+                    if self.task_by_data_id.get(data_id) == task_arn:
+                        del self.task_by_data_id[data_id]
+
+    @staticmethod
+    def succeeded(task):
+        return task is not None and task['status'] == STOPPED and task['exitCode'] == 0
+
+    @staticmethod
+    def runtime(task):
+        """
+        :rtype: Seconds from the start of a stopped task, or from its launch if ECS didn't say when it started, to its stop.
+        """
+        if task is None or task.get('stoppedAt') is None:
+            return None
+        return task['stoppedAt'] - (task.get('startedAt') or task['launchedAt'])
+
+    def start(self):
+        """
+        Polls on a background thread until stop() is called. The thread sleeps while nothing is being tracked.
+        """
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='completion-tracker', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self._active:
+                self.poll()
+                self._stop.wait(self.interval)
+            else:
+                self._wake.wait()
+                self._wake.clear()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+def timestamp(value):
+    """
+    describe_tasks gives times as datetimes.
+    """
+    if value is None:
+        return None
+    return value.timestamp() if hasattr(value, 'timestamp') else float(value)
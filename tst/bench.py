@@ -0,0 +1,154 @@
+"""
+Planning and dispatch benchmarks on synthetic service graphs, run offline against the fake AWS clients.
+
+    python tst/bench.py --shapes chain,fan_in,diamond --sizes 10,1000,100000
+    python tst/bench.py --sizes 1000000 --scheduling dag > bench_output.txt
+
+Every phase reports its wall time and the peak memory traced while it ran.
+"""
+import argparse
+import time
+import tracemalloc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.hypervisor import Hypervisor
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+
+SHAPES = ('chain', 'fan_in', 'diamond')
+PHASES = ('expansion', 'levels', 'hashing', 'dispatch', 'registry')
+# Values given to each upstream service, the target service takes the rest of the grid.
+UPSTREAM_VALUES = 2
+# Regression thresholds per planned task, with tracemalloc running, roughly 5x the cost measured when they were set.
+MAX_SECONDS_PER_TASK = {'expansion': 0.0002, 'levels': 0.0005, 'hashing': 0.001, 'dispatch': 0.0015, 'registry': 0.001}
+MAX_PEAK_BYTES_PER_TASK = {'expansion': 4096, 'levels': 8192, 'hashing': 16384, 'dispatch': 16384, 'registry': 32768}
+
+
+def build_services(shape, size=4):
+    """
+    chain: S0 -> S1 -> ... -> S{size-1}
+    fan_in: S0 ... S{size-2} -> S{size-1}
+    diamond: S0 -> S1 ... S{size-2} -> S{size-1}
+
+    :rtype: List of service descriptions, target service last.
+    """
+    names = ["S{}".format(i) for i in range(size)]
+    if shape == 'chain':
+        inputs = [[]] + [[names[i - 1]] for i in range(1, size)]
+    elif shape == 'fan_in':
+        inputs = [[] for _ in range(size - 1)] + [names[:-1]]
+    elif shape == 'diamond':
+        inputs = [[]] + [[names[0]] for _ in range(1, size - 1)] + [names[1:-1]]
+    else:
+        raise ValueError("Unknown graph shape {}".format(shape))
+    return [{'service_name': name, 'inputs': {i: {} for i in service_inputs}, 'parameters': {'p': {}}}
+            for name, service_inputs in zip(names, inputs)]
+
+
+def build_request(services, grid_size):
+    """
+    Parameter grid with grid_size combinations for the target service, as far as it divides.
+    """
+    upstream = services[:-1]
+    target_values = max(1, grid_size // UPSTREAM_VALUES ** len(upstream))
+    parameters = {s['service_name']: {'p': [str(v) for v in range(UPSTREAM_VALUES)]} for s in upstream}
+    parameters[services[-1]['service_name']] = {'p': [str(v) for v in range(target_values)]}
+    return {'request_name': 'bench', 'target_service': services[-1]['service_name'], 'parameters': parameters}
+
+
+def measure(results, phase, fn, *args):
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    value = fn(*args)
+    results[phase] = {'seconds': time.perf_counter() - start, 'peak_bytes': tracemalloc.get_traced_memory()[1]}
+    return value
+
+
+def run_benchmark(shape, grid_size, services=4, scheduling='levels', bundle_size='auto'):
+    """
+    Runs the planning and dispatch phases of one request, one phase at a time.
+
+    :rtype: Dict with the number of tasks and per phase seconds and peak_bytes.
+    """
+    ddb = FakeDynamoDBResource()
+    registry = DynamoDBRegistry(ddb)
+    descriptions = build_services(shape, services)
+    for description in descriptions:
+        registry.put_service(description)
+    request = build_request(descriptions, grid_size)
+    target = request['target_service']
+    hypervisor = Hypervisor(registry=registry, ecs_client=FakeECSClient(), bundle_size=bundle_size)
+
+    started = tracemalloc.is_tracing()
+    if not started:
+        tracemalloc.start()
+    phases = {}
+    try:
+        s_e = measure(phases, 'expansion', hypervisor.build_expanded_service_sets, request['parameters'])
+        if scheduling == 'dag':
+            task_graph = measure(phases, 'levels', lambda: list(hypervisor.build_task_graph(registry.service_graph, target, s_e)))
+            task_descriptions = [d for d, _ in task_graph]
+            phases['hashing'] = {'seconds': 0.0, 'peak_bytes': 0}
+            del task_graph
+        else:
+            preds = hypervisor.build_predecessor_level_dict(registry.service_graph, target)
+            tasks_by_level = measure(phases, 'levels', hypervisor.build_tasks_per_level, preds, s_e)
+            task_sets = [task_set for level, level_tasks in sorted(tasks_by_level.items()) if level >= 0 for task_set in level_tasks]
+            del tasks_by_level
+            task_descriptions = measure(phases, 'hashing', lambda: [hypervisor.build_task_description(t) for t in task_sets])
+            del task_sets
+        measure(phases, 'dispatch', hypervisor.compute_task_descriptions, task_descriptions)
+        measure(phases, 'registry', lambda: (registry.put_data_many(task_descriptions),
+                                             registry.get_data_many([d['dataId'] for d in task_descriptions])))
+    finally:
+        if not started:
+            tracemalloc.stop()
+    return {'shape': shape, 'grid_size': grid_size, 'scheduling': scheduling, 'tasks': len(task_descriptions), 'phases': phases}
+
+
+def check_thresholds(result, seconds=True):
+    """
+    Wall-clock thresholds depend on the machine, seconds=False only checks the memory ones.
+
+    :rtype: List of the phases slower or larger than their thresholds.
+    """
+    tasks = max(result['tasks'], 1)
+    regressions = []
+    for phase, stats in result['phases'].items():
+        slower = seconds and stats['seconds'] / tasks > MAX_SECONDS_PER_TASK[phase]
+        if slower or stats['peak_bytes'] / tasks > MAX_PEAK_BYTES_PER_TASK[phase]:
+            regressions.append(phase)
+    return regressions
+
+
+def format_result(result):
+    cells = ["{:8} {:>8} {:6} {:>8} tasks".format(result['shape'], result['grid_size'], result['scheduling'], result['tasks'])]
+    for phase in PHASES:
+        stats = result['phases'][phase]
+        cells.append("{} {:.3f}s {:.1f}MB".format(phase, stats['seconds'], stats['peak_bytes'] / 2 ** 20))
+    regressions = check_thresholds(result)
+    if regressions:
+        cells.append("OVER THRESHOLD: {}".format(", ".join(regressions)))
+    return " | ".join(cells)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--shapes', default=','.join(SHAPES))
+    parser.add_argument('--sizes', default='10,1000,100000')
+    parser.add_argument('--services', type=int, default=4)
+    parser.add_argument('--scheduling', default='levels', choices=('levels', 'dag'))
+    parser.add_argument('--bundle-size', default='auto')
+    args = parser.parse_args(argv)
+    bundle_size = args.bundle_size if args.bundle_size == 'auto' else int(args.bundle_size)
+    for shape in args.shapes.split(','):
+        for size in args.sizes.split(','):
+            print(format_result(run_benchmark(shape, int(size), args.services, args.scheduling, bundle_size)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
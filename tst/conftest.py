@@ -0,0 +1,46 @@
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+import pytest
+
+
+@pytest.fixture
+def chain_registry():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {'locations': {}}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {'thresholds': {}}})
+    registry.put_service({'service_name': 'CalculateCost', 'inputs': {'BiasCorrection': {}}, 'parameters': {'time_windows': {}}})
+    return registry
+
+
+@pytest.fixture
+def diamond_registry():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {'locations': {}}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {'thresholds': {}, 'methods': {}}})
+    registry.put_service({'service_name': 'Downscale', 'inputs': {'SelectLocation': {}}, 'parameters': {'factors': {}}})
+    registry.put_service({'service_name': 'CalculateCost', 'inputs': {'BiasCorrection': {}, 'Downscale': {}}, 'parameters': {'time_windows': {}}})
+    return registry
+
+
+@pytest.fixture
+def two_root_registry():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {'locations': {}}})
+    registry.put_service({'service_name': 'SelectModel', 'inputs': {}, 'parameters': {'models': {}}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}, 'SelectModel': {}}, 'parameters': {'thresholds': {}}})
+    registry.put_service({'service_name': 'CalculateCost', 'inputs': {'BiasCorrection': {}}, 'parameters': {'time_windows': {}}})
+    return registry
+
+
+@pytest.fixture
+def fast_slow_registry():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'Fast', 'inputs': {}, 'parameters': {'p': {}}})
+    registry.put_service({'service_name': 'Slow', 'inputs': {}, 'parameters': {'p': {}}})
+    registry.put_service({'service_name': 'Target', 'inputs': {'Fast': {}, 'Slow': {}}, 'parameters': {}})
+    return registry
+
+
+@pytest.fixture
+def ecs_client():
+    return FakeECSClient()
@@ -0,0 +1,308 @@
+"""
+In-memory stand-ins for the AWS and MongoDB clients the hypervisor and registries use, so tests can run offline.
+"""
+import copy
+import io
+import itertools
+import threading
+import time
+import zlib
+
+from pymongo.errors import DuplicateKeyError
+
+
+def _reject_floats(value):
+    """
+    DynamoDB only takes numbers as Decimal.
+    """
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple, set)):
+        for item in value:
+            _reject_floats(item)
+
+
+class FakeTable:
+    SCAN_PAGE_SIZE = 2
+
+    def __init__(self, name, key):
+        self.name = name
+        self.key = key
+        self.items = {}
+        self.calls = []
+
+    def put_item(self, Item):
+        self.calls.append('put_item')
+        _reject_floats(Item)
+        self.items[Item[self.key]] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, ConsistentRead=False):
+        self.calls.append('get_item')
+        item = self.items.get(Key[self.key])
+        if item is None:
+            return {}
+        return {'Item': copy.deepcopy(item)}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeValues, ReturnValues='NONE'):
+        # Only the "ADD attribute :value" form the registry uses.
+        self.calls.append('update_item')
+        _, attribute, placeholder = UpdateExpression.split()
+        item = self.items.setdefault(Key[self.key], dict(Key))
+        item[attribute] = item.get(attribute, 0) + ExpressionAttributeValues[placeholder]
+        return {'Attributes': {attribute: item[attribute]}}
+
+    def scan(self, Segment=0, TotalSegments=1, ExclusiveStartKey=None):
+        self.calls.append('scan')
+        keys = sorted(k for k in self.items if zlib.crc32(k.encode()) % TotalSegments == Segment)
+        if ExclusiveStartKey is not None:
+            keys = [k for k in keys if k > ExclusiveStartKey[self.key]]
+        page = keys[:self.SCAN_PAGE_SIZE]
+        response = {'Items': [copy.deepcopy(self.items[k]) for k in page]}
+        if len(keys) > len(page):
+            response['LastEvaluatedKey'] = {self.key: page[-1]}
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return FakeBatchWriter(self)
+
+
+class FakeBatchWriter:
+    BATCH_SIZE = 25
+
+    def __init__(self, table):
+        self.table = table
+        self.buffer = []
+
+    def put_item(self, Item):
+        self.buffer.append(Item)
+        if len(self.buffer) == self.BATCH_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self.buffer:
+            self.table.calls.append('batch_write_item')
+            for item in self.buffer:
+                self.table.items[item[self.table.key]] = copy.deepcopy(item)
+            self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._flush()
+        return False
+
+
+class FakeDynamoDBResource:
+    """
+    unprocessed_per_call makes batch_get_item leave that many keys unprocessed on any call asking for more keys than
+        that, like a throttled table.
+    """
+    KEYS = {'climate-data-index': 'dataId', 'climate-services-index': 'service_name'}
+
+    def __init__(self, unprocessed_per_call=0):
+        self.tables = {}
+        self.unprocessed_per_call = unprocessed_per_call
+        self.batch_get_calls = []
+
+    def batch_get_item(self, RequestItems):
+        responses = {}
+        unprocessed = {}
+        for name, request in RequestItems.items():
+            keys = request['Keys']
+            assert len(keys) <= 100
+            self.batch_get_calls.append(len(keys))
+            table = self.Table(name)
+            processed = keys
+            if len(keys) > self.unprocessed_per_call > 0:
+                processed = keys[self.unprocessed_per_call:]
+                unprocessed[name] = {'Keys': keys[:self.unprocessed_per_call]}
+            responses[name] = [copy.deepcopy(table.items[k[table.key]]) for k in processed if k[table.key] in table.items]
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.KEYS[name])
+        return self.tables[name]
+
+
+class FakeECSClient:
+    """
+    latency is added to every call, to stand in for the round trip to the ECS API. Task ARNs are numbered from
+        first_task.
+    """
+    def __init__(self, latency=0, first_task=1):
+        self.latency = latency
+        self.first_task = first_task
+        self.run_task_calls = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self.task_states = {}
+        self.describe_tasks_calls = []
+        self.stop_task_calls = []
+        self._lock = threading.Lock()
+
+    def run_task(self, **kwargs):
+        with self._lock:
+            self.run_task_calls.append(kwargs)
+            arn = "arn:aws:ecs:eu-west-1:000000000000:task/HypervisorCluster/{}".format(self.first_task + len(self.run_task_calls) - 1)
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        time.sleep(self.latency)
+        with self._lock:
+            self._in_flight -= 1
+        return {'tasks': [{'taskArn': arn, 'lastStatus': 'PROVISIONING'}], 'failures': []}
+
+    def set_task_state(self, arn, status, exit_code=None):
+        self.task_states[arn] = {'taskArn': arn, 'lastStatus': status, 'containers': [{'exitCode': exit_code}] if exit_code is not None else []}
+
+    def describe_tasks(self, cluster, tasks):
+        assert len(tasks) <= 100
+        self.describe_tasks_calls.append(list(tasks))
+        described = [self.task_states.get(arn, {'taskArn': arn, 'lastStatus': 'PROVISIONING'}) for arn in tasks]
+        return {'tasks': described, 'failures': []}
+
+    def stop_task(self, **kwargs):
+        self.stop_task_calls.append(kwargs)
+        return {'task': {'taskArn': kwargs['task'], 'desiredStatus': 'STOPPED'}}
+
+    @property
+    def launched_arns(self):
+        return ["arn:aws:ecs:eu-west-1:000000000000:task/HypervisorCluster/{}".format(self.first_task + i) for i in range(len(self.run_task_calls))]
+
+
+class FakeS3Client:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.objects = {}
+        self.put_object_calls = 0
+
+    def put_object(self, Bucket, Key, Body):
+        self.put_object_calls += 1
+        if self.fail:
+            raise IOError("Access Denied")
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise KeyError("NoSuchKey: " + Key)
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+
+class FakeMongoCollection:
+    """
+    Enough of a pymongo collection for the registry: equality, $in, $gt and $lte filters, upserts, unique indexes and
+        bulk_write of ReplaceOne requests. Every method call is counted in calls.
+    """
+    def __init__(self):
+        self.documents = []
+        self.unique_keys = []
+        self.calls = []
+        self._ids = itertools.count(1)
+
+    def create_index(self, key, unique=False):
+        self.calls.append('create_index')
+        if unique and key not in self.unique_keys:
+            self.unique_keys.append(key)
+        return key + '_1'
+
+    def _matches(self, document, query):
+        for key, condition in query.items():
+            value = document.get(key)
+            if isinstance(condition, dict):
+                for op, operand in condition.items():
+                    if op == '$in' and value not in operand:
+                        return False
+                    if op == '$gt' and not (value is not None and value > operand):
+                        return False
+                    if op == '$lte' and not (value is not None and value <= operand):
+                        return False
+            elif value != condition:
+                return False
+        return True
+
+    def _project(self, document, projection):
+        document = copy.deepcopy(document)
+        if projection and projection.get('_id') == 0:
+            document.pop('_id', None)
+        return document
+
+    def _replace(self, query, replacement, upsert):
+        for i, document in enumerate(self.documents):
+            if self._matches(document, query):
+                self.documents[i] = dict(copy.deepcopy(replacement), _id=document['_id'])
+                return
+        if upsert:
+            self._insert(dict(query, **copy.deepcopy(replacement)))
+
+    def _insert(self, document):
+        for key in self.unique_keys:
+            if any(d.get(key) == document.get(key) for d in self.documents):
+                raise DuplicateKeyError("E11000 duplicate key error {}: {}".format(key, document.get(key)))
+        document.setdefault('_id', next(self._ids))
+        self.documents.append(document)
+
+    def insert_one(self, document):
+        self.calls.append('insert_one')
+        self._insert(copy.deepcopy(document))
+
+    def replace_one(self, query, replacement, upsert=False):
+        self.calls.append('replace_one')
+        self._replace(query, replacement, upsert)
+
+    def find_one(self, query, projection=None):
+        self.calls.append('find_one')
+        for document in self.documents:
+            if self._matches(document, query):
+                return self._project(document, projection)
+        return None
+
+    def find(self, query, projection=None):
+        self.calls.append('find')
+        return [self._project(d, projection) for d in self.documents if self._matches(d, query)]
+
+    def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self.calls.append('find_one_and_update')
+        document = next((d for d in self.documents if self._matches(d, query)), None)
+        if document is None:
+            if not upsert:
+                return None
+            document = dict(query)
+            self._insert(document)
+        for key, n in update['$inc'].items():
+            document[key] = document.get(key, 0) + n
+        return copy.deepcopy(document)
+
+    def bulk_write(self, requests, ordered=True):
+        self.calls.append('bulk_write')
+        for request in requests:
+            self._replace(request._filter, request._doc, request._upsert)
+
+
+class FakeMongoDatabase:
+    def __init__(self):
+        self.collections = {}
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self.collections.setdefault(name, FakeMongoCollection())
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+class FakeMongoClient:
+    def __init__(self):
+        self.databases = {}
+
+    def __getitem__(self, name):
+        return self.databases.setdefault(name, FakeMongoDatabase())
@@ -0,0 +1,29 @@
+from bench import run_benchmark, check_thresholds, build_services, build_request, SHAPES
+import os
+import pytest
+
+# The 100k and 1M grids take minutes, set HYPERVISOR_BENCH_LARGE=1 to run them. Wall-clock thresholds depend on the
+# machine, so they are only checked then too, memory thresholds are always checked.
+BENCH_LARGE = bool(os.environ.get('HYPERVISOR_BENCH_LARGE'))
+SIZES = [10, 1000]
+if BENCH_LARGE:
+    SIZES += [100000, 1000000]
+
+
+def test_synthetic_graphs():
+    chain, fan_in, diamond = (build_services(shape) for shape in SHAPES)
+    assert [list(s['inputs']) for s in chain] == [[], ['S0'], ['S1'], ['S2']]
+    assert [list(s['inputs']) for s in fan_in] == [[], [], [], ['S0', 'S1', 'S2']]
+    assert [list(s['inputs']) for s in diamond] == [[], ['S0'], ['S0'], ['S1', 'S2']]
+    request = build_request(chain, 1000)
+    assert [len(p['p']) for p in request['parameters'].values()] == [2, 2, 2, 125]
+
+
+@pytest.mark.parametrize('shape', SHAPES)
+@pytest.mark.parametrize('size', SIZES)
+@pytest.mark.parametrize('scheduling', ['levels', 'dag'])
+def test_planning_and_dispatch_within_thresholds(shape, size, scheduling):
+    result = run_benchmark(shape, size, scheduling=scheduling)
+    assert result['tasks'] >= size
+    if size >= 1000:
+        assert check_thresholds(result, seconds=BENCH_LARGE) == []
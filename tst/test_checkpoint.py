@@ -0,0 +1,209 @@
+from modules.hypervisor import Hypervisor
+from modules.checkpoint import Checkpoint, CheckpointLocked, pending_checkpoints
+from modules.executors import Executor, LOCAL
+from modules.jobs import Job, RUNNING
+from fakes import FakeECSClient
+import json
+import os
+import pytest
+
+
+class Crash(Exception):
+    pass
+
+
+class RecordingExecutor(Executor):
+    def __init__(self):
+        self.bundles = []
+
+    def run(self, bundle):
+        self.bundles.append(bundle)
+        return {'tasks': [{'taskArn': 'local:task/{}'.format(len(self.bundles))}], 'failures': []}
+
+
+@pytest.fixture
+def service_request():
+    return {'target_service': 'CalculateCost',
+            'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago', 'Lima']},
+                           'BiasCorrection': {'thresholds': ['1', '2']}, 'CalculateCost': {'time_windows': ['today', 'week', 'year']}}}
+
+
+def crash_after(hypervisor, chunks):
+    """
+    Makes the hypervisor stop, as if its process died, right after dispatching chunks chunks and before recording the last.
+
+    :rtype: List of the checkpoints passed to compute_tasks, the last one is left open.
+    """
+    compute_tasks = hypervisor.compute_tasks
+    calls = []
+
+    def crashing(task_sets, job=None, checkpoint=None):
+        result = compute_tasks(task_sets, job, checkpoint)
+        calls.append(checkpoint)
+        if len(calls) == chunks:
+            raise Crash()
+        return result
+    hypervisor.compute_tasks = crashing
+    return calls
+
+
+def test_resume_only_launches_what_was_not_dispatched(chain_registry, service_request, tmpdir):
+    whole = Hypervisor(registry=chain_registry, ecs_client=FakeECSClient())
+    whole.execute_service(service_request)
+
+    first_ecs = FakeECSClient()
+    first = Hypervisor(registry=chain_registry, ecs_client=first_ecs, chunk_size=2, checkpoint_dir=str(tmpdir))
+    checkpoints = crash_after(first, 3)
+    with pytest.raises(Crash):
+        first.execute_service(service_request)
+    # One task finished before the crash, the others were still running.
+    first_ecs.set_task_state(first_ecs.launched_arns[0], 'STOPPED', exit_code=0)
+    first.tracker.poll()
+    # Held by the first hypervisor until its process is gone.
+    assert pending_checkpoints(str(tmpdir)) == []
+    checkpoints[-1].close()
+
+    paths = pending_checkpoints(str(tmpdir))
+    assert len(paths) == 1
+    second_ecs = FakeECSClient(first_task=100)
+    second = Hypervisor(registry=chain_registry, ecs_client=second_ecs, chunk_size=2, checkpoint_dir=str(tmpdir))
+    job = Job({'resume': paths[0]})
+    job.status = RUNNING
+    second.execute_service({'resume': paths[0]}, job)
+
+    assert len(first.dispatch_results) == 5
+    assert set(first.dispatch_results).isdisjoint(second.dispatch_results)
+    assert set(first.dispatch_results) | set(second.dispatch_results) == set(whole.dispatch_results)
+    # Tasks launched before the crash are followed by the new process, except the one that had finished.
+    assert set(second.tracker.tasks) == set(first_ecs.launched_arns[1:]) | set(second_ecs.launched_arns)
+    # The job counts the tasks it follows again along with the ones it launched.
+    assert sum(counts['dispatched'] for counts in job.progress.values()) == len(whole.dispatch_results) - 1
+
+    for arn in first_ecs.launched_arns[1:]:
+        second_ecs.set_task_state(arn, 'STOPPED', exit_code=0)
+    for arn in second_ecs.launched_arns:
+        second_ecs.set_task_state(arn, 'STOPPED', exit_code=0)
+    second.tracker.poll()
+    job.finish_dispatch()
+    assert job.status == 'COMPLETED'
+    assert pending_checkpoints(str(tmpdir)) == []
+    assert not os.path.exists(paths[0])
+
+
+def test_tasks_of_the_previous_process_are_launched_again(chain_registry, tmpdir, ecs_client):
+    path = os.path.join(str(tmpdir), 'job.jsonl')
+    task = {'dataId': 'SelectLocation/h1/', 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+    checkpoint = Checkpoint(path)
+    checkpoint.start({'target_service': 'SelectLocation', 'parameters': {'SelectLocation': {'locations': ['Dhaka']}}},
+                     {0: [0, 1]}, {'SelectLocation': 0})
+    checkpoint.chunk_dispatched(0, 1)
+    checkpoint.task_launched('local:task/1', [task])
+    checkpoint.close()
+
+    local = RecordingExecutor()
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, checkpoint_dir=str(tmpdir),
+                            executors={LOCAL: local}, default_backend=LOCAL)
+    job = Job({'resume': path})
+    job.status = RUNNING
+    hypervisor.execute_service({'resume': path}, job)
+    assert local.bundles == [[task]]
+    assert job.progress[0]['dispatched'] == 1
+
+    hypervisor.tracker.report_stopped('local:task/1', 0)
+    job.finish_dispatch()
+    assert job.status == 'COMPLETED'
+    assert pending_checkpoints(str(tmpdir)) == []
+
+
+def test_checkpoint_tolerates_a_cut_short_record(tmpdir):
+    path = os.path.join(str(tmpdir), 'job.jsonl')
+    checkpoint = Checkpoint(path)
+    a, b = {'dataId': 'S/a', 'service_name': 'S'}, {'dataId': 'S/b', 'service_name': 'S'}
+    checkpoint.start({'target_service': 'S'}, {0: [0, 4]}, {'S': 0})
+    checkpoint.chunk_dispatched(0, 2)
+    checkpoint.task_launched('arn/1', [a, b])
+    checkpoint.close()
+    with open(path, 'a') as f:
+        f.write('{"type": "finished_ta')
+
+    checkpoint = Checkpoint(path)
+    assert checkpoint.cursors == {0: 2}
+    assert checkpoint.service_levels == {'S': 0}
+    assert checkpoint.running() == {'arn/1': [a, b]}
+    checkpoint.task_finished('S/a', True)
+    checkpoint.close()
+
+    checkpoint = Checkpoint(path)
+    assert checkpoint.completed('S/a')
+    assert checkpoint.running() == {'arn/1': [b]}
+    checkpoint.close()
+
+
+def test_cancelled_requests_are_not_resumed(chain_registry, service_request, tmpdir, ecs_client):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, checkpoint_dir=str(tmpdir))
+    job = Job(service_request)
+    hypervisor.execute_service(service_request, job)
+    assert len(os.listdir(str(tmpdir))) == 1
+
+    job.cancel()
+    assert pending_checkpoints(str(tmpdir)) == []
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_only_the_last_record_marks_a_checkpoint_done(tmpdir):
+    done = os.path.join(str(tmpdir), 'done.jsonl')
+    with open(done, 'w') as f:
+        f.write('{"type": "plan", "request": {}, "ranges": {}}\n' * 1000 + '{"type": "done"}\n')
+    cut_short = os.path.join(str(tmpdir), 'cut_short.jsonl')
+    with open(cut_short, 'w') as f:
+        f.write('{"type": "dispatched"}\n{"type": "do')
+    assert pending_checkpoints(str(tmpdir)) == [cut_short]
+
+
+def test_a_checkpoint_is_resumed_by_one_hypervisor_only(chain_registry, ecs_client, tmpdir):
+    path = os.path.join(str(tmpdir), 'job.jsonl')
+    checkpoint = Checkpoint(path)
+    checkpoint.start({'target_service': 'SelectLocation', 'parameters': {'SelectLocation': {'locations': ['Dhaka']}}},
+                     {0: [0, 1]}, {'SelectLocation': 0})
+    with pytest.raises(CheckpointLocked):
+        Checkpoint(path)
+    assert pending_checkpoints(str(tmpdir)) == []
+
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, checkpoint_dir=str(tmpdir))
+    job = Job({'resume': path})
+    job.status = RUNNING
+    hypervisor.execute_service({'resume': path}, job)
+    job.finish_dispatch()
+    assert job.status == 'CANCELLED'
+    assert ecs_client.run_task_calls == []
+
+    checkpoint.close()
+    assert pending_checkpoints(str(tmpdir)) == [path]
+
+
+def test_resumed_requests_keep_their_dispatch_flow(chain_registry, service_request, ecs_client, tmpdir):
+    request = dict(service_request, requester='ops', request_name='sweep', priority=2)
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, checkpoint_dir=str(tmpdir))
+    job = Job(request)
+    hypervisor.execute_service(request, job)
+
+    path = os.path.join(str(tmpdir), job.id + '.jsonl')
+    with open(path) as f:
+        plan = json.loads(f.readline())
+    resumed = Job(dict(plan['request'], resume=path))
+    assert hypervisor.flow_of(resumed) == hypervisor.flow_of(job) == ('ops', 1, 2)
+
+
+def test_checkpointed_levels_dispatch_the_longest_critical_paths_first(fast_slow_registry, ecs_client, tmpdir):
+    hypervisor = Hypervisor(registry=fast_slow_registry, ecs_client=ecs_client, checkpoint_dir=str(tmpdir))
+    for _ in range(3):
+        hypervisor.history.record('Slow', {'p': '1'}, 100.0)
+        hypervisor.history.record('Fast', {'p': '1'}, 1.0)
+    job = Job({'target_service': 'Target', 'parameters': {'Fast': {'p': ['1', '2']}, 'Slow': {'p': ['1', '2']}}})
+    hypervisor.execute_service(job.request, job)
+
+    assert next(iter(hypervisor.dispatch_results)).startswith('Slow/')
+    with open(os.path.join(str(tmpdir), job.id + '.jsonl')) as f:
+        plan = json.loads(f.readline())
+    # Resumed in the same order, whatever the runtimes are by then.
+    assert plan['orders']['0'] == ['Slow', 'Fast']
@@ -0,0 +1,241 @@
+from modules.dispatch import Dispatcher, FairDispatcher, TokenBucket
+from modules.hypervisor import Hypervisor, MAX_OVERRIDE_BYTES
+from modules.jobs import Job
+from fakes import FakeECSClient, FakeS3Client
+import json
+import threading
+import time
+
+
+def test_dispatcher_runs_concurrently_and_keeps_order():
+    ecs_client = FakeECSClient(latency=0.05)
+    dispatcher = Dispatcher(max_workers=8)
+    start = time.monotonic()
+    results = dispatcher.map(lambda i: ecs_client.run_task(index=i), range(32))
+    elapsed = time.monotonic() - start
+    dispatcher.shutdown()
+
+    assert [r.item for r in results] == list(range(32))
+    assert all(r.succeeded for r in results)
+    assert ecs_client.max_in_flight == 8
+    assert elapsed < 32 * 0.05 / 2
+
+
+def test_dispatcher_captures_errors_per_item():
+    def launch(i):
+        if i == 2:
+            raise ValueError("throttled")
+        return i
+
+    results = Dispatcher(max_workers=4).map(launch, range(4))
+    assert [r.response for r in results] == [0, 1, None, 3]
+    assert isinstance(results[2].error, ValueError)
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, capacity=5)
+    start = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+def blocked_launches(dispatcher):
+    """
+    Occupies the dispatcher's only thread until the returned gate is set, so the order items are queued in is known.
+    """
+    gate, started = threading.Event(), threading.Event()
+    order = []
+
+    def launch(item):
+        started.set()
+        gate.wait()
+        order.append(item)
+    dispatcher.submit(launch, ['blocker'])
+    started.wait()
+    return launch, gate, order
+
+
+def test_fair_dispatcher_interleaves_small_requests_with_large_ones():
+    dispatcher = FairDispatcher(max_workers=1)
+    launch, gate, order = blocked_launches(dispatcher)
+    dispatcher.submit(launch, [('sweep', i) for i in range(20)], flow='sweep')
+    dispatcher.submit(launch, [('interactive', i) for i in range(2)], flow='interactive')
+    dispatcher.submit(launch, [('urgent', 0)], flow='ops', priority=1)
+    gate.set()
+    while len(order) < 24:
+        time.sleep(0.01)
+    dispatcher.shutdown()
+
+    assert order[1] == ('urgent', 0)
+    assert order.index(('interactive', 1)) <= 5
+    assert [i for flow, i in order[1:] if flow == 'sweep'] == list(range(20))
+
+
+def test_fair_dispatcher_weights_flows():
+    dispatcher = FairDispatcher(max_workers=1)
+    launch, gate, order = blocked_launches(dispatcher)
+    dispatcher.submit(launch, ['a'] * 12, flow='a', weight=3)
+    dispatcher.submit(launch, ['b'] * 12, flow='b')
+    gate.set()
+    while len(order) < 25:
+        time.sleep(0.01)
+    dispatcher.shutdown()
+    assert order[1:13].count('a') == 9
+
+
+def test_fair_dispatcher_caps_running_tasks():
+    dispatcher = FairDispatcher(max_workers=4, max_running=2)
+    ecs_client = FakeECSClient()
+    entries = dispatcher.submit(lambda i: ecs_client.run_task(index=i), range(5))
+    time.sleep(0.1)
+    assert len(ecs_client.run_task_calls) == 2
+
+    dispatcher.release(ecs_client.launched_arns[0])
+    entries[2].done.wait(1)
+    time.sleep(0.05)
+    assert len(ecs_client.run_task_calls) == 3
+    for arn in ecs_client.launched_arns:
+        dispatcher.release(arn)
+    for entry in entries:
+        assert entry.done.wait(1)
+    dispatcher.shutdown()
+
+
+def test_hypervisor_launches_more_as_running_tasks_stop():
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(ecs_client=ecs_client, max_concurrency=2, max_running_tasks=2)
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+                    for i in range(3)]
+    dispatch = threading.Thread(target=hypervisor.compute_task_descriptions, args=(descriptions,))
+    dispatch.start()
+    time.sleep(0.1)
+    assert len(ecs_client.run_task_calls) == 2
+
+    ecs_client.set_task_state(ecs_client.launched_arns[0], 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+    dispatch.join(1)
+    assert len(ecs_client.run_task_calls) == 3
+    assert hypervisor.metrics_snapshot()['running'] == 2
+
+
+def test_hypervisor_collects_dispatch_results():
+    ecs_client = FakeECSClient(latency=0.01)
+    hypervisor = Hypervisor(ecs_client=ecs_client, max_concurrency=4)
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+                    for i in range(10)]
+    hypervisor.compute_task_descriptions(descriptions)
+
+    assert len(hypervisor.dispatch_results) == 10
+    assert all(len(r['taskArns']) == 1 and r['error'] is None for r in hypervisor.dispatch_results.values())
+
+
+def test_only_the_latest_dispatch_results_are_kept():
+    hypervisor = Hypervisor(ecs_client=FakeECSClient(), max_dispatch_results=3)
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+                    for i in range(5)]
+    hypervisor.compute_task_descriptions(descriptions)
+
+    assert list(hypervisor.dispatch_results) == ['SelectLocation/h2/', 'SelectLocation/h3/', 'SelectLocation/h4/']
+
+
+def test_bundles_pack_tasks_of_the_same_service():
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(ecs_client=ecs_client, bundle_size=4)
+    descriptions = [{'dataId': '{}/h{}/'.format(service, i), 'service_name': service, 'inputs': {}, 'outputs': {}, 'parameters': {}}
+                    for service in ('SelectLocation', 'BiasCorrection') for i in range(6)]
+    results = hypervisor.compute_task_descriptions(descriptions)
+
+    assert [len(r.item) for r in results] == [4, 2, 4, 2]
+    assert all(len(set(d['service_name'] for d in r.item)) == 1 for r in results)
+    assert len(ecs_client.run_task_calls) == 4
+    command = ecs_client.run_task_calls[0]['overrides']['containerOverrides'][0]['command'][0]
+    assert command.count('python3 /app/main.py') == 4
+    assert 'echo [bundle] SelectLocation/h3/ exit=' in command
+    assert hypervisor.dispatch_results['SelectLocation/h1/']['taskArns'] == hypervisor.dispatch_results['SelectLocation/h0/']['taskArns']
+    assert hypervisor.dispatch_results['SelectLocation/h1/']['bundleSize'] == 4
+
+
+def test_tasks_of_a_failed_bundle_finish_with_their_own_exit_codes():
+    ecs_client = FakeECSClient()
+    s3_client = FakeS3Client()
+    hypervisor = Hypervisor(ecs_client=ecs_client, s3_client=s3_client, bundle_size=3)
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {},
+                     'outputs': {'output1': 's3://climate-ensembling/SelectLocation/h{}/'.format(i)}, 'parameters': {}} for i in range(3)]
+    job = Job({})
+    hypervisor.compute_task_descriptions(descriptions, job, [job])
+    command = ecs_client.run_task_calls[0]['overrides']['containerOverrides'][0]['command'][0]
+    assert 'aws s3 cp - s3://climate-ensembling/SelectLocation/h2/_status.json' in command
+
+    # The third task never ran, the container was stopped after the second failed.
+    s3_client.objects[('climate-ensembling', 'SelectLocation/h0/_status.json')] = b'{"exitCode": 0}'
+    s3_client.objects[('climate-ensembling', 'SelectLocation/h1/_status.json')] = b'{"exitCode": 2}'
+    ecs_client.set_task_state(ecs_client.launched_arns[0], 'STOPPED', exit_code=1)
+    hypervisor.tracker.poll()
+    assert job.progress[0]['completed'] == 1
+    assert job.progress[0]['failed'] == 2
+    assert hypervisor.metrics_snapshot()['counters']['tasks_failed'] == 2
+
+
+def test_auto_bundles_fit_in_the_overrides_limit():
+    hypervisor = Hypervisor(bundle_size='auto')
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {},
+                     'parameters': {'SelectLocation': {'models': ['s3://climate-ensembling/EC-Earth3/'] * 5}}} for i in range(200)]
+    bundles = hypervisor.build_bundles(descriptions)
+
+    assert sum(len(b) for b in bundles) == 200
+    assert len(bundles) < 200 / 8
+    assert all(len(json.dumps(hypervisor._build_bundle_command(b))) <= MAX_OVERRIDE_BYTES for b in bundles)
+
+
+def test_offloaded_payloads_keep_commands_short():
+    ecs_client = FakeECSClient()
+    s3_client = FakeS3Client()
+    hypervisor = Hypervisor(ecs_client=ecs_client, s3_client=s3_client, bundle_size=2, offload_payloads=True)
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {},
+                     'parameters': {'SelectLocation': {'models': ['s3://climate-ensembling/EC-Earth3/'] * 500}}} for i in range(4)]
+    hypervisor.compute_task_descriptions(descriptions)
+
+    assert s3_client.put_object_calls == 1
+    (bucket, key), body = next(iter(s3_client.objects.items()))
+    location = "s3://{}/{}".format(bucket, key)
+    assert [d['dataId'] for d in json.loads(body)] == [d['dataId'] for d in descriptions]
+    command = ecs_client.run_task_calls[1]['overrides']['containerOverrides'][0]['command'][0]
+    assert "--payload={} --payload-index=2".format(location) in command
+    assert "--payload-index=3" in command
+    assert 'pip freeze' not in command
+    assert len(command) < 500
+    assert hypervisor._payload_refs == {}
+
+    for arn in ecs_client.launched_arns:
+        ecs_client.set_task_state(arn, 'STOPPED', exit_code=0)
+        hypervisor.tracker.poll()
+        # The payload is only deleted once both of its bundles have stopped.
+        assert bool(s3_client.objects) == (arn != ecs_client.launched_arns[-1])
+
+
+def test_failed_offload_passes_parameters_inline():
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(ecs_client=ecs_client, s3_client=FakeS3Client(fail=True), offload_payloads=True,
+                            diagnostics=True)
+    hypervisor.compute_task_descriptions([{'dataId': 'SelectLocation/h1/', 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}])
+
+    command = ecs_client.run_task_calls[0]['overrides']['containerOverrides'][0]['command'][0]
+    assert "--parameters=" in command and 'pip freeze' in command
+
+
+def test_payloads_of_a_data_id_launched_twice_are_deleted():
+    ecs_client = FakeECSClient()
+    s3_client = FakeS3Client()
+    hypervisor = Hypervisor(ecs_client=ecs_client, s3_client=s3_client, offload_payloads=True)
+    description = {'dataId': 'SelectLocation/h1/', 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+    other = dict(description, dataId='SelectLocation/h2/')
+    hypervisor.compute_task_descriptions([description])
+    hypervisor.compute_task_descriptions([description, other])
+    assert len(s3_client.objects) == 2
+
+    for arn in ecs_client.launched_arns:
+        ecs_client.set_task_state(arn, 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+    assert s3_client.objects == {}
+    assert hypervisor._payload_keys == {} and hypervisor._payload_tasks == {}
@@ -0,0 +1,93 @@
+from modules.hypervisor import Hypervisor
+from modules.executors import LocalExecutor, LOCAL, STATUS_OBJECT, localize
+import json
+import os
+import time
+import pytest
+
+ENTRY_POINT = '''
+import argparse
+import json
+import os
+import sys
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--parameters')
+parameters = json.loads(parser.parse_args().parameters)
+with open(os.path.join(parameters['outputs']['output1'], 'output.json'), 'w') as f:
+    json.dump({'cwd': os.getcwd(), 'inputs': parameters['inputs']}, f)
+thresholds = parameters['parameters'][parameters['service_name']].get('thresholds')
+sys.exit(3 if thresholds == 'fail' else 0)
+'''
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+@pytest.fixture
+def entry_point(tmp_path):
+    path = tmp_path / 'service' / 'main.py'
+    path.parent.mkdir()
+    path.write_text(ENTRY_POINT)
+    return str(path)
+
+
+def test_localize_maps_s3_locations_under_root(tmp_path):
+    description = {'dataId': 'BiasCorrection/h1/h2/', 'inputs': {'SelectLocation': 's3://climate-ensembling/SelectLocation/h1/'},
+                   'outputs': {'output1': 's3://climate-ensembling/BiasCorrection/h1/h2/'}, 'parameters': {'models': ['s3://climate-ensembling/EC-Earth3/']}}
+    local = localize(description, str(tmp_path))
+
+    assert local['inputs']['SelectLocation'] == os.path.join(str(tmp_path), 'climate-ensembling/SelectLocation/h1/')
+    assert local['parameters']['models'] == [os.path.join(str(tmp_path), 'climate-ensembling/EC-Earth3/')]
+    assert os.path.isdir(local['outputs']['output1'])
+    assert description['outputs']['output1'].startswith('s3://')
+
+
+def test_services_run_on_the_backend_their_policy_names(chain_registry, entry_point, tmp_path, ecs_client):
+    local = LocalExecutor(str(tmp_path / 'data'), default_entry_point=entry_point, max_workers=2)
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, scheduling='dag',
+                            executors={LOCAL: local}, backends={'SelectLocation': LOCAL})
+    parameters = {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2', '3']}}
+    scheduler = hypervisor.execute_service({'target_service': 'BiasCorrection', 'parameters': parameters})
+
+    # SelectLocation runs locally, its completion releases BiasCorrection to ECS.
+    wait_for(lambda: len(ecs_client.run_task_calls) == 6)
+    local.shutdown()
+    outputs = [os.path.join(root, f) for root, _, files in os.walk(str(tmp_path / 'data')) for f in files if f != STATUS_OBJECT]
+    assert len(outputs) == 2
+    with open(outputs[0]) as f:
+        assert json.load(f)['cwd'] == os.path.dirname(entry_point)
+    assert all(hypervisor.tracker.status_of(data_id)['status'] == 'STOPPED' for data_id in scheduler.tasks
+               if data_id.startswith('SelectLocation/'))
+    assert hypervisor.tracker.active_count == 6
+    assert not scheduler.finished
+
+
+def test_local_exit_codes_reach_the_scheduler(chain_registry, entry_point, tmp_path, ecs_client):
+    local = LocalExecutor(str(tmp_path / 'data'), default_entry_point=entry_point)
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, scheduling='dag',
+                            executors={LOCAL: local}, default_backend=LOCAL)
+    parameters = {'SelectLocation': {'locations': ['Dhaka']}, 'BiasCorrection': {'thresholds': ['1', 'fail']}}
+    scheduler = hypervisor.execute_service({'target_service': 'BiasCorrection', 'parameters': parameters})
+
+    wait_for(lambda: scheduler.finished)
+    local.shutdown()
+    assert scheduler.counts() == {'PENDING': 0, 'DISPATCHED': 0, 'COMPLETED': 2, 'FAILED': 1}
+    assert hypervisor.metrics.snapshot()['counters']['tasks_failed'] == 1
+
+
+def test_tasks_of_a_local_bundle_finish_with_their_own_exit_codes(chain_registry, entry_point, tmp_path, ecs_client):
+    local = LocalExecutor(str(tmp_path / 'data'), default_entry_point=entry_point)
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, scheduling='dag', bundle_size=3,
+                            executors={LOCAL: local}, default_backend=LOCAL)
+    parameters = {'SelectLocation': {'locations': ['Dhaka']}, 'BiasCorrection': {'thresholds': ['1', 'fail', '2']}}
+    scheduler = hypervisor.execute_service({'target_service': 'BiasCorrection', 'parameters': parameters})
+
+    wait_for(lambda: scheduler.finished)
+    local.shutdown()
+    assert scheduler.counts() == {'PENDING': 0, 'DISPATCHED': 0, 'COMPLETED': 3, 'FAILED': 1}
+    assert hypervisor.dispatch_results[next(d for d in scheduler.tasks if d.startswith('BiasCorrection/'))]['bundleSize'] == 3
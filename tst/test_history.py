@@ -0,0 +1,70 @@
+from modules.hypervisor import Hypervisor
+from modules.history import RuntimeHistory
+
+
+def test_runtime_summaries_and_predictions(fast_slow_registry):
+    history = RuntimeHistory(fast_slow_registry, max_samples=10, flush_every=5)
+    for i in range(12):
+        history.record('Slow', {'p': 'big' if i % 2 else 'small'}, 10.0 if i % 2 else 2.0)
+
+    summary = history.summary('Slow')
+    assert summary['count'] == 10
+    assert summary['mean'] == 6.0
+    assert summary['p95'] == 10.0
+    assert summary['parameters']['p'] == {'big': {'count': 5, 'mean': 10.0}, 'small': {'count': 5, 'mean': 2.0}}
+    assert history.predict('Slow', {'p': 'big'}) == 10.0
+    assert history.predict('Slow', {'p': 'unseen'}) == 6.0
+    assert history.predict('Fast') is None
+
+    history.flush()
+    reloaded = RuntimeHistory(fast_slow_registry)
+    reloaded.load(['Slow', 'Fast'])
+    assert reloaded.summary('Slow') == summary
+
+
+def test_samples_with_float_parameters_are_stored(fast_slow_registry):
+    history = RuntimeHistory(fast_slow_registry, flush_every=3)
+    for _ in range(3):
+        history.record('Slow', {'p': 0.5}, 4.0)
+    assert not history._unflushed
+
+    reloaded = RuntimeHistory(fast_slow_registry)
+    reloaded.load(['Slow'])
+    assert reloaded.predict('Slow', {'p': 0.5}) == 4.0
+
+
+def test_failed_loads_are_retried(fast_slow_registry):
+    RuntimeHistory(fast_slow_registry, flush_every=1).record('Slow', {'p': '1'}, 4.0)
+    get_runtime_samples = fast_slow_registry.get_runtime_samples
+    fast_slow_registry.get_runtime_samples = lambda services: 1 / 0
+    history = RuntimeHistory(fast_slow_registry)
+    history.load(['Slow'])
+    assert history.predict('Slow') is None
+
+    fast_slow_registry.get_runtime_samples = get_runtime_samples
+    history.load(['Slow'])
+    assert history.predict('Slow') == 4.0
+
+
+def test_completed_tasks_are_recorded(fast_slow_registry, ecs_client):
+    hypervisor = Hypervisor(registry=fast_slow_registry, ecs_client=ecs_client)
+    hypervisor.execute_service({'target_service': 'Target', 'parameters': {'Fast': {'p': ['1', '2']}, 'Slow': {'p': ['1']}}})
+    for arn in ecs_client.launched_arns:
+        ecs_client.set_task_state(arn, 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+
+    assert len(hypervisor.history.samples['Fast']) == 2
+    assert len(hypervisor.history.samples['Slow']) == 1
+    assert hypervisor.history.summary('Fast')['parameters']['p'].keys() == {'1', '2'}
+
+
+def test_longest_critical_paths_are_dispatched_first(fast_slow_registry, ecs_client):
+    hypervisor = Hypervisor(registry=fast_slow_registry, ecs_client=ecs_client, bundle_size='auto')
+    for _ in range(3):
+        hypervisor.history.record('Slow', {'p': '1'}, 100.0)
+        hypervisor.history.record('Fast', {'p': '1'}, 1.0)
+    hypervisor.execute_service({'target_service': 'Target', 'parameters': {'Fast': {'p': ['1', '2']}, 'Slow': {'p': ['1', '2']}}})
+
+    assert next(iter(hypervisor.dispatch_results)).startswith('Slow/')
+    assert hypervisor.bundle_limit('Slow') == 3
+    assert hypervisor.bundle_limit('Fast') == 64
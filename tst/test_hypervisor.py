@@ -0,0 +1,108 @@
+from modules.hypervisor import Hypervisor
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+from testdata import SERVICE_DESCRIPTIONS
+import networkx as nx
+import pytest
+import json
+import types
+
+
+@pytest.fixture
+def service_graph():
+    graph = nx.DiGraph()
+    graph.add_edge("SelectLocation", "BiasCorrection")
+    graph.add_edge("BiasCorrection", "CalculateCost")
+    return graph
+
+@pytest.fixture
+def parameters():
+    parameters_sl = {'SelectLocation': {'base_model': ['s3://climate-ensembling/EC-Earth3/'], 'models': ['TESTMODEL1', 'TESTMODEL2'], 'locations': ['Dhaka', 'Chicago']}}
+    parameters_bc = {'BiasCorrection': {'bias_correction_methods': ['bc1', 'bc2'], 'thresholds': ['1', '2']}}
+    parameters_cc = {'CalculateCost': {'time_windows': [['today', 'tomorrow'], [1980, 2020]]}}
+    return {**parameters_sl, **parameters_bc, **parameters_cc}
+
+@pytest.fixture
+def hypervisor():
+    return Hypervisor(registry=None, s3_client=None, ecs_client=None)
+
+@pytest.fixture
+def fake_registry():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    for sdesc in SERVICE_DESCRIPTIONS:
+        with open(sdesc) as f:
+            registry.put_service(json.load(f))
+    return registry
+
+@pytest.fixture
+def fake_ecs_client():
+    return FakeECSClient()
+
+@pytest.fixture
+def service_request(parameters):
+    return {"request_name": "Request 1", "target_service": "CalculateCost", "parameters": parameters}
+
+
+def test_streaming_matches_materialized_tasks(hypervisor, service_graph, parameters):
+    s_e = hypervisor.build_expanded_service_sets(parameters)
+    preds = hypervisor.build_predecessor_level_dict(service_graph, "CalculateCost")
+
+    tasks_by_level = hypervisor.build_tasks_per_level(preds, s_e, service_graph)
+    streamed_by_level = hypervisor.iter_tasks_per_level(preds, s_e, service_graph)
+
+    assert list(streamed_by_level.keys()) == list(tasks_by_level.keys())
+    for level, level_tasks in streamed_by_level.items():
+        assert isinstance(level_tasks, types.GeneratorType)
+        assert list(level_tasks) == tasks_by_level[level]
+    assert len(tasks_by_level[2]) == 32
+
+
+def test_streaming_dispatches_before_expansion_finishes(hypervisor, service_graph, parameters):
+    s_e = hypervisor.build_expanded_service_sets(parameters)
+    preds = hypervisor.build_predecessor_level_dict(service_graph, "CalculateCost")
+    level_tasks = hypervisor.iter_tasks_per_level(preds, s_e, service_graph)[2]
+
+    first = next(level_tasks)
+    assert [task['service'] for task in first] == ["SelectLocation", "BiasCorrection", "CalculateCost"]
+    assert len(list(level_tasks)) == 31
+
+
+def test_hashes_are_cached_across_requests(hypervisor, service_graph, parameters):
+    s_e = hypervisor.build_expanded_service_sets(parameters)
+    preds = hypervisor.build_predecessor_level_dict(service_graph, "CalculateCost")
+    tasks = hypervisor.build_tasks_per_level(preds, s_e, service_graph)[2]
+    first_hashes = [hypervisor.build_input_task_set_hashes(task_set) for task_set in tasks]
+    misses = hypervisor.tshash_cache.misses
+
+    assert hypervisor.build_expanded_service_sets(parameters) == s_e
+    assert hypervisor.hash_cache.hits == sum(len(tasks) for tasks in s_e.values())
+    assert [hypervisor.build_input_task_set_hashes(task_set) for task_set in tasks] == first_hashes
+    assert hypervisor.tshash_cache.misses == misses
+
+    for task_set, tshashes in zip(tasks, first_hashes):
+        for i, task in enumerate(task_set):
+            assert tshashes[task['service']]['tshash'] == hypervisor.build_task_set_hash(task_set[:i + 1])
+
+
+def test_hash_cache_keeps_json_types_apart(hypervisor):
+    assert hypervisor.hash_single_service({'thresholds': 1}) != hypervisor.hash_single_service({'thresholds': True})
+    assert hypervisor.hash_single_service({'thresholds': 1}) == hypervisor._hash_parameters({'thresholds': 1})
+
+
+def test_reuse_skips_materialized_outputs(fake_registry, fake_ecs_client, service_request):
+    hypervisor = Hypervisor(registry=fake_registry, ecs_client=fake_ecs_client, reuse_outputs=True)
+    hypervisor.execute_service(service_request)
+    assert len(fake_ecs_client.run_task_calls) == 4 + 16 + 32
+    assert len(hypervisor.pending_outputs) == 4 + 16 + 32
+
+    for data_id in list(hypervisor.pending_outputs)[:10]:
+        assert hypervisor.mark_output_completed(data_id)
+    assert not hypervisor.mark_output_completed(data_id)
+    # Failed tasks have no output to record.
+    failed = next(iter(hypervisor.pending_outputs))
+    hypervisor.notify_completed(failed, succeeded=False)
+    assert failed not in hypervisor.pending_outputs
+
+    rerun = Hypervisor(registry=fake_registry, ecs_client=FakeECSClient(), reuse_outputs=True)
+    rerun.execute_service(service_request)
+    assert len(rerun.ecs_client.run_task_calls) == 4 + 16 + 32 - 10
@@ -0,0 +1,117 @@
+from modules.hypervisor import Hypervisor
+from modules.jobs import JobManager, Job, COMPLETED, CANCELLED, WAITING
+from modules.tracker import STOPPED
+from fakes import FakeECSClient
+import threading
+import time
+import pytest
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+@pytest.fixture
+def service_request():
+    return {'request_name': 'Request 1', 'target_service': 'BiasCorrection',
+            'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2', '3']}}}
+
+
+def test_job_reports_per_level_progress(chain_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client)
+    jobs = JobManager(hypervisor.execute_service)
+    job = jobs.submit(service_request)
+
+    wait_for(lambda: job.status == WAITING)
+    progress = job.to_dict()['progress']
+    assert progress['0'] == {'planned': 2, 'skipped': 0, 'dispatched': 2, 'attached': 0, 'completed': 0, 'failed': 0}
+    assert progress['1']['dispatched'] == 6
+
+    for arn in ecs_client.launched_arns:
+        ecs_client.set_task_state(arn, STOPPED, exit_code=0)
+    hypervisor.tracker.poll()
+    assert job.status == COMPLETED
+    assert job.to_dict()['progress']['1']['completed'] == 6
+    assert len(hypervisor.in_flight) == 0
+
+
+def test_cancelled_job_stops_dispatching(chain_registry, service_request):
+    release = threading.Event()
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=FakeECSClient(), chunk_size=1)
+    original = hypervisor.compute_tasks
+
+    def slow_compute_tasks(task_sets, job=None):
+        release.wait()
+        return original(task_sets, job)
+
+    hypervisor.compute_tasks = slow_compute_tasks
+    jobs = JobManager(hypervisor.execute_service)
+    job = jobs.submit(service_request)
+    queued = jobs.submit(service_request)
+    wait_for(lambda: job.status == 'RUNNING')
+
+    jobs.cancel(queued.id)
+    assert queued.status == CANCELLED
+    jobs.cancel(job.id)
+    release.set()
+    wait_for(lambda: job.status == CANCELLED)
+    assert len(hypervisor.ecs_client.run_task_calls) == 1
+
+
+def test_job_cancelled_after_its_last_dispatch_is_cancelled(chain_registry, service_request):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=FakeECSClient())
+    jobs = JobManager(lambda request, job: (hypervisor.execute_service(request, job), job.cancel()))
+    job = jobs.submit(service_request)
+    wait_for(lambda: job.done)
+    assert job.status == CANCELLED
+
+
+def test_identical_requests_share_in_flight_tasks(chain_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client)
+    first, second = Job(service_request), Job(service_request)
+    first.status = second.status = 'RUNNING'
+    hypervisor.execute_service(service_request, first)
+    first.finish_dispatch()
+    hypervisor.execute_service(service_request, second)
+    second.finish_dispatch()
+
+    assert len(ecs_client.run_task_calls) == 8
+    assert second.to_dict()['progress']['1']['attached'] == 6
+
+    ecs_client.set_task_state(ecs_client.launched_arns[0], STOPPED, exit_code=1)
+    for arn in ecs_client.launched_arns[1:]:
+        ecs_client.set_task_state(arn, STOPPED, exit_code=0)
+    hypervisor.tracker.poll()
+    assert first.status == second.status == 'FAILED'
+    assert first.to_dict()['progress']['0']['failed'] == second.to_dict()['progress']['0']['failed'] == 1
+
+    # The failed task is no longer in flight, so a new request launches it again.
+    third = Job(service_request)
+    hypervisor.execute_service(service_request, third)
+    assert len(ecs_client.run_task_calls) == 16
+
+
+def test_requests_without_waiters_are_not_coalesced(chain_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client)
+    hypervisor.execute_service(service_request)
+    hypervisor.execute_service(service_request)
+
+    assert len(ecs_client.run_task_calls) == 16
+    assert len(hypervisor.in_flight) == 0
+    assert 'tasks_attached' not in hypervisor.metrics_snapshot()['counters']
+
+
+def test_cancelling_the_last_waiter_stops_the_task(chain_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client)
+    first, second = Job(service_request), Job(service_request)
+    hypervisor.execute_service(service_request, first)
+    hypervisor.execute_service(service_request, second)
+
+    first.cancel()
+    assert ecs_client.stop_task_calls == []
+    second.cancel()
+    assert sorted(c['task'] for c in ecs_client.stop_task_calls) == sorted(ecs_client.launched_arns)
+    assert len(hypervisor.in_flight) == 0
@@ -0,0 +1,42 @@
+from modules.hypervisor import Hypervisor
+from modules.jobs import Job
+from modules.metrics import Metrics
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+import logging
+
+
+def test_metrics_counts_and_times_phases():
+    metrics = Metrics()
+    metrics.incr('tasks_planned', 3)
+    metrics.incr('tasks_planned')
+    with metrics.timer('dispatch'):
+        pass
+    metrics.observe('dispatch', 0.5)
+    snapshot = metrics.snapshot()
+
+    assert snapshot['counters'] == {'tasks_planned': 4}
+    assert snapshot['timers']['dispatch']['count'] == 2
+    assert snapshot['timers']['dispatch']['max_seconds'] == 0.5
+    assert snapshot['timers']['dispatch']['mean_seconds'] >= 0.25
+
+
+def test_hypervisor_reports_phase_timings_and_counters(caplog):
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {'locations': {}}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {'thresholds': {}}})
+    hypervisor = Hypervisor(registry=registry, ecs_client=FakeECSClient())
+    with caplog.at_level(logging.INFO):
+        request = {'request_name': 'Request 1', 'target_service': 'BiasCorrection',
+                   'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2', '3']}}}
+        hypervisor.execute_service(request, Job(request))
+    snapshot = hypervisor.metrics_snapshot()
+
+    assert snapshot['counters']['tasks_planned'] == 8
+    assert snapshot['counters']['tasks_dispatched'] == 8
+    assert snapshot['counters']['bundles_launched'] == 8
+    assert {'expansion', 'hashing', 'planning', 'registry', 'dispatch'} <= set(snapshot['timers'])
+    assert snapshot['in_flight'] == 8
+    assert 'task_hashes' in snapshot['caches']
+    # Per task set dumps are only built at DEBUG.
+    assert not any('Task set:' in r.getMessage() for r in caplog.records)
@@ -0,0 +1,55 @@
+from modules.hypervisor import Hypervisor, AdmissionError
+from modules.jobs import Job
+import pytest
+
+
+@pytest.fixture
+def service_request():
+    return {'target_service': 'CalculateCost',
+            'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2'], 'methods': ['a', 'b']},
+                           'Downscale': {'factors': [2, 4, 8]}, 'CalculateCost': {'time_windows': ['today', 'week']}}}
+
+
+def test_plan_counts_tasks_without_dispatching(diamond_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=diamond_registry, ecs_client=ecs_client, reuse_outputs=True)
+    plan = hypervisor.plan(service_request)
+
+    assert plan['services'] == {'SelectLocation': 2, 'BiasCorrection': 8, 'Downscale': 6, 'CalculateCost': 48}
+    assert plan['levels'] == {0: 2, 1: 14, 2: 48}
+    assert plan['total'] == 64
+    assert plan['existing'] == 0 and plan['admitted']
+    assert ecs_client.run_task_calls == []
+
+    hypervisor.execute_service(service_request)
+    assert len(hypervisor.dispatch_results) == plan['total']
+    for data_id in list(hypervisor.pending_outputs)[:5]:
+        hypervisor.mark_output_completed(data_id)
+    assert hypervisor.plan(service_request)['existing'] == 5
+
+
+def test_requests_over_the_limits_are_rejected_up_front(diamond_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=diamond_registry, ecs_client=ecs_client, max_tasks=100, max_level_tasks=40, max_existing_check=10)
+
+    with pytest.raises(AdmissionError) as e:
+        hypervisor.execute_service(service_request)
+    assert e.value.plan['levels'][2] == 48
+    assert ecs_client.run_task_calls == []
+    plan = hypervisor.plan(service_request)
+    assert not plan['admitted'] and plan['reason'] == "Level 2 of the request has 48 tasks, the limit is 40"
+    assert plan['existing'] is None
+
+    service_request['parameters']['CalculateCost']['time_windows'] = ['today']
+    hypervisor.execute_service(service_request)
+    assert len(hypervisor.dispatch_results) == 40
+
+
+def test_admitted_jobs_are_not_counted_again(diamond_registry, service_request, ecs_client):
+    hypervisor = Hypervisor(registry=diamond_registry, ecs_client=ecs_client, max_tasks=100)
+    counted = []
+    count_tasks = hypervisor.count_tasks
+    hypervisor.count_tasks = lambda *args: counted.append(args) or count_tasks(*args)
+
+    hypervisor.execute_service(service_request, Job(service_request, admitted=True))
+    assert counted == []
+    hypervisor.execute_service(service_request, Job(service_request))
+    assert len(counted) == 1
@@ -0,0 +1,36 @@
+from modules.hypervisor import Hypervisor
+from modules.profiling import ProfileStore
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+import os
+import tracemalloc
+
+
+def test_profile_of_a_request(tmpdir):
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {'locations': {}}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {'thresholds': {}}})
+    hypervisor = Hypervisor(registry=registry, ecs_client=FakeECSClient())
+    profiles = ProfileStore(max_profiles=2, directory=str(tmpdir))
+    request = {'request_name': 'sweep', 'target_service': 'BiasCorrection',
+               'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Lima']}, 'BiasCorrection': {'thresholds': ['1', '2']}}}
+
+    with profiles.profile('job-1', request['request_name']):
+        hypervisor.execute_service(request)
+
+    profile = profiles.get('job-1')
+    assert profile['label'] == 'sweep'
+    assert profile['seconds'] > 0
+    assert any('build_task_description' in f['function'] for f in profile['functions'])
+    assert profile['allocations']
+    assert os.path.exists(os.path.join(str(tmpdir), 'job-1.prof'))
+    assert not tracemalloc.is_tracing()
+
+
+def test_only_the_latest_profiles_are_kept():
+    profiles = ProfileStore(max_profiles=2)
+    for profile_id in ('a', 'b', 'c'):
+        with profiles.profile(profile_id):
+            pass
+    assert [p['profile_id'] for p in profiles.list()] == ['b', 'c']
+    assert profiles.get('a') is None
@@ -0,0 +1,193 @@
+from data.registry import DynamoDBRegistry, MongoDBRegistry
+from data.cache import LRUCache
+from fakes import FakeDynamoDBResource, FakeMongoClient, FakeECSClient
+from modules.hypervisor import Hypervisor
+from testdata import SERVICE_DESCRIPTIONS
+import pytest
+import json
+import threading
+import networkx as nx
+
+
+@pytest.fixture
+def ddb_registry():
+    return DynamoDBRegistry(FakeDynamoDBResource())
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 1}
+
+
+def test_data_descriptions_are_cached(ddb_registry):
+    input_hashes = {'SelectLocation': 'h1/'}
+    parameters = {'BiasCorrection': {'thresholds': '1'}}
+    first = ddb_registry.build_data_description_from_task('BiasCorrection', input_hashes, 'h1/h2/', parameters)
+    second = ddb_registry.build_data_description_from_task('BiasCorrection', input_hashes, 'h1/h2/', parameters)
+
+    assert second is first
+    assert first['dataId'] == 'BiasCorrection/h1/h2/'
+    assert first['inputs'] == {'SelectLocation': 's3://climate-ensembling/SelectLocation/h1/'}
+    assert ddb_registry.description_cache.stats()['hits'] == 1
+
+
+def test_batched_data_round_trip():
+    client = FakeDynamoDBResource(unprocessed_per_call=7)
+    registry = DynamoDBRegistry(client)
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation'} for i in range(230)]
+
+    assert registry.put_data_many(descriptions)
+    data_table = client.Table('climate-data-index')
+    assert data_table.calls.count('batch_write_item') == 10
+
+    wanted = [d['dataId'] for d in descriptions[:150]] + ['SelectLocation/missing/']
+    found = registry.get_data_many(wanted)
+    assert set(found) == set(wanted[:150])
+    assert max(client.batch_get_calls) == 100
+    assert 'get_item' not in data_table.calls
+
+
+def register_all(registry):
+    for sdesc in SERVICE_DESCRIPTIONS:
+        with open(sdesc) as f:
+            assert registry.put_service(json.load(f))
+
+
+def test_service_graph_is_loaded_at_startup():
+    client = FakeDynamoDBResource()
+    register_all(DynamoDBRegistry(client))
+
+    restarted = DynamoDBRegistry(client)
+    assert set(restarted.service_graph.edges) == {("SelectLocation", "BiasCorrection"), ("BiasCorrection", "CalculateCost")}
+    assert restarted.service_graph.nodes["CalculateCost"]['service_name'] == "CalculateCost"
+    assert restarted.graph_version == 3
+
+
+def test_warm_start_from_snapshot_and_incremental_refresh(tmp_path):
+    client = FakeDynamoDBResource()
+    snapshot_path = str(tmp_path / "service_graph.json")
+    worker = DynamoDBRegistry(client, snapshot_path=snapshot_path)
+    register_all(worker)
+
+    services_table = client.Table('climate-services-index')
+    services_table.calls.clear()
+    warm = DynamoDBRegistry(client, snapshot_path=snapshot_path)
+    assert 'scan' not in services_table.calls
+    assert set(warm.service_graph.nodes) == set(worker.service_graph.nodes)
+
+    worker.put_service({"service_name": "Report", "inputs": {"CalculateCost": {"type": "ServiceOutput"}}, "parameters": {}})
+    assert worker.graph_version == 4
+    services_table.calls.clear()
+    assert warm.refresh_service_graph()
+    assert not warm.refresh_service_graph()
+    assert 'scan' not in services_table.calls
+    assert ("CalculateCost", "Report") in warm.service_graph.edges
+    assert DynamoDBRegistry(client, snapshot_path=snapshot_path).graph_version == 4
+
+
+def test_graph_indexes_follow_registrations():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {}})
+    registry.put_service({'service_name': 'Downscale', 'inputs': {'SelectLocation': {}}, 'parameters': {}})
+    registry.put_service({'service_name': 'CalculateCost', 'inputs': {'BiasCorrection': {}}, 'parameters': {}})
+    assert registry.get_predecessor_levels('CalculateCost') == {0: {'SelectLocation'}, 1: {'BiasCorrection'}, 2: {'CalculateCost'}}
+
+    # Re-registering with other inputs updates the closures of every service downstream and upstream of it.
+    registry.put_service({'service_name': 'CalculateCost', 'inputs': {'BiasCorrection': {}, 'Downscale': {}}, 'parameters': {}})
+    registry.put_service({'service_name': 'Downscale', 'inputs': {}, 'parameters': {}})
+    graph = registry.service_graph
+    for service in graph.nodes:
+        assert registry.get_ancestors_and_self(service) == nx.ancestors(graph, service) | {service}
+        assert registry.get_descendants_and_self(service) == nx.descendants(graph, service) | {service}
+    assert registry.get_descendants_and_self('SelectLocation') == {'SelectLocation', 'BiasCorrection', 'CalculateCost'}
+    assert registry.get_topological_level('CalculateCost') == 2
+    assert registry.get_topological_level('Downscale') == 0
+    assert registry.get_predecessor_levels('CalculateCost') == {0: {'SelectLocation', 'Downscale'}, 1: {'BiasCorrection'}, 2: {'CalculateCost'}}
+
+
+def test_refreshes_wait_for_graph_readers():
+    client = FakeDynamoDBResource()
+    reader = DynamoDBRegistry(client)
+    register_all(DynamoDBRegistry(client))
+
+    with reader.graph_lock:
+        refresh = threading.Thread(target=reader.refresh_service_graph)
+        refresh.start()
+        refresh.join(timeout=0.1)
+        assert refresh.is_alive()
+        assert reader.service_graph.number_of_nodes() == 0
+    refresh.join()
+    assert reader.get_predecessor_levels('CalculateCost') == {0: {'SelectLocation'}, 1: {'BiasCorrection'}, 2: {'CalculateCost'}}
+
+
+def test_registrations_creating_a_cycle_are_rejected():
+    ddb = FakeDynamoDBResource()
+    registry = DynamoDBRegistry(ddb)
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {}})
+
+    assert not registry.put_service({'service_name': 'SelectLocation', 'inputs': {'BiasCorrection': {}}, 'parameters': {}})
+    assert not registry.put_service({'service_name': 'Loop', 'inputs': {'Loop': {}}, 'parameters': {}})
+    assert list(registry.service_graph.edges) == [('SelectLocation', 'BiasCorrection')]
+    assert ddb.Table('climate-services-index').items['SelectLocation']['inputs'] == {}
+    assert 'Loop' not in ddb.Table('climate-services-index').items
+
+
+def test_mongo_registry_upserts_and_batches():
+    client = FakeMongoClient()
+    registry = MongoDBRegistry(client)
+    data = client['registry'].data
+    assert data.unique_keys == ['dataId']
+    assert client['registry'].services.unique_keys == ['service_name']
+
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation'} for i in range(30)]
+    assert registry.put_data_many(descriptions)
+    assert registry.put_data_many(descriptions[:10])
+    assert registry.put_data(dict(descriptions[0], outputs={'output1': 's3://b/SelectLocation/h0/'}))
+    assert len(data.documents) == 30
+    assert data.calls.count('bulk_write') == 2
+
+    found = registry.get_data_many([d['dataId'] for d in descriptions[:20]] + ['SelectLocation/missing/'])
+    assert set(found) == set(d['dataId'] for d in descriptions[:20])
+    assert '_id' not in found['SelectLocation/h1/']
+    assert registry.get_data('SelectLocation/h0/')['outputs'] == {'output1': 's3://b/SelectLocation/h0/'}
+    assert registry.get_data('SelectLocation/missing/') is None
+
+
+def test_mongo_registry_keeps_the_service_graph():
+    client = FakeMongoClient()
+    registry = MongoDBRegistry(client)
+    register_all(registry)
+    assert registry.put_service(json.loads(json.dumps(registry.get_service('BiasCorrection', {}))))
+    assert not registry.put_service({'service_name': 'SelectLocation', 'inputs': {'CalculateCost': {}}, 'parameters': {}})
+    assert len(client['registry'].services.documents) == 3
+
+    other = MongoDBRegistry(client)
+    assert set(other.service_graph.edges) == {("SelectLocation", "BiasCorrection"), ("BiasCorrection", "CalculateCost")}
+    assert other.graph_version == 4
+
+    registry.put_service({'service_name': 'Downscale', 'inputs': {'SelectLocation': {}}, 'parameters': {}})
+    assert other.refresh_service_graph()
+    assert other.get_ancestors_and_self('Downscale') == {'SelectLocation', 'Downscale'}
+    assert not other.refresh_service_graph()
+
+
+def test_hypervisor_runs_on_mongo_registry():
+    registry = MongoDBRegistry(FakeMongoClient())
+    register_all(registry)
+    hypervisor = Hypervisor(registry=registry, ecs_client=FakeECSClient(), reuse_outputs=True)
+    request = {'target_service': 'CalculateCost',
+               'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Lima']}, 'CalculateCost': {'time_windows': ['week']}}}
+    hypervisor.execute_service(request)
+    assert hypervisor.dispatch_results
+
+    for data_id in list(hypervisor.dispatch_results):
+        hypervisor.notify_completed(data_id)
+    assert set(registry.get_data_many(hypervisor.dispatch_results)) == set(hypervisor.dispatch_results)
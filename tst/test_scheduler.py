@@ -0,0 +1,113 @@
+from modules.hypervisor import Hypervisor
+from modules.scheduler import DAGScheduler, FAILED, PENDING
+from fakes import FakeECSClient
+
+
+def description(data_id):
+    return {'dataId': data_id}
+
+
+def test_tasks_are_released_by_their_own_inputs():
+    dispatched = []
+    scheduler = DAGScheduler(lambda descriptions: dispatched.extend(d['dataId'] for d in descriptions))
+    scheduler.add_task(description('A/1'))
+    scheduler.add_task(description('A/2'))
+    scheduler.add_task(description('B/1'), ['A/1'])
+    scheduler.add_task(description('B/2'), ['A/2'])
+    scheduler.add_task(description('C/1'), ['B/1', 'B/2'])
+    scheduler.start()
+    assert dispatched == ['A/1', 'A/2']
+
+    scheduler.mark_completed('A/1')
+    assert dispatched == ['A/1', 'A/2', 'B/1']
+    scheduler.mark_completed('B/1')
+    scheduler.mark_completed('A/2')
+    assert dispatched[-1] == 'B/2'
+    scheduler.mark_completed('B/2')
+    assert dispatched[-1] == 'C/1'
+    scheduler.mark_completed('C/1')
+    assert scheduler.finished
+
+
+def test_failures_propagate_downstream():
+    scheduler = DAGScheduler(lambda descriptions: ['B/1'] if descriptions[0]['dataId'] == 'B/1' else [])
+    scheduler.add_task(description('A/1'))
+    scheduler.add_task(description('B/1'), ['A/1'])
+    scheduler.add_task(description('C/1'), ['B/1'])
+    scheduler.add_task(description('D/1'))
+    scheduler.start()
+    scheduler.mark_completed('A/1')
+
+    assert scheduler.tasks['B/1'].state == FAILED
+    assert scheduler.tasks['C/1'].state == FAILED
+    assert scheduler.counts()[PENDING] == 0
+    assert not scheduler.finished
+    scheduler.mark_completed('D/1')
+    assert scheduler.finished
+
+
+def test_dag_mode_supports_multi_input_nodes(diamond_registry, ecs_client):
+    hypervisor = Hypervisor(registry=diamond_registry, ecs_client=ecs_client, scheduling='dag')
+    parameters = {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2']},
+                  'Downscale': {'factors': [2, 4, 8]}, 'CalculateCost': {'time_windows': ['today']}}
+    scheduler = hypervisor.execute_service({'target_service': 'CalculateCost', 'parameters': parameters})
+
+    assert len(ecs_client.run_task_calls) == 2
+    cost_task = next(node for data_id, node in scheduler.tasks.items() if data_id.startswith('CalculateCost/'))
+    assert len(scheduler.tasks) == 2 + 4 + 6 + 12
+    assert len(cost_task.upstream) == 2
+    inputs = cost_task.description['inputs']
+    assert set(inputs) == {'SelectLocation', 'BiasCorrection', 'Downscale'}
+    # Both inputs were computed from the same SelectLocation task.
+    select_location = inputs['SelectLocation'].rsplit('/', 2)[-2]
+    assert inputs['BiasCorrection'].split('/')[-3] == select_location
+    assert inputs['Downscale'].split('/')[-3] == select_location
+
+    for data_id in list(scheduler.tasks):
+        if data_id.startswith('SelectLocation/'):
+            hypervisor.notify_completed(data_id)
+    assert len(ecs_client.run_task_calls) == 2 + 4 + 6
+    for data_id in list(scheduler.tasks):
+        if not data_id.startswith('CalculateCost/'):
+            hypervisor.notify_completed(data_id)
+    assert len(ecs_client.run_task_calls) == 24
+    assert not scheduler.finished
+    for data_id in list(scheduler.tasks):
+        hypervisor.notify_completed(data_id)
+    assert scheduler.finished
+    assert len(hypervisor.in_flight) == 0
+
+
+def test_dag_mode_matches_level_data_ids_on_a_chain(diamond_registry):
+    parameters = {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2']}}
+    levels = Hypervisor(registry=diamond_registry, ecs_client=FakeECSClient())
+    levels.execute_service({'target_service': 'BiasCorrection', 'parameters': parameters})
+    dag = Hypervisor(registry=diamond_registry, ecs_client=FakeECSClient(), scheduling='dag')
+    scheduler = dag.execute_service({'target_service': 'BiasCorrection', 'parameters': parameters})
+
+    assert set(scheduler.tasks) == set(levels.dispatch_results)
+    level_commands = sorted(c['overrides']['containerOverrides'][0]['command'] for c in levels.ecs_client.run_task_calls)
+    for data_id in list(scheduler.tasks):
+        dag.notify_completed(data_id)
+    dag_commands = sorted(c['overrides']['containerOverrides'][0]['command'] for c in dag.ecs_client.run_task_calls)
+    assert dag_commands == level_commands
+
+
+def test_level_mode_only_combines_real_ancestors(diamond_registry):
+    parameters = {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}, 'BiasCorrection': {'thresholds': ['1', '2']},
+                  'Downscale': {'factors': [2, 4, 8]}, 'CalculateCost': {'time_windows': ['today'], 'undeclared': ['a', 'b', 'c']}}
+    levels = Hypervisor(registry=diamond_registry, ecs_client=FakeECSClient())
+    levels.execute_service({'target_service': 'CalculateCost', 'parameters': parameters})
+    dag = Hypervisor(registry=diamond_registry, ecs_client=FakeECSClient(), scheduling='dag')
+    scheduler = dag.execute_service({'target_service': 'CalculateCost', 'parameters': parameters})
+
+    # BiasCorrection tasks are not multiplied by Downscale ones, and the undeclared parameter is dropped.
+    assert len(levels.dispatch_results) == 2 + 4 + 6 + 12
+    assert set(levels.dispatch_results) == set(scheduler.tasks)
+
+
+def test_services_without_request_parameters_run_once_per_lineage(diamond_registry, ecs_client):
+    hypervisor = Hypervisor(registry=diamond_registry, ecs_client=ecs_client)
+    hypervisor.execute_service({'target_service': 'BiasCorrection', 'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago']}}})
+
+    assert len(hypervisor.dispatch_results) == 2 + 2
@@ -0,0 +1,107 @@
+from modules.hypervisor import Hypervisor
+from fakes import FakeECSClient
+import time
+
+
+class Waiter:
+    def __init__(self):
+        self.finished = []
+
+    def task_finished(self, data_id, succeeded):
+        self.finished.append((data_id, succeeded))
+
+
+def launch_straggler(**kwargs):
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(ecs_client=ecs_client, speculative=True, **kwargs)
+    for _ in range(10):
+        hypervisor.history.record('SelectLocation', {}, 1.0)
+    waiter = Waiter()
+    description = {'dataId': 'SelectLocation/h1/', 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+    hypervisor.compute_task_descriptions([description], waiters=[waiter])
+    original = ecs_client.launched_arns[0]
+    ecs_client.set_task_state(original, 'RUNNING')
+    hypervisor.tracker.poll()
+    hypervisor.tracker.tasks[original]['startedAt'] -= 60
+    hypervisor.tracker.poll()
+    deadline = time.monotonic() + 1
+    while len(ecs_client.run_task_calls) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return hypervisor, ecs_client, waiter
+
+
+def test_first_copy_to_finish_wins():
+    hypervisor, ecs_client, waiter = launch_straggler()
+    original, copy = ecs_client.launched_arns
+    assert hypervisor.metrics_snapshot()['counters']['tasks_speculated'] == 1
+    # Already speculated, no further copies.
+    assert hypervisor.speculate() == 0
+
+    ecs_client.set_task_state(copy, 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+    assert waiter.finished == [('SelectLocation/h1/', True)]
+    assert [call['task'] for call in ecs_client.stop_task_calls] == [original]
+
+    ecs_client.set_task_state(original, 'STOPPED', exit_code=1)
+    hypervisor.tracker.poll()
+    assert waiter.finished == [('SelectLocation/h1/', True)]
+    assert hypervisor.metrics_snapshot()['counters']['speculative_wins'] == 1
+    assert 'tasks_failed' not in hypervisor.metrics_snapshot()['counters']
+
+
+def test_a_failed_copy_waits_for_the_other():
+    hypervisor, ecs_client, waiter = launch_straggler()
+    original, copy = ecs_client.launched_arns
+
+    ecs_client.set_task_state(original, 'STOPPED', exit_code=1)
+    hypervisor.tracker.poll()
+    assert waiter.finished == []
+
+    ecs_client.set_task_state(copy, 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+    assert waiter.finished == [('SelectLocation/h1/', True)]
+    assert ecs_client.stop_task_calls == []
+
+
+def test_tasks_within_their_usual_runtime_are_left_alone():
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(ecs_client=ecs_client, speculative=True)
+    for _ in range(10):
+        hypervisor.history.record('SelectLocation', {}, 600.0)
+    description = {'dataId': 'SelectLocation/h1/', 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {}, 'parameters': {}}
+    hypervisor.compute_task_descriptions([description])
+    ecs_client.set_task_state(ecs_client.launched_arns[0], 'RUNNING')
+    hypervisor.tracker.poll()
+    assert hypervisor.speculate() == 0
+    assert len(ecs_client.run_task_calls) == 1
+
+
+def test_a_bundle_stopping_after_its_copy_won_does_not_report_it_again():
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(ecs_client=ecs_client, speculative=True, bundle_size=2)
+    for _ in range(10):
+        hypervisor.history.record('SelectLocation', {}, 1.0)
+    waiter = Waiter()
+    descriptions = [{'dataId': 'SelectLocation/h{}/'.format(i), 'service_name': 'SelectLocation', 'inputs': {}, 'outputs': {},
+                     'parameters': {}} for i in (1, 2)]
+    hypervisor.compute_task_descriptions(descriptions, waiters=[waiter])
+    bundle = ecs_client.launched_arns[0]
+    ecs_client.set_task_state(bundle, 'RUNNING')
+    hypervisor.tracker.poll()
+    hypervisor.tracker.tasks[bundle]['startedAt'] -= 60
+    hypervisor.tracker.poll()
+    deadline = time.monotonic() + 1
+    while len(ecs_client.run_task_calls) < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    first_copy, second_copy = ecs_client.launched_arns[1:]
+
+    # The bundle keeps running, the second task in it is still needed.
+    ecs_client.set_task_state(first_copy, 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+    assert ecs_client.stop_task_calls == []
+
+    ecs_client.set_task_state(bundle, 'STOPPED', exit_code=0)
+    hypervisor.tracker.poll()
+    assert sorted(waiter.finished) == [('SelectLocation/h1/', True), ('SelectLocation/h2/', True)]
+    assert hypervisor.metrics_snapshot()['counters']['tasks_completed'] == 2
+    assert [call['task'] for call in ecs_client.stop_task_calls] == [second_copy]
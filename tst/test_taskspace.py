@@ -0,0 +1,60 @@
+from modules.hypervisor import Hypervisor
+from modules.taskspace import TaskSpace
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+import json
+import pytest
+
+
+@pytest.fixture
+def service_request():
+    return {'target_service': 'CalculateCost',
+            'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago', 'Lima']}, 'SelectModel': {'models': ['a', 'b']},
+                           'BiasCorrection': {'thresholds': ['1', '2']}, 'CalculateCost': {'time_windows': ['today', 'week', 'year']}}}
+
+
+def test_task_space_decodes_the_level_expansion(two_root_registry, service_request):
+    hypervisor = Hypervisor(registry=two_root_registry)
+    s_e = hypervisor.build_expanded_service_sets(service_request['parameters'])
+    preds = hypervisor.build_predecessor_level_dict(two_root_registry.service_graph, 'CalculateCost')
+    tasks_by_level = hypervisor.build_tasks_per_level(preds, s_e)
+    space = TaskSpace(preds, s_e, hypervisor.build_lineages(two_root_registry.service_graph, set(two_root_registry.service_graph.nodes)))
+
+    assert space.size == sum(len(tasks) for tasks in tasks_by_level.values())
+    for level, tasks in tasks_by_level.items():
+        assert space.level_size(level) == len(tasks)
+        assert [space.task_set(level, i) for i in range(len(tasks))] == tasks
+        assert list(space.iter_range(level, 1, len(tasks) - 1)) == tasks[1:-1]
+
+
+def test_shards_dispatch_the_same_data_ids(two_root_registry, service_request):
+    whole = Hypervisor(registry=two_root_registry, ecs_client=FakeECSClient())
+    whole.execute_service(service_request)
+
+    shard_requests = Hypervisor(registry=two_root_registry).plan_shards(service_request, 4)
+    dispatched = []
+    for shard_request in shard_requests:
+        # Shard requests are sent to other nodes as JSON.
+        node = Hypervisor(registry=two_root_registry, ecs_client=FakeECSClient(), streaming=True, chunk_size=3)
+        node.execute_service(json.loads(json.dumps(shard_request)))
+        assert node.dispatch_results
+        dispatched.extend(node.dispatch_results)
+
+    assert [r['shard']['index'] for r in shard_requests] == [0, 1, 2, 3]
+    assert len(dispatched) == len(set(dispatched))
+    assert set(dispatched) == set(whole.dispatch_results)
+
+
+def test_task_set_indexes_do_not_depend_on_parameter_order():
+    spaces = []
+    for parameters in ({'models': {}, 'members': {}}, {'members': {}, 'models': {}}):
+        registry = DynamoDBRegistry(FakeDynamoDBResource())
+        registry.put_service({'service_name': 'SelectModel', 'inputs': {}, 'parameters': parameters})
+        hypervisor = Hypervisor(registry=registry)
+        request_parameters = {'SelectModel': {'members': ['r1', 'r2'], 'models': ['a', 'b', 'c']}}
+        s_e = hypervisor.build_expanded_service_sets(hypervisor.prune_parameters('SelectModel', request_parameters))
+        preds = hypervisor.build_predecessor_level_dict(registry.service_graph, 'SelectModel')
+        space = TaskSpace(preds, s_e, hypervisor.build_lineages(registry.service_graph, {'SelectModel'}))
+        spaces.append([space.task_set(0, i)[0]['hash'] for i in range(space.level_size(0))])
+
+    assert spaces[0] == spaces[1]
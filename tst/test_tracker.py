@@ -0,0 +1,85 @@
+from modules.hypervisor import Hypervisor
+from modules.tracker import CompletionTracker, STOPPED
+from data.registry import DynamoDBRegistry
+from fakes import FakeDynamoDBResource, FakeECSClient
+import time
+
+
+def test_tracker_polls_in_batches_and_backs_off():
+    ecs_client = FakeECSClient()
+    stopped = []
+    tracker = CompletionTracker(ecs_client, "HypervisorCluster", on_stopped=lambda arn, task: stopped.append((arn, task['exitCode'])),
+                                min_interval=1, max_interval=8)
+    for i in range(250):
+        tracker.track("arn/{}".format(i), ["Service/h{}/".format(i)])
+
+    assert tracker.poll() == 250
+    assert [len(c) for c in ecs_client.describe_tasks_calls] == [100, 100, 50]
+    assert tracker.poll() == 0
+    assert tracker.interval == 1.5
+
+    ecs_client.set_task_state("arn/3", STOPPED, exit_code=0)
+    ecs_client.set_task_state("arn/7", STOPPED, exit_code=2)
+    ecs_client.set_task_state("arn/9", "RUNNING")
+    assert tracker.poll() == 3
+    assert tracker.interval == 1
+    assert sorted(stopped) == [("arn/3", 0), ("arn/7", 2)]
+    assert tracker.status_of("Service/h7/")['exitCode'] == 2
+    assert tracker.status_of("Service/h9/")['status'] == "RUNNING"
+    assert tracker.active_count == 248
+
+    ecs_client.describe_tasks_calls.clear()
+    tracker.poll()
+    assert sum(len(c) for c in ecs_client.describe_tasks_calls) == 248
+
+
+def test_only_the_latest_stopped_tasks_are_kept():
+    tracker = CompletionTracker(FakeECSClient(), "HypervisorCluster", max_stopped=2)
+    for i in range(4):
+        tracker.track("arn/{}".format(i), ["Service/h{}/".format(i)], poll=False)
+    tracker.report_stopped("arn/0", 0)
+    tracker.report_stopped("arn/1", 0)
+    tracker.report_stopped("arn/2", 1)
+
+    assert set(tracker.tasks) == {"arn/1", "arn/2", "arn/3"}
+    assert tracker.status_of("Service/h0/") is None
+    assert tracker.status_of("Service/h2/")['exitCode'] == 1
+    assert tracker.status_of("Service/h3/")['status'] == "PENDING"
+
+
+def test_completions_reach_the_scheduler_and_registry():
+    registry = DynamoDBRegistry(FakeDynamoDBResource())
+    registry.put_service({'service_name': 'SelectLocation', 'inputs': {}, 'parameters': {'locations': {}}})
+    registry.put_service({'service_name': 'BiasCorrection', 'inputs': {'SelectLocation': {}}, 'parameters': {'thresholds': {}}})
+    ecs_client = FakeECSClient()
+    hypervisor = Hypervisor(registry=registry, ecs_client=ecs_client, scheduling='dag', reuse_outputs=True)
+    hypervisor.tracker.min_interval = hypervisor.tracker.interval = 0.01
+    hypervisor.start_completion_tracking()
+    try:
+        parameters = {'SelectLocation': {'locations': ['Dhaka']}, 'BiasCorrection': {'thresholds': ['1', '2']}}
+        hypervisor.execute_service({'target_service': 'BiasCorrection', 'parameters': parameters})
+        assert len(ecs_client.run_task_calls) == 1
+
+        ecs_client.set_task_state(ecs_client.launched_arns[0], STOPPED, exit_code=0)
+        deadline = time.monotonic() + 5
+        while len(ecs_client.run_task_calls) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert len(ecs_client.run_task_calls) == 3
+        assert hypervisor._is_service_completed(ecs_client.launched_arns[0])
+        assert len(registry.get_data_many(hypervisor.tracker.task_by_data_id)) == 1
+    finally:
+        hypervisor.tracker.stop()
+
+
+def test_outputs_stopped_in_one_poll_are_registered_in_one_batch(chain_registry, ecs_client):
+    hypervisor = Hypervisor(registry=chain_registry, ecs_client=ecs_client, reuse_outputs=True)
+    hypervisor.execute_service({'target_service': 'SelectLocation', 'parameters': {'SelectLocation': {'locations': ['Dhaka', 'Chicago', 'Lima']}}})
+    for arn in ecs_client.launched_arns:
+        ecs_client.set_task_state(arn, STOPPED, exit_code=0)
+    data_table = chain_registry.client.Table('climate-data-index')
+    data_table.calls.clear()
+    hypervisor.tracker.poll()
+
+    assert data_table.calls == ['batch_write_item']
+    assert len(chain_registry.get_data_many(hypervisor.dispatch_results)) == 3
+    assert not hypervisor.pending_outputs